@@ -0,0 +1,196 @@
+"""Бенчмарк поиска по коллекциям базы знаний: фильтрованный против глобального (только Postgres).
+
+В отдельной схеме засеваются --chunks чанков в --collections коллекциях.
+Векторы сгруппированы вокруг --topics общих тем, и коллекции делят темы
+между собой, как документация разных продуктов про «оплату» или «доставку».
+Для запросов к случайной коллекции сравниваются:
+- global          — текущий поиск по всем чанкам (глобальный HNSW-индекс);
+- global_postfilter — глобальный поиск --candidates кандидатов и фильтр по коллекции на клиенте;
+- filtered        — search_chunks(collection=...) по частичному HNSW-индексу коллекции;
+- exact_filtered  — точный поиск внутри коллекции без индексов (эталон для recall).
+
+Для каждого режима печатаются p50/p95 задержки, recall@k относительно
+эталона и доля найденных чанков из чужих коллекций.
+
+    python -m benchmarks.bench_collections --database-url postgresql://... --chunks 50000
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.orm import sessionmaker
+
+from src.db import Base, Document, DocumentChunk, EMBEDDING_DIM
+from src.knowledge_bases import create_collection_index
+from src.read_models import search_chunks
+
+SCHEMA = "bench_collections"
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def _seed(factory, args: argparse.Namespace, rng: np.random.Generator) -> tuple[list[str], np.ndarray]:
+    collections = [f"c{index:02d}" for index in range(args.collections)]
+    topics = _unit(rng.standard_normal((args.topics, EMBEDDING_DIM)).astype(np.float32))
+
+    with factory() as db:
+        documents = {}
+        for collection in collections:
+            document = Document(title=f"bench {collection}", source="bench", collection=collection)
+            db.add(document)
+            db.flush()
+            documents[collection] = document.id
+
+        for start in range(0, args.chunks, args.batch):
+            size = min(args.batch, args.chunks - start)
+            noise = rng.standard_normal((size, EMBEDDING_DIM)).astype(np.float32) * args.noise
+            vectors = _unit(topics[rng.integers(0, args.topics, size)] + noise)
+            owners = rng.integers(0, args.collections, size)
+            db.execute(
+                insert(DocumentChunk),
+                [
+                    {
+                        "document_id": documents[collections[owner]],
+                        "collection": collections[owner],
+                        "chunk_index": start + offset,
+                        "text": f"chunk {start + offset}",
+                        "embedding": vectors[offset],
+                    }
+                    for offset, owner in enumerate(owners)
+                ],
+            )
+        db.commit()
+    return collections, topics
+
+
+def _run_queries(factory, queries, limit: int, search) -> dict:
+    latencies = []
+    results = []
+    with factory() as db:
+        for collection, vector in queries:
+            started = time.perf_counter()
+            hits = search(db, collection, vector)
+            latencies.append((time.perf_counter() - started) * 1000)
+            results.append(hits[:limit])
+    return {"latencies": latencies, "results": results}
+
+
+def _summary(run: dict, truth: list, queries: list, owners: dict, limit: int) -> dict:
+    recalls = []
+    foreign = 0
+    returned = 0
+    for hits, expected, (collection, _) in zip(run["results"], truth, queries):
+        expected_ids = {hit.id for hit in expected}
+        recalls.append(len(expected_ids & {hit.id for hit in hits}) / max(1, len(expected_ids)))
+        foreign += sum(1 for hit in hits if owners[hit.id] != collection)
+        returned += len(hits)
+    return {
+        "p50_ms": round(statistics.median(run["latencies"]), 3),
+        "p95_ms": round(_percentile(run["latencies"], 0.95), 3),
+        f"recall_at_{limit}": round(statistics.fmean(recalls), 4),
+        "avg_hits": round(returned / len(queries), 2),
+        "foreign_share": round(foreign / max(1, returned), 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--chunks", type=int, default=50_000)
+    parser.add_argument("--collections", type=int, default=10)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--noise", type=float, default=0.03, help="разброс чанков вокруг темы")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=40, help="кандидатов для global_postfilter")
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not args.database_url.startswith("postgresql"):
+        parser.error("HNSW indexes are Postgres-only: pass a postgresql:// URL")
+
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+
+    admin = create_engine(args.database_url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    options = f"-csearch_path={SCHEMA},public -chnsw.ef_search={args.ef_search}"
+    engine = create_engine(args.database_url, connect_args={"options": options})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    result = {"chunks": args.chunks, "collections": args.collections}
+    started = time.perf_counter()
+    collections, topics = _seed(factory, args, rng)
+    result["seed_seconds"] = round(time.perf_counter() - started, 3)
+    with factory() as db:
+        owners = dict(db.execute(select(DocumentChunk.id, DocumentChunk.collection)).all())
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        started = time.perf_counter()
+        conn.execute(text("CREATE INDEX ix_document_chunks_embedding_hnsw ON document_chunks USING hnsw (embedding vector_l2_ops)"))
+        result["global_index_seconds"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    for collection in collections:
+        create_collection_index(engine, collection)
+    result["collection_indexes_seconds"] = round(time.perf_counter() - started, 3)
+    with admin.connect() as conn:
+        conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+        conn.execute(text("VACUUM ANALYZE document_chunks"))
+
+    queries = []
+    for _ in range(args.queries):
+        topic = topics[rng.integers(0, args.topics)]
+        vector = _unit(topic + rng.standard_normal(EMBEDDING_DIM).astype(np.float32) * args.noise)
+        queries.append((random.choice(collections), vector))
+
+    def global_search(db, collection, vector):
+        return search_chunks(db, vector, args.limit)
+
+    def global_postfilter(db, collection, vector):
+        return [hit for hit in search_chunks(db, vector, args.candidates) if owners[hit.id] == collection]
+
+    def filtered(db, collection, vector):
+        return search_chunks(db, vector, args.limit, collection=collection)
+
+    def exact_filtered(db, collection, vector):
+        db.execute(text("SET LOCAL enable_indexscan = off"))
+        return search_chunks(db, vector, args.limit, collection=collection)
+
+    modes = {
+        "exact_filtered": exact_filtered,
+        "global": global_search,
+        "global_postfilter": global_postfilter,
+        "filtered": filtered,
+    }
+    runs = {name: _run_queries(factory, queries, args.limit, search) for name, search in modes.items()}
+    truth = runs["exact_filtered"]["results"]
+    result["modes"] = {name: _summary(run, truth, queries, owners, args.limit) for name, run in runs.items()}
+
+    engine.dispose()
+    with admin.connect() as conn:
+        conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    admin.dispose()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Сквозной нагрузочный бенчмарк: реплей корпуса сообщений через бота целиком.
+
+Апдейты подаются в настоящий aiogram Dispatcher из src.bot, дальше работают
+LLMService/ConversationService и БД. Telegram Bot API заменён сессией-заглушкой
+(ответы бота не уходят в сеть), OpenAI — локальным src.openai_stub.
+
+Корпус — JSONL, по сообщению на строку: {"user_id": 1, "text": "...", "delay_ms": 800}.
+user_id и delay_ms необязательны; вместо text подойдут поля body/title, так что
+реплеить можно и файлы в формате requests.jsonl. Сообщения одного user_id
+образуют диалог; --users виртуальных пользователей разбирают эти диалоги по
+кругу и ведут их параллельно, каждый ждёт ответа перед следующим сообщением.
+Паузы между сообщениями — delay_ms из корпуса или --think-time-ms
+(фиксированные или экспоненциальные, --arrival).
+
+    python -m benchmarks.bench_e2e --corpus benchmarks/replay_sample.jsonl --users 50 \\
+        --stub-latency-ms 400 --output results/e2e.json --baseline results/e2e-main.json
+
+Без --database-url используется SQLite-файл, и поиск по базе знаний
+(pgvector) пропускается; с Postgres работает весь конвейер, включая RAG.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+STAGES = (
+    "add_user_message",
+    "get_history",
+    "retrieval",
+    "remaining_budget",
+    "completion",
+    "add_assistant_message",
+    "telegram_send",
+    "handler_total",
+)
+
+
+def load_corpus(path: str) -> Dict[str, List[dict]]:
+    """Диалоги корпуса: user_id → список {"text", "delay_ms"} в исходном порядке."""
+    dialogues: Dict[str, List[dict]] = defaultdict(list)
+    with open(path, encoding="utf-8") as corpus:
+        for number, line in enumerate(corpus):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            text = record.get("text") or record.get("body") or record.get("title")
+            if not text:
+                continue
+            user = str(record.get("user_id", number))
+            dialogues[user].append({"text": text, "delay_ms": record.get("delay_ms")})
+    return dict(dialogues)
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage: str, func):
+        """Обёртка, засекающая время вызова func; поведение не меняется."""
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        return timed
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for stage in STAGES:
+            values = self.samples.get(stage)
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+            result[stage] = {
+                "count": len(values),
+                "mean_ms": round(float(np.mean(values)) * 1000, 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+            }
+        return result
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(result: dict, baseline: dict) -> dict:
+    """Отношения ключевых показателей к прошлому прогону (>1 у задержек — хуже)."""
+    comparison = {
+        "baseline_commit": baseline.get("commit"),
+        "throughput_ratio": round(result["throughput_msg_per_sec"] / baseline["throughput_msg_per_sec"], 3)
+        if baseline.get("throughput_msg_per_sec")
+        else None,
+        "p95_ratio": {},
+    }
+    for stage, summary in result["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if previous and previous["p95_ms"]:
+            comparison["p95_ratio"][stage] = round(summary["p95_ms"] / previous["p95_ms"], 3)
+    return comparison
+
+
+async def _replay(args: argparse.Namespace, dialogues: Dict[str, List[dict]], timer: StageTimer) -> dict:
+    from aiogram import Bot, types
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from sqlalchemy import event
+
+    from src import bot as bot_module
+    from src import llm_service as llm_module
+    from src.db import Base, engine, init_db
+
+    # src.bot включает INFO-логи на каждый апдейт и запрос к OpenAI
+    logging.getLogger().setLevel(args.log_level)
+
+    class StubTelegramSession(BaseSession):
+        """Вместо Bot API: отвечает на sendMessage готовым объектом Message."""
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.sent = 0
+            self._message_id = 0
+
+        async def make_request(self, bot, method, timeout=None):  # noqa: ARG002 - сигнатура BaseSession
+            started = time.perf_counter()
+            if not isinstance(method, SendMessage):
+                return True
+            self.sent += 1
+            self._message_id += 1
+            result = types.Message(
+                message_id=self._message_id,
+                date=datetime.now(timezone.utc),
+                chat=types.Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            )
+            timer.record("telegram_send", time.perf_counter() - started)
+            return result
+
+        async def stream_content(self, *args, **kwargs):  # noqa: ARG002 - файлы в бенчмарке не скачиваются
+            raise NotImplementedError
+
+        async def close(self) -> None:
+            return None
+
+    if engine.dialect.name == "postgresql":
+        init_db()
+    else:
+        Base.metadata.create_all(bind=engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *event_args: statements.append(1))
+
+    bot_module._build_services()
+    conversation = bot_module.conversation_service
+    for method in ("add_user_message", "get_history", "add_assistant_message"):
+        setattr(conversation, method, timer.wrap(method, getattr(conversation, method)))
+    # LLMService читает историю вместе с коллекцией пользователя
+    conversation.get_dialogue = timer.wrap("get_history", conversation.get_dialogue)
+    conversation.get_remaining_daily_tokens = timer.wrap("remaining_budget", conversation.get_remaining_daily_tokens)
+    llm_module.retrieve_passages = timer.wrap("retrieval", llm_module.retrieve_passages)
+    llm_module.generate_completion = timer.wrap("completion", llm_module.generate_completion)
+
+    session = StubTelegramSession()
+    bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"], session=session)
+    rng = random.Random(args.seed)
+    update_ids = iter(range(1, 10**9))
+    errors = []
+    handled = 0
+
+    scripts = list(dialogues.values())
+
+    def pause(delay_ms: float | None) -> float:
+        if delay_ms is not None and not args.ignore_corpus_delays:
+            return delay_ms / 1000 / args.speed
+        if args.think_time_ms <= 0:
+            return 0.0
+        mean = args.think_time_ms / 1000
+        return rng.expovariate(1 / mean) if args.arrival == "exponential" else mean
+
+    async def virtual_user(index: int) -> None:
+        nonlocal handled
+        script = scripts[index % len(scripts)]
+        user = types.User(id=100_000 + index, is_bot=False, first_name=f"Load{index}", username=f"load{index}")
+        chat = types.Chat(id=user.id, type="private")
+        # Разнесённый старт, чтобы пользователи не приходили одной волной
+        await asyncio.sleep(rng.uniform(0, args.ramp_up_seconds))
+        for _ in range(args.repeat):
+            for step in script:
+                await asyncio.sleep(pause(step["delay_ms"]))
+                update = types.Update(
+                    update_id=next(update_ids),
+                    message=types.Message(
+                        message_id=next(update_ids),
+                        date=datetime.now(timezone.utc),
+                        chat=chat,
+                        from_user=user,
+                        text=step["text"],
+                    ),
+                )
+                started = time.perf_counter()
+                try:
+                    await bot_module.dp.feed_update(bot, update)
+                    handled += 1
+                except Exception as exc:  # noqa: BLE001 - ошибка учитывается, реплей продолжается
+                    errors.append(repr(exc))
+                timer.record("handler_total", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(index) for index in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    conversation.close()
+    if bot_module.send_queue is not None:
+        await bot_module.send_queue.close()
+    await bot.session.close()
+
+    return {
+        "messages": handled,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "telegram_sends": session.sent,
+        "seconds": round(elapsed, 3),
+        "throughput_msg_per_sec": round(handled / elapsed, 2) if elapsed else 0.0,
+        "db_statements_per_message": round(len(statements) / handled, 2) if handled else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=str(Path(__file__).with_name("replay_sample.jsonl")))
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1, help="сколько раз каждый пользователь проходит свой диалог")
+    parser.add_argument("--think-time-ms", type=float, default=0.0)
+    parser.add_argument("--arrival", choices=("fixed", "exponential"), default="exponential")
+    parser.add_argument("--ignore-corpus-delays", action="store_true")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение пауз delay_ms из корпуса")
+    parser.add_argument("--ramp-up-seconds", type=float, default=0.0)
+    parser.add_argument("--database-url")
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--stub-latency-ms", type=float, default=300.0)
+    parser.add_argument("--stub-latency-distribution", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--stub-latency-spread", type=float, default=0.4)
+    parser.add_argument("--stub-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--stub-error-rate-429", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    dialogues = load_corpus(args.corpus)
+    if not dialogues:
+        parser.error(f"Corpus {args.corpus} has no messages")
+    started_at = datetime.now(timezone.utc).isoformat()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Модули src читают окружение при импорте, поэтому оно задаётся до них
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmp, 'e2e.db')}"
+        os.environ["MESSAGE_WRITE_BEHIND"] = "1" if args.write_behind else "0"
+        os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:replay-benchmark")
+        if not os.environ["DATABASE_URL"].startswith("postgresql"):
+            # pgvector недоступен: гейт RAG пропускает все запросы
+            os.environ["RAG_MIN_QUERY_CHARS"] = str(10**9)
+
+        from src.openai_stub import LatencyModel, StubConfig, StubServer
+
+        stub = StubServer(
+            StubConfig(
+                latency=LatencyModel(args.stub_latency_distribution, args.stub_latency_ms, args.stub_latency_spread),
+                tokens_per_second=args.stub_tokens_per_second,
+                error_rate_429=args.stub_error_rate_429,
+                seed=args.seed,
+            )
+        ).start()
+        os.environ["OPENAI_BASE_URL"] = stub.base_url
+        os.environ["OPENAI_API_KEY"] = "stub"
+
+        timer = StageTimer()
+        try:
+            run = asyncio.run(_replay(args, dialogues, timer))
+        finally:
+            stub.stop()
+
+    result = {
+        "commit": _git_commit(),
+        "started_at": started_at,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "log_level")},
+        **run,
+        "stages": timer.summary(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "openai_stub": stub.stub.stats.snapshot(),
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            result["comparison"] = _compare(result, json.load(baseline))
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
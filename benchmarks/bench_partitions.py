@@ -0,0 +1,173 @@
+"""Бенчмарк таблицы messages: обычная против помесячно секционированной (только Postgres).
+
+Для каждого варианта в отдельной схеме засевается большой набор сообщений
+за последние --months месяцев, затем замеряются:
+- вставка новых сообщений пакетами;
+- обрезка истории до 30 сообщений (trim_messages_for_users) для выборки пользователей;
+- дневная статистика пользователя (get_daily_tokens);
+- retention: DELETE старых строк + VACUUM против DETACH/DROP секций;
+- размер таблицы до и после retention.
+
+    python -m benchmarks.bench_partitions --database-url postgresql://... --rows 2000000
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from src.db import Base, Message, trim_messages_for_users
+from src.partitions import add_months, apply_retention, create_partitioned_messages, ensure_partitions, month_start
+from src.token_counter import get_daily_tokens
+
+_TABLE_SIZE_SQL = """
+SELECT coalesce(sum(pg_total_relation_size(relid)), 0)
+FROM pg_partition_tree(to_regclass('messages'))
+"""
+
+
+def _timed(action) -> float:
+    started = time.perf_counter()
+    action()
+    return round(time.perf_counter() - started, 3)
+
+
+def _table_size_mb(conn) -> float:
+    return round(conn.execute(text(_TABLE_SIZE_SQL)).scalar() / 1024 / 1024, 1)
+
+
+def _run_mode(args: argparse.Namespace, partitioned: bool) -> dict:
+    schema = "bench_messages_partitioned" if partitioned else "bench_messages_plain"
+    admin = create_engine(args.database_url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+
+    engine = create_engine(args.database_url, connect_args={"options": f"-csearch_path={schema},public"})
+    today = datetime.now(timezone.utc).date()
+    first_month = add_months(month_start(today), -args.months)
+
+    with engine.begin() as conn:
+        if partitioned:
+            Base.metadata.create_all(
+                bind=conn,
+                tables=[table for table in Base.metadata.sorted_tables if table.name != Message.__tablename__],
+            )
+            create_partitioned_messages(conn)
+            ensure_partitions(conn, start=first_month)
+        else:
+            Base.metadata.create_all(bind=conn)
+
+    result = {}
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (telegram_id, created_at) "
+                "SELECT g, now() FROM generate_series(1, :users) AS g"
+            ),
+            {"users": args.users},
+        )
+        started = time.perf_counter()
+        conn.execute(
+            text(
+                "INSERT INTO messages (user_id, role, content, token_count, created_at) "
+                "SELECT 1 + g % :users, CASE WHEN g % 2 = 0 THEN 'user' ELSE 'assistant' END, "
+                "repeat('lorem ipsum ', 20), 60, "
+                "(now() AT TIME ZONE 'utc') - random() * (now() - CAST(:first_month AS date)) "
+                "FROM generate_series(1, :rows) AS g"
+            ),
+            {"users": args.users, "rows": args.rows, "first_month": first_month},
+        )
+        result["seed_seconds"] = round(time.perf_counter() - started, 3)
+    with admin.connect() as conn:
+        conn.execute(text(f"SET search_path TO {schema}, public"))
+        conn.execute(text("VACUUM ANALYZE"))
+        result["size_mb"] = _table_size_mb(conn)
+
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    batch = [
+        {
+            "user_id": random.randint(1, args.users),
+            "role": "user",
+            "content": "new message",
+            "token_count": 3,
+            "created_at": datetime.now(timezone.utc),
+        }
+        for _ in range(args.insert_batch)
+    ]
+
+    def insert_batches() -> None:
+        for _ in range(args.insert_batches):
+            with factory() as db:
+                db.execute(insert(Message), batch)
+                db.commit()
+
+    insert_seconds = _timed(insert_batches)
+    result["insert_rows_per_sec"] = round(args.insert_batch * args.insert_batches / insert_seconds, 1)
+
+    sample = random.sample(range(1, args.users + 1), min(args.sample_users, args.users))
+
+    def daily_stats() -> None:
+        with factory() as db:
+            for user_id in sample:
+                get_daily_tokens(db, user_id)
+
+    result["daily_stats_ms_per_user"] = round(_timed(daily_stats) * 1000 / len(sample), 3)
+
+    def trim() -> None:
+        with factory() as db:
+            trim_messages_for_users(db, sample)
+            db.commit()
+
+    result["trim_seconds"] = _timed(trim)
+
+    def retention() -> None:
+        if partitioned:
+            apply_retention(engine, retention_months=args.retention_months, archive_dir=args.archive_dir, today=today)
+            return
+        cutoff = add_months(month_start(today), -args.retention_months)
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM messages WHERE created_at < :cutoff"), {"cutoff": cutoff})
+
+    result["retention_seconds"] = _timed(retention)
+    with admin.connect() as conn:
+        conn.execute(text(f"SET search_path TO {schema}, public"))
+        result["vacuum_seconds"] = _timed(lambda: conn.execute(text("VACUUM messages")))
+        result["size_after_retention_mb"] = _table_size_mb(conn)
+        conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+
+    engine.dispose()
+    admin.dispose()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--retention-months", type=int, default=6)
+    parser.add_argument("--insert-batch", type=int, default=500)
+    parser.add_argument("--insert-batches", type=int, default=20)
+    parser.add_argument("--sample-users", type=int, default=200)
+    parser.add_argument("--archive-dir")
+    args = parser.parse_args()
+
+    if not args.database_url.startswith("postgresql"):
+        parser.error("Partitioning is Postgres-only: pass a postgresql:// URL")
+
+    result = {
+        "plain": _run_mode(args, partitioned=False),
+        "partitioned": _run_mode(args, partitioned=True),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Сравнение расхода токенов RAG-контекста: top-3 против MMR + склейки + бюджета.
+
+Эмбеддинги считаются локально (хэширование слов и символьных триграмм),
+поиск — точный L2 в numpy, поэтому ни OpenAI, ни Postgres не нужны.
+Запросы реплея — строки из --queries (по одной на строку) или случайные
+фрагменты предложений корпуса.
+
+Раздел prompt_cache прогоняет запросы реплея как один длинный диалог и
+сравнивает, какая часть промпта совпадает с промптом прошлого хода (и может
+прийти из prompt cache OpenAI) при скользящем окне истории и при окне,
+сдвигаемом блоками (src.llm_service.window_history).
+
+    python -m benchmarks.bench_rag_tokens --corpus "docs/**/*.txt" --queries replay.txt
+"""
+
+import argparse
+import glob
+import json
+import random
+import statistics
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from src import rag
+from src.db import MAX_MESSAGES_PER_USER
+from src.llm_service import build_prompt, window_history
+from src.openai_stub import hash_embedding
+from src.read_models import ChunkHit, HistoryEntry
+from src.rerank import fill_token_budget, mmr_order
+from src.token_counter import count_tokens
+
+
+DIM = 256
+SEPARATOR = "\n\n---\n\n"
+# OpenAI кэширует префиксы от 1024 токенов с шагом 128
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+
+TOPICS = [
+    "оплата заказа картой и возврат средств",
+    "доставка курьером и самовывоз из пункта выдачи",
+    "смена пароля и восстановление доступа к аккаунту",
+    "подключение тарифа и управление подпиской",
+    "гарантийный ремонт и сервисные центры",
+]
+
+
+def _hash_embedding(text: str) -> np.ndarray:
+    return hash_embedding(text, DIM)
+
+
+def _synthetic_corpus(documents: int, rng: random.Random) -> List[str]:
+    texts = []
+    for doc in range(documents):
+        topic = TOPICS[doc % len(TOPICS)]
+        sentences = [
+            f"Раздел {doc}.{i}: {topic}. Шаг {i} описывает, что делать пользователю, "
+            f"если {rng.choice(['не пришло письмо', 'операция отклонена', 'истёк срок', 'нужна справка'])}."
+            for i in range(rng.randint(20, 40))
+        ]
+        texts.append(" ".join(sentences))
+    return texts
+
+
+def _load_corpus(pattern: str | None, rng: random.Random) -> List[str]:
+    if not pattern:
+        return _synthetic_corpus(40, rng)
+    return [Path(path).read_text(encoding="utf-8") for path in sorted(glob.glob(pattern, recursive=True))]
+
+
+def _sample_queries(texts: List[str], count: int, rng: random.Random) -> List[str]:
+    queries = []
+    for _ in range(count):
+        words = rng.choice(texts).split()
+        start = rng.randrange(max(len(words) - 8, 1))
+        queries.append(" ".join(words[start : start + 8]))
+    return queries
+
+
+def _cached_tokens(previous: List[dict], current: List[dict]) -> int:
+    """Сколько токенов общего префикса двух промптов (по целым сообщениям) попадёт в кэш."""
+    shared = 0
+    for before, after in zip(previous, current):
+        if before != after:
+            break
+        shared += count_tokens(after["content"])
+    return 0 if shared < CACHE_MIN_TOKENS else shared // CACHE_STEP_TOKENS * CACHE_STEP_TOKENS
+
+
+def _prompt_cache(replay: List[str], contexts: List[str]) -> dict:
+    modes = {}
+    for mode in ("sliding", "blocks"):
+        stored: List[HistoryEntry] = []
+        anchor = None
+        previous: List[dict] = []
+        prompt_tokens, cached_tokens = [], []
+        for turn, (query, context) in enumerate(zip(replay, contexts)):
+            # История в БД ограничена MAX_MESSAGES_PER_USER, как при обрезке на записи
+            stored = (stored + [HistoryEntry("user", query, id=2 * turn)])[-MAX_MESSAGES_PER_USER:]
+            if mode == "blocks":
+                history = window_history(stored, anchor)
+                anchor = history[0].id
+            else:
+                history = stored
+            prompt = build_prompt(history, context, query)
+            prompt_tokens.append(sum(count_tokens(message["content"]) for message in prompt))
+            cached_tokens.append(_cached_tokens(previous, prompt))
+            previous = prompt
+            stored.append(HistoryEntry("assistant", f"Ответ {turn}: " + context[:400], id=2 * turn + 1))
+        modes[mode] = {
+            "avg_prompt_tokens": round(statistics.mean(prompt_tokens), 1),
+            "avg_cached_tokens": round(statistics.mean(cached_tokens), 1),
+            "cached_share": round(sum(cached_tokens) / max(1, sum(prompt_tokens)), 4),
+        }
+    return modes
+
+
+def run(pattern: str | None, queries_path: str | None, queries: int, limit: int, candidates: int, budget: int) -> dict:
+    rng = random.Random(7)
+    texts = _load_corpus(pattern, rng)
+
+    hits: List[ChunkHit] = []
+    for document_id, text in enumerate(texts):
+        for index, chunk in enumerate(rag._split_text(text)):
+            hits.append(ChunkHit(len(hits), document_id, index, chunk, 0.0, _hash_embedding(chunk)))
+    if not hits:
+        raise SystemExit("Corpus is empty")
+    matrix = np.stack([hit.embedding for hit in hits])
+
+    if queries_path:
+        replay = [line.strip() for line in Path(queries_path).read_text(encoding="utf-8").splitlines() if line.strip()]
+    else:
+        replay = _sample_queries(texts, queries, rng)
+
+    before_tokens, after_tokens, after_chunks = [], [], []
+    contexts = []
+    for query in replay:
+        query_vec = _hash_embedding(query)
+        nearest = np.argsort(np.linalg.norm(matrix - query_vec, axis=1))
+
+        top = [hits[i] for i in nearest[:limit]]
+        before_tokens.append(count_tokens(SEPARATOR.join(hit.text for hit in top)))
+
+        pool = [hits[i] for i in nearest[:candidates]]
+        order = mmr_order(query_vec, [hit.embedding for hit in pool], lambda_mult=rag.RAG_MMR_LAMBDA)
+        passages = fill_token_budget([pool[i] for i in order], budget, count_tokens, max_overlap=rag.CHUNK_OVERLAP)
+        contexts.append(SEPARATOR.join(p.text for p in passages))
+        after_tokens.append(count_tokens(contexts[-1]))
+        after_chunks.append(sum(p.last_chunk - p.first_chunk + 1 for p in passages))
+
+    return {
+        "documents": len(texts),
+        "chunks": len(hits),
+        "queries": len(replay),
+        "before": {"strategy": f"top-{limit}", "avg_rag_tokens": round(statistics.mean(before_tokens), 1)},
+        "after": {
+            "strategy": f"mmr(candidates={candidates}) + merge + budget={budget}",
+            "avg_rag_tokens": round(statistics.mean(after_tokens), 1),
+            "avg_chunks_covered": round(statistics.mean(after_chunks), 2),
+        },
+        "prompt_cache": _prompt_cache(replay, contexts),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="glob с текстовыми файлами; по умолчанию синтетический корпус")
+    parser.add_argument("--queries", help="файл с запросами, по одному на строку")
+    parser.add_argument("--samples", type=int, default=200, help="сколько запросов сгенерировать без --queries")
+    parser.add_argument("--limit", type=int, default=3)
+    parser.add_argument("--candidates", type=int, default=rag.RAG_CANDIDATES)
+    parser.add_argument("--budget", type=int, default=rag.RAG_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    result = run(args.corpus, args.queries, args.samples, args.limit, args.candidates, args.budget)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Бенчмарк горячих read-путей: полные ORM-объекты против колоночных проекций.
+
+Сравнивает объём полезной нагрузки (оценка по текстовому представлению
+значений, как их отдаёт Postgres в text-протоколе) и задержку одного запроса
+для выборки истории и поиска чанков.
+
+    python -m benchmarks.bench_read_paths --database-url postgresql://... --chunks 2000
+
+По умолчанию используется SQLite в памяти; в этом случае сортировка по
+L2-расстоянию заменяется сортировкой по id, т.к. оператора pgvector там нет.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Callable, Iterable, List
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, sessionmaker, undefer
+
+from src.db import Base, User, Message, Document, DocumentChunk, EMBEDDING_DIM, MAX_MESSAGES_PER_USER
+from src.read_models import load_history, search_chunks
+
+
+def _payload_bytes(values: Iterable[object]) -> int:
+    total = 0
+    for value in values:
+        if value is None:
+            continue
+        if hasattr(value, "tolist"):
+            value = value.tolist()
+        if isinstance(value, (list, tuple)):
+            value = "[" + ",".join(repr(float(v)) for v in value) + "]"
+        total += len(str(value).encode("utf-8"))
+    return total
+
+
+def _seed(db: Session, chunks: int, messages: int) -> int:
+    rng = random.Random(42)
+    user = User(telegram_id=1, username="bench")
+    db.add(user)
+    document = Document(title="bench", source="bench")
+    db.add(document)
+    db.commit()
+
+    db.add_all(
+        Message(user_id=user.id, role="user" if i % 2 == 0 else "assistant", content=f"сообщение {i} " * 20, token_count=40)
+        for i in range(messages)
+    )
+    db.add_all(
+        DocumentChunk(
+            document_id=document.id,
+            chunk_index=i,
+            text=f"фрагмент {i} " * 60,
+            embedding=[rng.random() for _ in range(EMBEDDING_DIM)],
+        )
+        for i in range(chunks)
+    )
+    db.commit()
+    return user.id
+
+
+def _measure(fn: Callable[[], List[object]], repeat: int) -> dict:
+    timings: List[float] = []
+    payload = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        payload = sum(_payload_bytes(row) for row in rows)
+    timings.sort()
+    return {
+        "bytes_per_query": payload,
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+    }
+
+
+def run(database_url: str, chunks: int, messages: int, limit: int, repeat: int) -> dict:
+    engine = create_engine(database_url)
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.commit()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    with factory() as db:
+        user_id = _seed(db, chunks, messages)
+
+    probe = [0.5] * EMBEDDING_DIM
+    is_pg = engine.dialect.name == "postgresql"
+    order = DocumentChunk.embedding.l2_distance(probe) if is_pg else DocumentChunk.id
+
+    def orm_history():
+        with factory() as db:
+            rows = db.query(Message).filter(Message.user_id == user_id).order_by(Message.created_at.asc()).all()
+            return [(m.id, m.user_id, m.role, m.content, m.token_count, m.created_at) for m in rows]
+
+    def projected_history():
+        with factory() as db:
+            return [(h.role, h.content) for h in load_history(db, user_id, limit=MAX_MESSAGES_PER_USER)]
+
+    def orm_chunks():
+        with factory() as db:
+            rows = (
+                db.query(DocumentChunk)
+                .options(undefer(DocumentChunk.embedding))
+                .order_by(order)
+                .limit(limit)
+                .all()
+            )
+            return [(c.id, c.document_id, c.chunk_index, c.text, c.embedding) for c in rows]
+
+    def projected_chunks():
+        with factory() as db:
+            if is_pg:
+                hits = search_chunks(db, probe, limit)
+                return [(h.id, h.document_id, h.chunk_index, h.text, h.distance) for h in hits]
+            rows = (
+                db.query(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.chunk_index, DocumentChunk.text)
+                .order_by(order)
+                .limit(limit)
+                .all()
+            )
+            return [tuple(row) for row in rows]
+
+    return {
+        "database": engine.dialect.name,
+        "history": {"orm": _measure(orm_history, repeat), "projection": _measure(projected_history, repeat)},
+        "chunks": {"orm": _measure(orm_chunks, repeat), "projection": _measure(projected_chunks, repeat)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///:memory:")
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=MAX_MESSAGES_PER_USER)
+    parser.add_argument("--limit", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    result = run(args.database_url, args.chunks, args.messages, args.limit, args.repeat)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Бенчмарк холодного старта: время импорта и время до первого ответа.
+
+Каждый замер выполняется в отдельном интерпретаторе, чтобы учитывать
+реальную стоимость импортов. OpenAI и RAG заменены заглушками, БД — SQLite
+во временном файле, поэтому бенчмарк работает без сети.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_BOT = """
+import time
+started = time.perf_counter()
+import src.bot
+print(time.perf_counter() - started)
+"""
+
+FIRST_REPLY = """
+import json
+import sys
+import time
+from types import SimpleNamespace
+
+started = time.perf_counter()
+from src import llm_service as llm_module
+from src.conversation_service import ConversationService
+from src.db import Base, SessionLocal, engine
+imported = time.perf_counter()
+
+Base.metadata.create_all(bind=engine)
+from src.openai_client import Completion
+llm_module.generate_completion = lambda messages, **kwargs: Completion(text="stub-reply", model="stub")
+llm_module.retrieve_passages = lambda db, query, **kwargs: []
+
+warmed = imported
+if sys.argv[1] == "warm":
+    from src.warmup import warm_up
+    warm_up()
+    warmed = time.perf_counter()
+
+service = llm_module.LLMService(ConversationService(SessionLocal))
+tg_user = SimpleNamespace(id=1, username="bench", first_name="Bench", last_name=None)
+
+reply_started = time.perf_counter()
+service.generate_reply(tg_user, "Привет! Как заварить чай?")
+first_reply = time.perf_counter() - reply_started
+
+print(json.dumps({
+    "import_s": imported - started,
+    "warm_up_s": warmed - imported,
+    "first_reply_s": first_reply,
+    "time_to_first_reply_s": time.perf_counter() - started,
+}))
+"""
+
+
+def _run(code: str, env: Dict[str, str], *args: str) -> str:
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {"median_ms": round(statistics.median(values) * 1000, 1), "max_ms": round(max(values) * 1000, 1)}
+
+
+def run(runs: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.pop("OPENAI_API_KEY", None)
+        env["TELEGRAM_BOT_TOKEN"] = env.get("TELEGRAM_BOT_TOKEN") or "123456:BENCHMARK-TOKEN"
+        env["PYTHONPATH"] = str(ROOT)
+
+        bot_import = [float(_run(IMPORT_BOT, env)) for _ in range(runs)]
+
+        modes: Dict[str, dict] = {}
+        for mode in ("cold", "warm"):
+            samples = []
+            for i in range(runs):
+                env["DATABASE_URL"] = f"sqlite:///{tmp}/{mode}-{i}.db"
+                samples.append(json.loads(_run(FIRST_REPLY, env, mode)))
+            modes[mode] = {key: _summary([s[key] for s in samples]) for key in samples[0]}
+
+    return {"bot_module_import": _summary(bot_import), "first_reply": modes}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.runs), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Бенчмарк записи сообщений: коммит на сообщение против write-behind буфера.
+
+Параллельно N пользователей (потоков) пишут по M сообщений через
+ConversationService. Считаются коммиты в секунду, пропускная способность
+и задержка вызова add_user_message; для буфера — ещё задержка от постановки
+в очередь до коммита.
+
+    python -m benchmarks.bench_write_behind --database-url postgresql://... --users 200 --messages 20
+
+По умолчанию — SQLite-файл во временном каталоге.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from src.conversation_service import ConversationService
+from src.db import Base
+from src.metrics import metrics
+from src.write_behind import WriteBehindBuffer
+
+
+def _percentiles_ms(values: List[float]) -> dict:
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def _run_mode(database_url: str, buffered: bool, users: int, messages: int) -> dict:
+    engine = create_engine(database_url, pool_size=users + 2, max_overflow=0) if database_url.startswith(
+        "postgresql"
+    ) else create_engine(database_url, connect_args={"timeout": 60, "check_same_thread": False})
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.commit()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    commits = []
+    lock = threading.Lock()
+
+    def on_commit(conn):
+        with lock:
+            commits.append(1)
+
+    metrics.reset()
+    buffer = WriteBehindBuffer(factory) if buffered else None
+    service = ConversationService(factory, write_buffer=buffer)
+
+    # Пользователи создаются заранее, чтобы их коммиты не попали в замер
+    for uid in range(users):
+        service.get_history(SimpleNamespace(id=uid, username=None, first_name=None, last_name=None))
+    event.listen(engine, "commit", on_commit)
+
+    def worker(uid: int) -> List[float]:
+        tg_user = SimpleNamespace(id=uid, username=None, first_name=None, last_name=None)
+        latencies = []
+        for i in range(messages):
+            started = time.perf_counter()
+            service.add_user_message(tg_user, f"user {uid} message {i}")
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        latencies = [value for result in pool.map(worker, range(users)) for value in result]
+    service.close()
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "messages": len(latencies),
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": round(len(latencies) / elapsed, 1),
+        "commits": len(commits),
+        "commits_per_sec": round(len(commits) / elapsed, 1),
+        "add_message": _percentiles_ms(latencies),
+    }
+    if buffered:
+        summary = metrics.summary("write_behind.insert_latency_seconds")
+        result["enqueue_to_commit"] = {
+            "p50_ms": round(summary["p50"] * 1000, 3),
+            "p99_ms": round(summary["p99"] * 1000, 3),
+        }
+    engine.dispose()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url")
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        result = {
+            "commit_per_message": _run_mode(database_url, False, args.users, args.messages),
+            "write_behind": _run_mode(database_url, True, args.users, args.messages),
+        }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Офлайн-эмбеддинги чанков через Batch API: дешевле синхронных запросов и без лимитов в минуту.
+
+Конвейер:
+- чанки без эмбеддинга (загруженные с src.ingest --batch) выгружаются в
+  JSONL-файлы запросов к /v1/embeddings, по строке на чанк с custom_id
+  «chunk-<id>»; файл ограничен BATCH_MAX_REQUESTS строками и
+  BATCH_MAX_FILE_BYTES байтами;
+- каждый файл загружается (purpose=batch) и отправляется заданием, задание
+  записывается в embedding_batches;
+- опрос проверяет активные задания, у завершённых потоково читает файл
+  результатов и пачками по BATCH_IMPORT_PAGE обновляет embedding у чанков.
+
+До импорта embedding чанка равен NULL, и поиск его не видит. Чанки из
+неудачных запросов или просроченного задания остаются без эмбеддинга и
+уходят в следующую отправку.
+
+    python -m src.ingest docs/ --batch --wait      # загрузить каталог и дождаться эмбеддингов
+    python -m src.batch_embeddings submit          # отправить чанки без эмбеддинга
+    python -m src.batch_embeddings poll --wait     # импортировать результаты готовых заданий
+    python -m src.batch_embeddings status
+"""
+
+import os
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from sqlalchemy import and_, bindparam, exists, select, update
+
+from src.db import DocumentChunk, EmbeddingBatch
+from src.metrics import metrics
+from src.rag import EMBEDDING_MODEL
+
+
+BATCH_EMBED_DIR = os.getenv("BATCH_EMBED_DIR", "batches")
+# Лимиты OpenAI на файл задания: 50 000 запросов и 200 МБ
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000"))
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_BYTES", str(190 * 1024 * 1024)))
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "60"))
+BATCH_IMPORT_PAGE = int(os.getenv("BATCH_IMPORT_PAGE", "1000"))
+# Таймаут загрузки файла задания и чтения файла результатов: у клиента
+# эмбеддингов он рассчитан на короткие запросы
+BATCH_FILE_TIMEOUT = float(os.getenv("BATCH_FILE_TIMEOUT", "600"))
+BATCH_COMPLETION_WINDOW = "24h"
+
+BATCH_ENDPOINT = "/v1/embeddings"
+# Статусы, после которых задание больше не изменится
+FINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+_CUSTOM_ID_PREFIX = "chunk-"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class BatchFile:
+    path: Path
+    first_chunk_id: int
+    last_chunk_id: int
+    requests: int
+
+
+def request_line(chunk_id: int, text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Строка JSONL-файла задания для одного чанка."""
+    request = {
+        "custom_id": f"{_CUSTOM_ID_PREFIX}{chunk_id}",
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "input": text},
+    }
+    return json.dumps(request, ensure_ascii=False) + "\n"
+
+
+def parse_result_line(line: str) -> Tuple[int, List[float] | None]:
+    """id чанка и его эмбеддинг из строки файла результатов; None — запрос не удался."""
+    result = json.loads(line)
+    chunk_id = int(result["custom_id"][len(_CUSTOM_ID_PREFIX) :])
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return chunk_id, None
+    return chunk_id, response["body"]["data"][0]["embedding"]
+
+
+def pending_chunks_query():
+    """Чанки без эмбеддинга, не входящие в активное задание, по возрастанию id."""
+    in_active_batch = exists().where(
+        and_(
+            EmbeddingBatch.imported_at.is_(None),
+            DocumentChunk.id.between(EmbeddingBatch.first_chunk_id, EmbeddingBatch.last_chunk_id),
+        )
+    )
+    return (
+        select(DocumentChunk.id, DocumentChunk.text)
+        .where(DocumentChunk.embedding.is_(None), ~in_active_batch)
+        .order_by(DocumentChunk.id)
+    )
+
+
+class BatchEmbedder:
+    def __init__(
+        self,
+        session_factory,
+        client,
+        output_dir: str = BATCH_EMBED_DIR,
+        max_requests: int = BATCH_MAX_REQUESTS,
+        max_file_bytes: int = BATCH_MAX_FILE_BYTES,
+        import_page: int = BATCH_IMPORT_PAGE,
+        keep_files: bool = False,
+    ) -> None:
+        self._session_factory = session_factory
+        self._client = client
+        self._output_dir = Path(output_dir)
+        self._max_requests = max_requests
+        self._max_file_bytes = max_file_bytes
+        self._import_page = import_page
+        self._keep_files = keep_files
+
+    def write_batch_files(self) -> List[BatchFile]:
+        """Выгружает ожидающие чанки в JSONL-файлы заданий в пределах лимитов на файл."""
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        prefix = f"embeddings-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}"
+        files: List[BatchFile] = []
+        current = None
+        first_id = last_id = requests = size = 0
+
+        def close() -> None:
+            current.close()
+            files.append(BatchFile(Path(current.name), first_id, last_id, requests))
+
+        with self._session_factory() as db:
+            for chunk_id, text in db.execute(pending_chunks_query().execution_options(yield_per=1000)):
+                line = request_line(chunk_id, text).encode("utf-8")
+                if current is not None and (requests >= self._max_requests or size + len(line) > self._max_file_bytes):
+                    close()
+                    current = None
+                if current is None:
+                    current = (self._output_dir / f"{prefix}-{len(files):04d}.jsonl").open("wb")
+                    first_id, requests, size = chunk_id, 0, 0
+                current.write(line)
+                last_id = chunk_id
+                requests += 1
+                size += len(line)
+        if current is not None:
+            close()
+        return files
+
+    def submit(self) -> List[str]:
+        """Отправляет все ожидающие чанки заданиями; возвращает id созданных заданий."""
+        batch_ids = []
+        for batch_file in self.write_batch_files():
+            with batch_file.path.open("rb") as file:
+                uploaded = self._client.files.create(file=file, purpose="batch", timeout=BATCH_FILE_TIMEOUT)
+            batch = self._client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=BATCH_COMPLETION_WINDOW,
+                metadata={"source": "llm-telegram-bot", "file": batch_file.path.name},
+            )
+            with self._session_factory() as db:
+                db.add(
+                    EmbeddingBatch(
+                        batch_id=batch.id,
+                        input_file_id=uploaded.id,
+                        status=batch.status,
+                        first_chunk_id=batch_file.first_chunk_id,
+                        last_chunk_id=batch_file.last_chunk_id,
+                        requests=batch_file.requests,
+                    )
+                )
+                db.commit()
+            if not self._keep_files:
+                batch_file.path.unlink()
+            metrics.increment("batch_embeddings.submitted_requests", batch_file.requests)
+            logger.info("Submitted batch %s with %d chunks", batch.id, batch_file.requests)
+            batch_ids.append(batch.id)
+        return batch_ids
+
+    def _stream_lines(self, file_id: str) -> Iterator[str]:
+        with self._client.files.with_streaming_response.content(file_id, timeout=BATCH_FILE_TIMEOUT) as response:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield line
+
+    def _write_page(self, db, page: List[Dict]) -> int:
+        """Записывает пачку эмбеддингов; возвращает, сколько чанков обновлено.
+
+        Чанки могли удалить после отправки задания (например, файл загрузили
+        заново), поэтому пишутся только сохранившиеся, а обновление идёт через
+        Core: ORM-обновление по первичному ключу падает на отсутствующей строке.
+        """
+        existing = set(db.scalars(select(DocumentChunk.id).where(DocumentChunk.id.in_([row["chunk_id"] for row in page]))))
+        rows = [row for row in page if row["chunk_id"] in existing]
+        if rows:
+            table = DocumentChunk.__table__
+            db.execute(update(table).where(table.c.id == bindparam("chunk_id")).values(embedding=bindparam("vector")), rows)
+        return len(rows)
+
+    def _import(self, file_id: str) -> Tuple[int, int]:
+        """Записывает эмбеддинги из файла результатов; возвращает (записано, неудачных запросов)."""
+        embedded = failed = 0
+        page: List[Dict] = []
+        with self._session_factory() as db:
+            for line in self._stream_lines(file_id):
+                chunk_id, embedding = parse_result_line(line)
+                if embedding is None:
+                    failed += 1
+                    continue
+                page.append({"chunk_id": chunk_id, "vector": embedding})
+                if len(page) >= self._import_page:
+                    embedded += self._write_page(db, page)
+                    page = []
+            if page:
+                embedded += self._write_page(db, page)
+            db.commit()
+        return embedded, failed
+
+    def poll(self) -> Dict[str, str]:
+        """Обновляет статусы активных заданий и импортирует завершённые; возвращает статусы."""
+        with self._session_factory() as db:
+            active = db.execute(
+                select(EmbeddingBatch.id, EmbeddingBatch.batch_id).where(EmbeddingBatch.imported_at.is_(None))
+            ).all()
+
+        statuses = {}
+        for row_id, batch_id in active:
+            batch = self._client.batches.retrieve(batch_id)
+            statuses[batch_id] = batch.status
+            embedded = failed = 0
+            if batch.status in FINAL_STATUSES:
+                # У просроченного или отменённого задания может быть частичный результат
+                if batch.output_file_id:
+                    embedded, failed = self._import(batch.output_file_id)
+                if batch.error_file_id:
+                    failed += sum(1 for _ in self._stream_lines(batch.error_file_id))
+                metrics.increment("batch_embeddings.embedded_chunks", embedded)
+                metrics.increment("batch_embeddings.failed_requests", failed)
+                logger.info("Batch %s %s: %d chunks embedded, %d failed", batch_id, batch.status, embedded, failed)
+
+            with self._session_factory() as db:
+                row = db.get(EmbeddingBatch, row_id)
+                row.status = batch.status
+                row.output_file_id = batch.output_file_id
+                row.error_file_id = batch.error_file_id
+                if batch.status in FINAL_STATUSES:
+                    row.embedded = embedded
+                    row.failed = failed
+                    row.imported_at = datetime.now(timezone.utc)
+                db.commit()
+        return statuses
+
+    def wait(self, interval: float = BATCH_POLL_INTERVAL, timeout: float | None = None) -> Dict[str, str]:
+        """Опрашивает задания, пока все не будут импортированы (или не истечёт timeout)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        statuses: Dict[str, str] = {}
+        while True:
+            current = self.poll()
+            statuses.update(current)
+            if all(status in FINAL_STATUSES for status in current.values()):
+                return statuses
+            if deadline is not None and time.monotonic() >= deadline:
+                return statuses
+            time.sleep(interval)
+
+    def pending_chunks(self) -> int:
+        with self._session_factory() as db:
+            return db.query(DocumentChunk).filter(DocumentChunk.embedding.is_(None)).count()
+
+
+def main(argv: List[str] | None = None) -> None:
+    import argparse
+
+    from src.db import SessionLocal, init_db
+    from src.openai_factory import CALL_EMBEDDING, get_client
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit")
+    submit_parser.add_argument("--keep-files", action="store_true", help="не удалять JSONL-файлы после отправки")
+    poll_parser = commands.add_parser("poll")
+    poll_parser.add_argument("--wait", action="store_true", help="ждать завершения всех заданий")
+    poll_parser.add_argument("--interval", type=float, default=BATCH_POLL_INTERVAL)
+    commands.add_parser("status")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+
+    if args.command == "status":
+        with SessionLocal() as db:
+            for batch in db.query(EmbeddingBatch).order_by(EmbeddingBatch.id).all():
+                print(
+                    f"{batch.batch_id}\t{batch.status}\tchunks {batch.first_chunk_id}-{batch.last_chunk_id}"
+                    f"\trequests {batch.requests}\tembedded {batch.embedded}\tfailed {batch.failed}"
+                )
+        print(f"Chunks without embeddings: {BatchEmbedder(SessionLocal, None).pending_chunks()}")
+        return
+
+    client = get_client(CALL_EMBEDDING)
+    if client is None:
+        parser.error("OPENAI_API_KEY is not set")
+
+    if args.command == "submit":
+        embedder = BatchEmbedder(SessionLocal, client, keep_files=args.keep_files)
+        batch_ids = embedder.submit()
+        print(f"Submitted {len(batch_ids)} batches: {', '.join(batch_ids) or 'no pending chunks'}")
+    else:
+        embedder = BatchEmbedder(SessionLocal, client)
+        statuses = embedder.wait(args.interval) if args.wait else embedder.poll()
+        for batch_id, status in statuses.items():
+            print(f"{batch_id}\t{status}")
+        print(f"Chunks without embeddings: {embedder.pending_chunks()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
 import asyncio
 import logging
 import os
+import time
+from typing import TYPE_CHECKING
+
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from dotenv import load_dotenv
-from src.db import init_db
-from src.conversation_service import ConversationService
-from src.llm_service import LLMService
+
+if TYPE_CHECKING:
+    from src.conversation_service import ConversationService
+    from src.llm_service import LLMService
+    from src.send_queue import SendQueue
 
 
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +19,8 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "300"))
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
 
 if not TELEGRAM_BOT_TOKEN:
     logger.error("TELEGRAM_BOT_TOKEN is not set. Please configure it in the environment or .env file.")
@@ -22,8 +29,56 @@ if not TELEGRAM_BOT_TOKEN:
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
 
-conversation_service = ConversationService()
-llm_service = LLMService(conversation_service)
+# Сервисы тянут SQLAlchemy, pgvector, OpenAI и tiktoken, поэтому создаются
+# в main() перед стартом polling, а не при импорте модуля.
+conversation_service: "ConversationService | None" = None
+llm_service: "LLMService | None" = None
+# Очередь исходящих сообщений с лимитами Telegram; создаётся в _get_send_queue()
+send_queue: "SendQueue | None" = None
+
+
+def _build_services() -> None:
+    global conversation_service, llm_service
+
+    from src.conversation_service import ConversationService
+    from src.db import SessionLocal
+    from src.llm_service import LLMService
+    from src.write_behind import WriteBehindBuffer
+
+    write_buffer = WriteBehindBuffer(SessionLocal) if MESSAGE_WRITE_BEHIND else None
+    conversation_service = ConversationService(SessionLocal, write_buffer=write_buffer)
+    llm_service = LLMService(conversation_service)
+
+
+def _get_send_queue(bot: Bot) -> "SendQueue":
+    """Очередь отправки бота; создаётся при первом ответе, чтобы ни один ответ не обходил лимиты."""
+    global send_queue
+
+    if send_queue is None:
+        from src.send_queue import SendQueue
+
+        send_queue = SendQueue(bot)
+        send_queue.start()
+    return send_queue
+
+
+async def _reply(message: types.Message, text: str) -> None:
+    """Отвечает в чат сообщения (в ту же тему форума и бизнес-чат) через очередь отправки."""
+    await _get_send_queue(message.bot).send(
+        message.chat.id,
+        text,
+        message_thread_id=message.message_thread_id if message.is_topic_message else None,
+        business_connection_id=message.business_connection_id,
+    )
+
+
+@dp.update.outer_middleware()
+async def trace_update(handler, event: types.Update, data: dict):
+    """Каждый апдейт — отдельная трасса с его update_id (см. src/tracing.py)."""
+    from src.tracing import tracer
+
+    with tracer.start_trace("telegram.update", update_id=event.update_id, event_type=event.event_type):
+        return await handler(event, data)
 
 
 @dp.message(Command("start"))
@@ -41,7 +96,7 @@ async def cmd_start(message: types.Message):
     logger.info("/start from user_id=%s", tg_user.id)
     conversation_service.register_start(tg_user, greeting_text)
 
-    await message.answer(greeting_text)
+    await _reply(message, greeting_text)
 
 
 @dp.message(Command("clear"))
@@ -50,31 +105,66 @@ async def cmd_clear(message: types.Message):
     logger.info("/clear from user_id=%s", tg_user.id)
     conversation_service.clear_history(tg_user)
 
-    await message.answer("✅ История диалога очищена (в dev-режиме)")
+    await _reply(message, "✅ История диалога очищена (в dev-режиме)")
 
 
 @dp.message(Command("stats", "stat"))
 async def cmd_stats(message: types.Message):
     """Показывает статистику использования токенов за сегодня"""
+    from src.usage_stats import prompt_cache_stats
+
     tg_user = message.from_user
     stats = conversation_service.get_stats(tg_user)
+    cache = prompt_cache_stats.for_user(tg_user.id)
 
     text = (
         "📊 Статистика за сегодня:\n"
         f"• Сообщений: {stats['today_messages']}\n"
         f"• Токенов использовано: {stats['today_tokens']:,}\n"
-        f"• Лимит токенов: {stats['max_daily_tokens']:,}"
+        f"• Лимит токенов: {stats['max_daily_tokens']:,}\n"
+        f"• Токенов из кэша промпта: {cache['cached_tokens']:,} ({cache['cache_hit_ratio']:.0%})"
     )
-    await message.answer(text)
+    await _reply(message, text)
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message, command: CommandObject):
+    """/profile [секунды] — статистический профиль живого процесса (только для администраторов)."""
+    from src.profiling import PROFILE_SIGNAL_SECONDS, is_admin, profiler
+
+    if not is_admin(message.from_user.id):
+        await _reply(message, "⛔ Команда доступна только администраторам.")
+        return
+
+    try:
+        seconds = float(command.args) if command.args else PROFILE_SIGNAL_SECONDS
+    except ValueError:
+        await _reply(message, "Использование: /profile [секунды]")
+        return
+
+    if profiler.busy:
+        await _reply(message, "⏳ Профилирование уже идёт.")
+        return
+
+    await _reply(message, f"⏱ Профилирую процесс {seconds:.0f} с...")
+    result = await asyncio.to_thread(profiler.run, seconds)
+    if result is None:
+        await _reply(message, "⏳ Профилирование уже идёт.")
+        return
+
+    top = "\n".join(f"• {label}: {count}" for label, count in result.top[:5])
+    await _reply(message, f"✅ {result.samples} сэмплов за {result.seconds:.1f} с: {result.path}\n{top}")
 
 
 @dp.message()
 async def echo_message(message: types.Message):
     """Эхо-обработчик — теперь отвечает через OpenAI GPT-4o-mini"""
+    from src.tracing import span
+
     user_text = message.text
 
     if not user_text:
-        await message.answer("Пока я понимаю только текстовые сообщения. Пожалуйста, отправь текст.")
+        await _reply(message, "Пока я понимаю только текстовые сообщения. Пожалуйста, отправь текст.")
         return
 
     tg_user = message.from_user
@@ -82,22 +172,92 @@ async def echo_message(message: types.Message):
         reply_text = await asyncio.to_thread(llm_service.generate_reply, tg_user, user_text)
     except Exception as e:
         logger.error("LLM error: %s", e)
-        await message.answer("⚠️ Ошибка на сервере. Попробуйте позже.")
+        await _reply(message, "⚠️ Ошибка на сервере. Попробуйте позже.")
         return
 
-    await message.answer(reply_text)
+    with span("telegram.send_message"):
+        await _reply(message, reply_text)
+
+
+def _log_metrics() -> None:
+    from src.metrics import metrics
+    from src.model_router import model_router
+    from src.openai_factory import transport_stats
+    from src.rag_gate import gate_stats
+    from src.usage_stats import prompt_cache_stats
+
+    logger.info("RAG gate: %s", gate_stats())
+    logger.info("Prompt cache: %s", prompt_cache_stats.totals())
+    logger.info("Model latency percentiles: %s", model_router.latency_percentiles())
+    logger.info("OpenAI transport stats: %s", transport_stats.snapshot())
+    logger.info("Metrics: %s", metrics.snapshot())
+
+
+async def _log_metrics_periodically() -> None:
+    while True:
+        await asyncio.sleep(METRICS_LOG_INTERVAL)
+        _log_metrics()
+
+
+async def _maintain_partitions_periodically() -> None:
+    from src.partitions import MESSAGES_MAINTENANCE_INTERVAL, maintain_partitions
+
+    while True:
+        await asyncio.sleep(MESSAGES_MAINTENANCE_INTERVAL)
+        try:
+            await asyncio.to_thread(maintain_partitions)
+        except Exception as e:
+            logger.error("Partition maintenance failed: %s", e)
+
+
+def _install_profile_signal() -> None:
+    """SIGUSR1 запускает профилирование на PROFILE_SIGNAL_SECONDS (только Unix)."""
+    import signal
+
+    from src.profiling import PROFILE_SIGNAL_SECONDS, profiler
+
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    def on_signal() -> None:
+        logger.info("SIGUSR1 received, profiling for %.0fs", PROFILE_SIGNAL_SECONDS)
+        asyncio.get_running_loop().run_in_executor(None, profiler.run, PROFILE_SIGNAL_SECONDS)
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, on_signal)
 
 
 async def main():
     """Запуск бота"""
-    init_db()
-    logger.info("🚀 Bot starting...")
+    started = time.perf_counter()
+    await asyncio.to_thread(_build_services)
+
+    from src.db import init_db
+    from src.warmup import warm_up
+
+    await asyncio.to_thread(init_db)
+    await asyncio.to_thread(warm_up)
+    logger.info("🚀 Bot starting... (startup took %.2fs)", time.perf_counter() - started)
+    metrics_task = asyncio.create_task(_log_metrics_periodically())
+    maintenance_task = asyncio.create_task(_maintain_partitions_periodically())
+    _install_profile_signal()
+    _get_send_queue(bot)
     try:
         await dp.start_polling(bot)
     finally:
         logger.info("Bot shutdown, closing resources...")
+        metrics_task.cancel()
+        maintenance_task.cancel()
+        await _get_send_queue(bot).close()
         await bot.session.close()
 
+        if conversation_service is not None:
+            await asyncio.to_thread(conversation_service.close)
+
+        from src.openai_factory import close_clients
+
+        _log_metrics()
+        close_clients()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,19 +1,27 @@
 from typing import List
-from datetime import datetime, timezone
 
 from aiogram import types
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from src.db import SessionLocal, User, Message, trim_old_messages, MAX_MESSAGES_PER_USER
-from src.token_counter import count_tokens, check_daily_limit, MAX_MESSAGE_TOKENS
+from src.db import SessionLocal, User, Message, trim_old_messages, utc_day_range, MAX_MESSAGES_PER_USER, MESSAGES_TRIM_ON_WRITE
+from src.knowledge_bases import RAG_COLLECTION, validate_collection
+from src.read_models import Dialogue, HistoryEntry, load_history
+from src.tracing import traced
+from src.token_counter import count_tokens, check_daily_limit, get_daily_tokens, MAX_DAILY_TOKENS, MAX_MESSAGE_TOKENS
+from src.write_behind import WriteBehindBuffer
 
 
 class ConversationService:
-    """Сервис для работы с пользователями и сообщениями (историей диалога)."""
+    """Сервис для работы с пользователями и сообщениями (историей диалога).
 
-    def __init__(self, session_factory=SessionLocal) -> None:
+    Если передан write_buffer, сообщения сохраняются отложенно пакетами,
+    а чтения истории и лимитов учитывают ещё не записанные сообщения.
+    """
+
+    def __init__(self, session_factory=SessionLocal, write_buffer: WriteBehindBuffer | None = None) -> None:
         self._session_factory = session_factory
+        self._write_buffer = write_buffer
 
     def _get_db(self) -> Session:
         return self._session_factory()
@@ -40,14 +48,21 @@ class ConversationService:
         if tokens > MAX_MESSAGE_TOKENS:
             return
 
-        if not check_daily_limit(db, user.id):
+        pending_tokens = self._write_buffer.pending_tokens(user.id) if self._write_buffer is not None else 0
+        if not check_daily_limit(db, user.id, max_tokens=MAX_DAILY_TOKENS - pending_tokens):
+            return
+
+        if self._write_buffer is not None:
+            self._write_buffer.add(user.id, role, content, tokens)
             return
 
         message = Message(user_id=user.id, role=role, content=content, token_count=tokens)
         db.add(message)
         db.commit()
-        trim_old_messages(db, user.id, keep_last=MAX_MESSAGES_PER_USER)
+        if MESSAGES_TRIM_ON_WRITE:
+            trim_old_messages(db, user.id, keep_last=MAX_MESSAGES_PER_USER)
 
+    @traced("conversation.register_start")
     def register_start(self, tg_user: types.User, greeting_text: str) -> None:
         """Регистрирует пользователя и сохраняет приветственное сообщение."""
         with self._get_db() as db:
@@ -55,46 +70,74 @@ class ConversationService:
             self._save_message(db, user, "user", "/start")
             self._save_message(db, user, "assistant", greeting_text)
 
+    @traced("conversation.clear_history")
     def clear_history(self, tg_user: types.User) -> None:
         """Очищает историю диалога пользователя."""
         with self._get_db() as db:
             user = self._get_or_create_user(db, tg_user)
+            if self._write_buffer is not None:
+                self._write_buffer.discard_user(user.id)
             db.query(Message).filter(Message.user_id == user.id).delete()
             db.commit()
 
+    @traced("conversation.add_user_message")
     def add_user_message(self, tg_user: types.User, content: str) -> None:
         with self._get_db() as db:
             user = self._get_or_create_user(db, tg_user)
             self._save_message(db, user, "user", content)
 
+    @traced("conversation.add_assistant_message")
     def add_assistant_message(self, tg_user: types.User, content: str) -> None:
         with self._get_db() as db:
             user = self._get_or_create_user(db, tg_user)
             self._save_message(db, user, "assistant", content)
 
-    def get_history(self, tg_user: types.User) -> List[Message]:
-        """Возвращает историю сообщений пользователя в хронологическом порядке."""
+    def _load_history(self, db: Session, user: User, limit: int | None) -> List[HistoryEntry]:
+        if self._write_buffer is None:
+            return load_history(db, user.id, limit=limit)
+
+        stored, pending = self._write_buffer.read_consistent(user.id, lambda: load_history(db, user.id, limit=limit))
+        history = stored + [HistoryEntry(role=message.role, content=message.content) for message in pending]
+        return history[-limit:] if limit else history
+
+    @traced("conversation.get_history")
+    def get_history(self, tg_user: types.User, limit: int | None = None) -> List[HistoryEntry]:
+        """Возвращает историю сообщений пользователя в хронологическом порядке.
+
+        limit ограничивает выборку последними limit сообщениями.
+        """
         with self._get_db() as db:
             user = self._get_or_create_user(db, tg_user)
-            messages = (
-                db.query(Message)
-                .filter(Message.user_id == user.id)
-                .order_by(Message.created_at.asc())
-                .all()
-            )
-            return list(messages)
+            return self._load_history(db, user, limit)
+
+    @traced("conversation.get_dialogue")
+    def get_dialogue(self, tg_user: types.User, limit: int | None = None) -> Dialogue:
+        """История (как get_history) и коллекция пользователя из той же сессии и той же строки users."""
+        with self._get_db() as db:
+            user = self._get_or_create_user(db, tg_user)
+            return Dialogue(history=self._load_history(db, user, limit), collection=user.collection or RAG_COLLECTION)
 
+    @traced("conversation.get_remaining_daily_tokens")
+    def get_remaining_daily_tokens(self, tg_user: types.User) -> int:
+        """Возвращает, сколько токенов пользователь ещё может потратить сегодня."""
+        with self._get_db() as db:
+            user = self._get_or_create_user(db, tg_user)
+            pending_tokens = self._write_buffer.pending_tokens(user.id) if self._write_buffer is not None else 0
+            return max(0, MAX_DAILY_TOKENS - get_daily_tokens(db, user.id) - pending_tokens)
+
+    @traced("conversation.get_stats")
     def get_stats(self, tg_user: types.User) -> dict:
         """Возвращает статистику токенов за сегодня для пользователя."""
         with self._get_db() as db:
             user = self._get_or_create_user(db, tg_user)
-            today = datetime.now(timezone.utc).date()
+            day_start, day_end = utc_day_range()
 
             total_tokens = (
                 db.query(func.coalesce(func.sum(Message.token_count), 0))
                 .filter(
                     Message.user_id == user.id,
-                    func.date(Message.created_at) == today,
+                    Message.created_at >= day_start,
+                    Message.created_at < day_end,
                 )
                 .scalar()
             )
@@ -103,13 +146,37 @@ class ConversationService:
                 db.query(Message)
                 .filter(
                     Message.user_id == user.id,
-                    func.date(Message.created_at) == today,
+                    Message.created_at >= day_start,
+                    Message.created_at < day_end,
                 )
                 .count()
             )
 
+            pending = self._write_buffer.pending_for(user.id) if self._write_buffer is not None else []
+
             return {
-                "today_tokens": int(total_tokens or 0),
-                "today_messages": message_count,
-                "max_daily_tokens": 50000,
+                "today_tokens": int(total_tokens or 0) + sum(message.token_count for message in pending),
+                "today_messages": message_count + len(pending),
+                "max_daily_tokens": MAX_DAILY_TOKENS,
             }
+
+    @traced("conversation.set_collection")
+    def set_collection(self, telegram_id: int, collection: str | None) -> None:
+        """Привязывает пользователя к коллекции; None возвращает коллекцию бота по умолчанию.
+
+        Пользователь, ещё не писавший боту, создаётся заранее.
+        """
+        if collection is not None:
+            validate_collection(collection)
+        with self._get_db() as db:
+            user = db.query(User).filter(User.telegram_id == telegram_id).first()
+            if user is None:
+                user = User(telegram_id=telegram_id)
+                db.add(user)
+            user.collection = collection
+            db.commit()
+
+    def close(self) -> None:
+        """Дописывает отложенные сообщения (вызывается при остановке бота)."""
+        if self._write_buffer is not None:
+            self._write_buffer.close()
@@ -1,8 +1,24 @@
 import os
-from datetime import datetime, timezone
-
-from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, create_engine, text, select
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker, Session
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Tuple
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    Text,
+    DateTime,
+    ForeignKey,
+    Index,
+    create_engine,
+    delete,
+    func,
+    text,
+    select,
+)
+from sqlalchemy.orm import declarative_base, deferred, relationship, sessionmaker, Session
 from pgvector.sqlalchemy import Vector
 
 
@@ -15,6 +31,18 @@ Base = declarative_base()
 
 MAX_MESSAGES_PER_USER = 30
 EMBEDDING_DIM = 1536
+# Коллекция базы знаний для документов, загруженных без явного указания (src/knowledge_bases.py)
+DEFAULT_COLLECTION = "default"
+
+# В Postgres таблица messages создаётся секционированной по месяцам (src/partitions.py)
+MESSAGES_PARTITIONING = os.getenv("MESSAGES_PARTITIONING", "1").lower() in ("1", "true", "yes")
+# Физически удалять сообщения сверх MAX_MESSAGES_PER_USER при записи. С секциями
+# по умолчанию выключено: история и так читается с лимитом, а старые сообщения
+# уходят целыми секциями по MESSAGES_RETENTION_MONTHS
+_TRIM_ON_WRITE_DEFAULT = "0" if MESSAGES_PARTITIONING else "1"
+MESSAGES_TRIM_ON_WRITE = os.getenv("MESSAGES_TRIM_ON_WRITE", _TRIM_ON_WRITE_DEFAULT).lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
 
 
 class User(Base):
@@ -25,6 +53,8 @@ class User(Base):
     username = Column(String(255), nullable=True)
     first_name = Column(String(255), nullable=True)
     last_name = Column(String(255), nullable=True)
+    # Коллекция базы знаний пользователя; None — коллекция бота RAG_COLLECTION
+    collection = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
 
     messages = relationship("Message", back_populates="user", cascade="all, delete-orphan")
@@ -42,6 +72,9 @@ class Message(Base):
 
     user = relationship("User", back_populates="messages")
 
+    # Дневной лимит и /stats ищут сообщения пользователя по диапазону дат
+    __table_args__ = (Index("ix_messages_user_id_created_at", "user_id", "created_at"),)
+
 
 class Document(Base):
     __tablename__ = "documents"
@@ -49,6 +82,7 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
     source = Column(String(255), nullable=True)  # путь к файлу или другой идентификатор
+    collection = Column(String(64), nullable=False, default=DEFAULT_COLLECTION, server_default=DEFAULT_COLLECTION)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
 
     chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
@@ -60,19 +94,119 @@ class DocumentChunk(Base):
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
     chunk_index = Column(Integer, nullable=False)
+    # Копия Document.collection: поиск фильтрует чанки без JOIN, а частичные
+    # HNSW-индексы строятся по условию на эту колонку
+    collection = Column(
+        String(64), nullable=False, default=DEFAULT_COLLECTION, server_default=DEFAULT_COLLECTION, index=True
+    )
     text = Column(Text, nullable=False)
-    embedding = Column(Vector(EMBEDDING_DIM), nullable=False)
+    # 1536 float'ов на строку: по умолчанию не загружаем, пока явно не обратились.
+    # NULL — эмбеддинг ещё считается пакетным заданием (src/batch_embeddings.py),
+    # такие чанки в поиск не попадают
+    embedding = deferred(Column(Vector(EMBEDDING_DIM), nullable=True))
 
     document = relationship("Document", back_populates="chunks")
 
 
+class IngestCheckpoint(Base):
+    """Файл, полностью загруженный пакетной загрузкой (src/ingest.py).
+
+    Строка пишется в одной транзакции с документом и его чанками, поэтому
+    прерванная загрузка продолжается с первого файла без записи.
+    """
+
+    __tablename__ = "ingest_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(1024), unique=True, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="SET NULL"), nullable=True)
+    chunks = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class EmbeddingBatch(Base):
+    """Задание Batch API на эмбеддинги чанков с id от first_chunk_id до last_chunk_id.
+
+    Пока imported_at пуст, задание считается активным, и его чанки не
+    отправляются повторно; после импорта результатов чанки, оставшиеся без
+    эмбеддинга, попадают в следующее задание.
+    """
+
+    __tablename__ = "embedding_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String(64), unique=True, nullable=False)
+    input_file_id = Column(String(64), nullable=False)
+    output_file_id = Column(String(64), nullable=True)
+    error_file_id = Column(String(64), nullable=True)
+    status = Column(String(32), nullable=False)
+    first_chunk_id = Column(Integer, nullable=False)
+    last_chunk_id = Column(Integer, nullable=False)
+    requests = Column(Integer, nullable=False)
+    embedded = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    imported_at = Column(DateTime, nullable=True, index=True)
+
+
 def init_db() -> None:
     with engine.connect() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         conn.commit()
 
+    if engine.dialect.name == "postgresql" and MESSAGES_PARTITIONING:
+        from src.partitions import create_partitioned_messages, ensure_partitions, is_partitioned, table_exists
+
+        # messages ссылается на users, поэтому сначала остальные таблицы
+        Base.metadata.create_all(
+            bind=engine,
+            tables=[table for table in Base.metadata.sorted_tables if table.name != Message.__tablename__],
+        )
+        with engine.begin() as conn:
+            if not table_exists(conn, Message.__tablename__):
+                create_partitioned_messages(conn)
+            if is_partitioned(conn):
+                ensure_partitions(conn)
+            else:
+                logger.warning(
+                    "Table messages is not partitioned; run `python -m src.partitions migrate` to convert it"
+                )
+
     Base.metadata.create_all(bind=engine)
 
+    if engine.dialect.name == "postgresql":
+        from src.knowledge_bases import ensure_collection_columns
+
+        # create_all не меняет уже существующие таблицы
+        with engine.begin() as conn:
+            ensure_collection_columns(conn)
+            # ALTER берёт ACCESS EXCLUSIVE на таблицу, поэтому только если колонка ещё NOT NULL
+            if not _column_is_nullable(conn, DocumentChunk.__tablename__, "embedding"):
+                conn.execute(text("ALTER TABLE document_chunks ALTER COLUMN embedding DROP NOT NULL"))
+
+
+def _column_is_nullable(conn, table: str, column: str) -> bool:
+    nullable = conn.execute(
+        text(
+            "SELECT is_nullable FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+        ),
+        {"table": table, "column": column},
+    ).scalar()
+    return nullable == "YES"
+
+
+def utc_day_range(day: date | None = None) -> Tuple[datetime, datetime]:
+    """Границы суток (UTC) для фильтра по created_at.
+
+    Диапазон вместо func.date(created_at) позволяет использовать индекс
+    и отсекать лишние секции messages.
+    """
+    day = day or datetime.now(timezone.utc).date()
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
 
 def trim_old_messages(db: Session, user_id: int, keep_last: int = MAX_MESSAGES_PER_USER) -> None:
     """Удаляет самые старые сообщения пользователя, оставляя только последние keep_last.
@@ -95,3 +229,27 @@ def trim_old_messages(db: Session, user_id: int, keep_last: int = MAX_MESSAGES_P
         ids_select = select(subquery.c.id)
         db.query(Message).filter(Message.id.in_(ids_select)).delete(synchronize_session=False)
         db.commit()
+
+
+def trim_messages_for_users(db: Session, user_ids: Iterable[int], keep_last: int = MAX_MESSAGES_PER_USER) -> None:
+    """Одним DELETE оставляет каждому из пользователей только последние keep_last сообщений.
+
+    В отличие от trim_old_messages не коммитит: используется внутри пакетной
+    записи, где вставка и обрезка истории идут одной транзакцией.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+
+    ranked = (
+        select(
+            Message.id,
+            func.row_number()
+            .over(partition_by=Message.user_id, order_by=(Message.created_at.desc(), Message.id.desc()))
+            .label("position"),
+        )
+        .where(Message.user_id.in_(user_ids))
+        .subquery()
+    )
+    stale_ids = select(ranked.c.id).where(ranked.c.position > keep_last)
+    db.execute(delete(Message).where(Message.id.in_(stale_ids)))
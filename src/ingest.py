@@ -0,0 +1,385 @@
+"""Параллельная загрузка каталога или набора файлов в базу знаний.
+
+    python -m src.ingest docs/                 # все .txt/.md в каталоге рекурсивно
+    python -m src.ingest "docs/**/*.md" --workers 8 --concurrency 8
+    python -m src.ingest docs/shop/ --collection shop   # в коллекцию shop
+    python -m src.ingest docs/ --batch --wait           # эмбеддинги через Batch API
+
+Конвейер:
+- чтение, разбиение на чанки и подсчёт токенов — в пуле процессов на все ядра;
+- эмбеддинги — пакетами по INGEST_EMBED_BATCH_SIZE чанков, несколько файлов
+  параллельно, с ограничением запросов и токенов в минуту;
+- запись — документ, все его чанки (одним multi-row INSERT) и отметка в
+  ingest_checkpoints одной транзакцией на файл.
+
+Уже загруженные файлы с тем же содержимым пропускаются, поэтому прерванный
+запуск достаточно повторить. Изменившийся файл загружается заново, а его
+прежний документ удаляется. После загрузки строится частичный HNSW-индекс
+коллекции, если его ещё нет (src/knowledge_bases.py).
+
+С --batch чанки записываются без эмбеддингов и отправляются заданиями Batch
+API (src/batch_embeddings.py): до импорта результатов они не ищутся.
+"""
+
+import os
+import glob
+import hashlib
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import delete, insert, select
+
+from src.db import DEFAULT_COLLECTION, Document, DocumentChunk, IngestCheckpoint
+from src.rag import EMBEDDING_MODEL, _split_text, load_text_file
+from src.token_counter import count_tokens
+
+
+INGEST_EXTENSIONS = tuple(
+    ext.strip() for ext in os.getenv("INGEST_EXTENSIONS", ".txt,.md").split(",") if ext.strip()
+)
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+# Лимит OpenAI на запрос эмбеддингов — 300k токенов; держим запас
+INGEST_EMBED_BATCH_TOKENS = int(os.getenv("INGEST_EMBED_BATCH_TOKENS", "100000"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+INGEST_EMBED_RPM = float(os.getenv("INGEST_EMBED_RPM", "3000"))
+INGEST_EMBED_TPM = float(os.getenv("INGEST_EMBED_TPM", "1000000"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedFile:
+    source: str
+    title: str
+    content_hash: str
+    chunks: Tuple[str, ...] = ()
+    tokens: Tuple[int, ...] = ()
+    error: str | None = None
+
+
+@dataclass(slots=True)
+class IngestReport:
+    files: int = 0
+    ingested: int = 0
+    skipped: int = 0
+    failed: List[str] = field(default_factory=list)
+    chunks: int = 0
+    seconds: float = 0.0
+
+
+def discover_files(target: str, extensions: Iterable[str] = INGEST_EXTENSIONS) -> List[str]:
+    """Файлы каталога (рекурсивно, по расширениям) или результата glob-шаблона."""
+    if os.path.isdir(target):
+        extensions = tuple(extensions)
+        paths = [str(path) for path in Path(target).rglob("*") if path.is_file() and path.suffix in extensions]
+    else:
+        paths = [path for path in glob.glob(target, recursive=True) if os.path.isfile(path)]
+    return sorted(paths)
+
+
+def prepare_file(path: str) -> PreparedFile:
+    """CPU-часть загрузки одного файла; выполняется в пуле процессов."""
+    try:
+        text = load_text_file(path)
+    except (OSError, UnicodeDecodeError) as exc:
+        return PreparedFile(source=path, title=os.path.basename(path), content_hash="", error=str(exc))
+    chunks = tuple(_split_text(text))
+    return PreparedFile(
+        source=path,
+        title=os.path.basename(path),
+        content_hash=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        chunks=chunks,
+        tokens=tuple(count_tokens(chunk, EMBEDDING_MODEL) for chunk in chunks),
+    )
+
+
+class RateLimiter:
+    """Блокирующий лимит запросов и токенов в минуту (два token bucket)."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float) -> None:
+        self._rates = (requests_per_minute / 60, tokens_per_minute / 60)
+        self._capacity = (requests_per_minute, tokens_per_minute)
+        self._available = [requests_per_minute, tokens_per_minute]
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> float:
+        """Ждёт, пока можно отправить запрос на tokens токенов. Возвращает время ожидания."""
+        need = (1.0, float(min(tokens, self._capacity[1])))
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for i in range(2):
+                    self._available[i] = min(
+                        self._capacity[i], self._available[i] + (now - self._updated) * self._rates[i]
+                    )
+                self._updated = now
+                delay = max((need[i] - self._available[i]) / self._rates[i] for i in range(2))
+                if delay <= 0:
+                    for i in range(2):
+                        self._available[i] -= need[i]
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+
+def _batches(prepared: PreparedFile, batch_size: int, batch_tokens: int) -> List[Tuple[int, int, int]]:
+    """Границы пакетов (start, end, tokens) по числу чанков и токенов."""
+    batches = []
+    start = tokens = 0
+    for index, chunk_tokens in enumerate(prepared.tokens):
+        if index > start and (index - start >= batch_size or tokens + chunk_tokens > batch_tokens):
+            batches.append((start, index, tokens))
+            start, tokens = index, 0
+        tokens += chunk_tokens
+    if start < len(prepared.chunks):
+        batches.append((start, len(prepared.chunks), tokens))
+    return batches
+
+
+class Progress:
+    """Файлы/с, чанки/с и ETA; пишет в stderr не чаще раза в interval секунд."""
+
+    def __init__(self, total: int, interval: float = 1.0, stream=None) -> None:
+        self.total = total
+        self.done = 0
+        self.chunks = 0
+        self._interval = interval
+        self._stream = stream or sys.stderr
+        self._started = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, files: int = 1, chunks: int = 0) -> None:
+        self.done += files
+        self.chunks += chunks
+        now = time.perf_counter()
+        if now - self._last >= self._interval or self.done == self.total:
+            self._last = now
+            self._stream.write("\r" + self.render(now) if self._stream.isatty() else self.render(now) + "\n")
+            self._stream.flush()
+
+    def render(self, now: float | None = None) -> str:
+        elapsed = max((now or time.perf_counter()) - self._started, 1e-9)
+        files_rate = self.done / elapsed
+        eta = (self.total - self.done) / files_rate if files_rate else float("inf")
+        eta_text = f"{eta:.0f}s" if eta != float("inf") else "?"
+        return (
+            f"{self.done}/{self.total} files, {files_rate:.1f} files/s, "
+            f"{self.chunks / elapsed:.1f} chunks/s, ETA {eta_text}"
+        )
+
+
+class Ingestor:
+    def __init__(
+        self,
+        session_factory,
+        client,
+        workers: int | None = None,
+        concurrency: int = INGEST_EMBED_CONCURRENCY,
+        batch_size: int = INGEST_EMBED_BATCH_SIZE,
+        batch_tokens: int = INGEST_EMBED_BATCH_TOKENS,
+        rate_limiter: RateLimiter | None = None,
+        progress_interval: float = 1.0,
+        collection: str = DEFAULT_COLLECTION,
+        defer_embeddings: bool = False,
+    ) -> None:
+        self._session_factory = session_factory
+        self._client = client
+        self._workers = workers or os.cpu_count() or 1
+        self._concurrency = concurrency
+        self._batch_size = batch_size
+        self._batch_tokens = batch_tokens
+        self._rate_limiter = rate_limiter or RateLimiter(INGEST_EMBED_RPM, INGEST_EMBED_TPM)
+        self._progress_interval = progress_interval
+        self._collection = collection
+        # Чанки пишутся с embedding = NULL, эмбеддинги считает src/batch_embeddings.py
+        self._defer_embeddings = defer_embeddings
+
+    def _embed(self, prepared: PreparedFile) -> List[List[float] | None]:
+        if self._defer_embeddings:
+            return [None] * len(prepared.chunks)
+        embeddings: List[List[float]] = []
+        for start, end, tokens in _batches(prepared, self._batch_size, self._batch_tokens):
+            self._rate_limiter.acquire(tokens)
+            response = self._client.embeddings.create(model=EMBEDDING_MODEL, input=list(prepared.chunks[start:end]))
+            embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        if len(embeddings) != len(prepared.chunks):
+            raise ValueError(f"got {len(embeddings)} embeddings for {len(prepared.chunks)} chunks")
+        return embeddings
+
+    def _write(self, prepared: PreparedFile, embeddings: List[List[float] | None]) -> None:
+        with self._session_factory() as db:
+            checkpoint = db.execute(
+                select(IngestCheckpoint).where(IngestCheckpoint.source == prepared.source)
+            ).scalar_one_or_none()
+            if checkpoint is not None and checkpoint.document_id is not None:
+                db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == checkpoint.document_id))
+                db.execute(delete(Document).where(Document.id == checkpoint.document_id))
+
+            document = Document(title=prepared.title[:255], source=prepared.source[-255:], collection=self._collection)
+            db.add(document)
+            db.flush()
+            if prepared.chunks:
+                db.execute(
+                    insert(DocumentChunk),
+                    [
+                        {
+                            "document_id": document.id,
+                            "collection": self._collection,
+                            "chunk_index": index,
+                            "text": text,
+                            "embedding": embedding,
+                        }
+                        for index, (text, embedding) in enumerate(zip(prepared.chunks, embeddings))
+                    ],
+                )
+
+            if checkpoint is None:
+                checkpoint = IngestCheckpoint(source=prepared.source)
+                db.add(checkpoint)
+            checkpoint.content_hash = prepared.content_hash
+            checkpoint.document_id = document.id
+            checkpoint.chunks = len(prepared.chunks)
+            checkpoint.updated_at = datetime.now(timezone.utc)
+            db.commit()
+
+    def _load_checkpoints(self) -> Dict[str, str]:
+        # Файл, загруженный в другую коллекцию, загружается заново и переезжает в эту
+        with self._session_factory() as db:
+            rows = db.execute(
+                select(IngestCheckpoint.source, IngestCheckpoint.content_hash)
+                .join(Document, Document.id == IngestCheckpoint.document_id)
+                .where(Document.collection == self._collection)
+            ).all()
+            return dict(rows)
+
+    def run(self, paths: List[str]) -> IngestReport:
+        report = IngestReport(files=len(paths))
+        progress = Progress(len(paths), interval=self._progress_interval)
+        checkpoints = self._load_checkpoints()
+        started = time.perf_counter()
+        # Файлы читаются и режутся лениво: в памяти не больше max_in_flight
+        # подготовленных файлов — разбиваемых, ждущих эмбеддинга и эмбеддящихся
+        max_in_flight = self._workers + self._concurrency * 2
+        pending_paths = iter(paths)
+        preparing: Set[Future] = set()
+        in_flight: Dict[Future, PreparedFile] = {}
+
+        def accept(prepared: PreparedFile) -> None:
+            if prepared.error is not None:
+                logger.error("Failed to read %s: %s", prepared.source, prepared.error)
+                report.failed.append(prepared.source)
+                progress.update()
+            elif checkpoints.get(prepared.source) == prepared.content_hash:
+                report.skipped += 1
+                progress.update()
+            else:
+                in_flight[embed_pool.submit(self._embed, prepared)] = prepared
+
+        def collect(future: Future) -> None:
+            prepared = in_flight.pop(future)
+            try:
+                self._write(prepared, future.result())
+            except Exception as exc:  # noqa: BLE001 - файл без отметки загрузится при следующем запуске
+                logger.error("Failed to ingest %s: %s", prepared.source, exc)
+                report.failed.append(prepared.source)
+                progress.update()
+                return
+            report.ingested += 1
+            report.chunks += len(prepared.chunks)
+            progress.update(chunks=len(prepared.chunks))
+
+        with ProcessPoolExecutor(max_workers=self._workers) as cpu_pool, ThreadPoolExecutor(
+            max_workers=self._concurrency, thread_name_prefix="ingest-embed"
+        ) as embed_pool:
+            while True:
+                while len(preparing) < self._workers and len(preparing) + len(in_flight) < max_in_flight:
+                    path = next(pending_paths, None)
+                    if path is None:
+                        break
+                    preparing.add(cpu_pool.submit(prepare_file, path))
+                if not preparing and not in_flight:
+                    break
+
+                done, _ = wait(preparing | set(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in preparing:
+                        preparing.discard(future)
+                        accept(future.result())
+                    else:
+                        collect(future)
+
+        report.seconds = time.perf_counter() - started
+        return report
+
+
+def main(argv: List[str] | None = None) -> None:
+    import argparse
+
+    from src.db import SessionLocal, engine, init_db
+    from src.knowledge_bases import ensure_collection_indexes, validate_collection
+    from src.openai_factory import CALL_EMBEDDING, get_client
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", help="каталог или glob-шаблон (в кавычках)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="процессы для разбиения на чанки")
+    parser.add_argument("--concurrency", type=int, default=INGEST_EMBED_CONCURRENCY, help="параллельных файлов в эмбеддинге")
+    parser.add_argument("--batch-size", type=int, default=INGEST_EMBED_BATCH_SIZE)
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="коллекция базы знаний")
+    parser.add_argument("--batch", action="store_true", help="эмбеддинги через Batch API вместо синхронных запросов")
+    parser.add_argument("--wait", action="store_true", help="с --batch: дождаться и импортировать результаты")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    client = get_client(CALL_EMBEDDING)
+    if client is None:
+        parser.error("OPENAI_API_KEY is not set")
+
+    paths = discover_files(args.target)
+    if not paths:
+        parser.error(f"No files match {args.target}")
+
+    try:
+        validate_collection(args.collection)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    init_db()
+    report = Ingestor(
+        SessionLocal,
+        client,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        collection=args.collection,
+        defer_embeddings=args.batch,
+    ).run(paths)
+    ensure_collection_indexes(engine, [args.collection])
+    print(
+        f"Ingested {report.ingested} files ({report.chunks} chunks), skipped {report.skipped} unchanged, "
+        f"failed {len(report.failed)} in {report.seconds:.1f}s"
+    )
+    if args.batch:
+        from src.batch_embeddings import BatchEmbedder
+
+        embedder = BatchEmbedder(SessionLocal, client)
+        batch_ids = embedder.submit()
+        print(f"Submitted {len(batch_ids)} embedding batches: {', '.join(batch_ids) or 'no pending chunks'}")
+        if args.wait and batch_ids:
+            embedder.wait()
+            print(f"Chunks without embeddings: {embedder.pending_chunks()}")
+    if report.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
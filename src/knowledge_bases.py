@@ -0,0 +1,164 @@
+"""Коллекции базы знаний: отдельные наборы документов для продуктов, ботов и арендаторов.
+
+Каждый документ и каждый его чанк помечены коллекцией (колонка collection),
+и поиск идёт только внутри коллекции пользователя — его привязка хранится в
+users.collection, а для не привязанных пользователей используется
+коллекция бота RAG_COLLECTION.
+
+Чтобы фильтр по коллекции не превращал ANN-поиск в пост-фильтрацию
+(глобальный индекс отдаёт ef_search ближайших, и после фильтра от них
+почти ничего не остаётся), на каждую коллекцию строится частичный
+HNSW-индекс ``WHERE collection = '<имя>'``. Планировщик выбирает его, когда
+в запросе стоит то же условие с литералом — psycopg2 подставляет параметры
+на клиенте, поэтому search_chunks(collection=...) под него подходит.
+
+    python -m src.knowledge_bases list                       # коллекции и число чанков
+    python -m src.knowledge_bases index [коллекция ...]      # построить недостающие индексы
+    python -m src.knowledge_bases assign <telegram_id> <коллекция|->
+"""
+
+import os
+import logging
+import re
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from src.db import DEFAULT_COLLECTION
+
+
+RAG_COLLECTION = os.getenv("RAG_COLLECTION", DEFAULT_COLLECTION)
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "16"))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "64"))
+
+# Имя коллекции попадает в имя индекса и в литерал его условия, поэтому
+# допускаются только строчные латинские буквы, цифры и подчёркивание; длина
+# ограничена так, чтобы имя индекса уложилось в 63 символа Postgres
+_COLLECTION_RE = re.compile(r"^[a-z0-9_]{1,48}$")
+_INDEX_PREFIX = "ix_chunks_hnsw_"
+
+_COLLECTION_COLUMNS = (
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS collection VARCHAR(64)",
+    f"ALTER TABLE documents ADD COLUMN IF NOT EXISTS collection VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_COLLECTION}'",
+    f"ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS collection VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_COLLECTION}'",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_collection ON document_chunks (collection)",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def validate_collection(name: str) -> str:
+    if not _COLLECTION_RE.match(name):
+        raise ValueError(f"Invalid collection name {name!r}: use 1-48 characters from [a-z0-9_]")
+    return name
+
+
+def index_name(collection: str) -> str:
+    return _INDEX_PREFIX + validate_collection(collection)
+
+
+def ensure_collection_columns(conn: Connection) -> None:
+    """Добавляет колонки коллекций в таблицы, созданные до их появления."""
+    for statement in _COLLECTION_COLUMNS:
+        conn.execute(text(statement))
+
+
+def list_collections(conn: Connection) -> Dict[str, int]:
+    """Коллекции с числом чанков в каждой."""
+    rows = conn.execute(
+        text("SELECT collection, count(*) FROM document_chunks GROUP BY collection ORDER BY collection")
+    )
+    return {collection: count for collection, count in rows}
+
+
+def existing_indexes(conn: Connection) -> List[str]:
+    rows = conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = 'document_chunks' AND indexname LIKE :prefix"),
+        {"prefix": _INDEX_PREFIX + "%"},
+    )
+    return [row[0] for row in rows]
+
+
+def create_collection_index(
+    engine: Engine,
+    collection: str,
+    m: int = RAG_HNSW_M,
+    ef_construction: int = RAG_HNSW_EF_CONSTRUCTION,
+) -> None:
+    """Строит частичный HNSW-индекс коллекции, не блокируя запись (CONCURRENTLY)."""
+    name = index_name(collection)
+    statement = (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON document_chunks "
+        f"USING hnsw (embedding vector_l2_ops) WITH (m = {int(m)}, ef_construction = {int(ef_construction)}) "
+        f"WHERE collection = '{collection}'"
+    )
+    # CONCURRENTLY нельзя выполнять внутри транзакции
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(statement))
+    logger.info("HNSW index %s is ready", name)
+
+
+def drop_collection_index(engine: Engine, collection: str) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(collection)}"))
+
+
+def ensure_collection_indexes(engine: Engine, collections: Iterable[str] | None = None) -> List[str]:
+    """Строит недостающие индексы для collections (по умолчанию — для всех непустых коллекций).
+
+    Возвращает коллекции, для которых индекс был создан. На других СУБД ничего не делает.
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+
+    with engine.connect() as conn:
+        if collections is None:
+            collections = list(list_collections(conn))
+        existing = set(existing_indexes(conn))
+
+    created = []
+    for collection in collections:
+        if index_name(collection) in existing:
+            continue
+        create_collection_index(engine, collection)
+        created.append(collection)
+    return created
+
+
+def main(argv: List[str] | None = None) -> None:
+    import argparse
+
+    from src.conversation_service import ConversationService
+    from src.db import engine, init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list")
+    index_parser = commands.add_parser("index")
+    index_parser.add_argument("collections", nargs="*")
+    assign_parser = commands.add_parser("assign")
+    assign_parser.add_argument("telegram_id", type=int)
+    assign_parser.add_argument("collection", help="имя коллекции или «-», чтобы вернуть коллекцию бота")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+
+    if args.command == "list":
+        with engine.connect() as conn:
+            indexes = set(existing_indexes(conn)) if engine.dialect.name == "postgresql" else set()
+            for collection, chunks in list_collections(conn).items():
+                indexed = "indexed" if _INDEX_PREFIX + collection in indexes else "no index"
+                print(f"{collection}\t{chunks} chunks\t{indexed}")
+    elif args.command == "index":
+        created = ensure_collection_indexes(engine, [validate_collection(name) for name in args.collections] or None)
+        print(f"Created indexes for: {', '.join(created) or 'nothing, all up to date'}")
+    else:
+        collection = None if args.collection == "-" else validate_collection(args.collection)
+        ConversationService().set_collection(args.telegram_id, collection)
+        print(f"User {args.telegram_id} -> {collection or RAG_COLLECTION}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,161 @@
-from typing import List
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Sequence
 
 from aiogram import types
 
-from src.db import SessionLocal, Message, MAX_MESSAGES_PER_USER
-from src.openai_client import SYSTEM_PROMPT, generate_answer
-from src.rag import retrieve_relevant_chunks
+from src.db import SessionLocal, MAX_MESSAGES_PER_USER
+from src.openai_client import SYSTEM_PROMPT, generate_completion
+from src.rag import retrieve_passages
+from src.rag_gate import should_retrieve
 from src.conversation_service import ConversationService
+from src.model_router import ModelRouter, model_router
+from src.read_models import HistoryEntry
+from src.tracing import set_attribute, span, traced
+from src.usage_stats import PromptCacheStats, prompt_cache_stats
+
+
+# cache  — системный промпт и история идут первыми, RAG-контекст вставляется
+#          перед последним сообщением пользователя: префикс промпта стабилен
+#          между ходами и попадает в prompt cache OpenAI;
+# legacy — RAG-контекст сразу после системного промпта.
+PROMPT_LAYOUT_CACHE = "cache"
+PROMPT_LAYOUT_LEGACY = "legacy"
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", PROMPT_LAYOUT_CACHE)
+# Для скольких последних пользователей помнить начало окна истории
+HISTORY_ANCHORS_MAX = int(os.getenv("HISTORY_ANCHORS_MAX", "10000"))
+
+
+def window_history(
+    history: Sequence[HistoryEntry],
+    anchor: int | None = None,
+    limit: int = MAX_MESSAGES_PER_USER,
+) -> List[HistoryEntry]:
+    """Окно истории для промпта, которое сдвигается блоками, а не на сообщение за ход.
+
+    Окно начинается с того же сообщения (anchor — id первого сообщения
+    прошлого окна), пока в него помещается limit сообщений; затем старшая
+    половина отбрасывается целиком. Скользящее окно меняло бы префикс промпта
+    каждый ход, а так он стабилен limit/2 сообщений подряд и попадает в prompt cache.
+    """
+    history = list(history)
+    if anchor is not None:
+        for index, entry in enumerate(history):
+            if entry.id == anchor:
+                if len(history) - index <= limit:
+                    return history[index:]
+                break
+    if len(history) < limit:
+        return history
+    return history[-max(1, limit // 2):]
+
+
+def build_prompt(
+    history: Sequence[HistoryEntry],
+    rag_context: str,
+    user_text: str,
+    layout: str = PROMPT_LAYOUT,
+) -> List[dict]:
+    """Собирает сообщения для OpenAI в заданной раскладке."""
+    oa_messages: List[dict] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    dialogue = [{"role": msg.role, "content": msg.content} for msg in history[-MAX_MESSAGES_PER_USER:]]
+
+    if not rag_context:
+        return oa_messages + dialogue
+
+    context_message = {"role": "system", "content": rag_context}
+    if layout == PROMPT_LAYOUT_LEGACY:
+        return oa_messages + [context_message] + dialogue
+
+    if dialogue and dialogue[-1]["role"] == "user" and dialogue[-1]["content"] == user_text:
+        return oa_messages + dialogue[:-1] + [context_message, dialogue[-1]]
+    return oa_messages + dialogue + [context_message]
 
 
 class LLMService:
     """Сервис оркестрации LLM-ответов: контекст диалога + RAG."""
 
-    def __init__(self, conversation_service: ConversationService) -> None:
+    def __init__(
+        self,
+        conversation_service: ConversationService,
+        cache_stats: PromptCacheStats = prompt_cache_stats,
+        router: ModelRouter = model_router,
+    ) -> None:
         self._conversation_service = conversation_service
+        self._cache_stats = cache_stats
+        self._router = router
+        # id первого сообщения окна истории недавних пользователей (см. window_history), LRU
+        self._history_anchors: OrderedDict[int, int] = OrderedDict()
+        self._anchors_lock = threading.Lock()
 
+    def _get_anchor(self, user_id: int) -> int | None:
+        with self._anchors_lock:
+            return self._history_anchors.get(user_id)
+
+    def _set_anchor(self, user_id: int, message_id: int | None) -> None:
+        with self._anchors_lock:
+            if message_id is None:
+                # Окно начинается с ещё не записанного сообщения — история короткая, якорь не нужен
+                self._history_anchors.pop(user_id, None)
+                return
+            self._history_anchors[user_id] = message_id
+            self._history_anchors.move_to_end(user_id)
+            while len(self._history_anchors) > HISTORY_ANCHORS_MAX:
+                self._history_anchors.popitem(last=False)
+
+    @traced("llm.generate_reply")
     def generate_reply(self, tg_user: types.User, user_text: str) -> str:
         """Сохраняет сообщение пользователя, собирает контекст и получает ответ LLM."""
         self._conversation_service.add_user_message(tg_user, user_text)
 
-        history: List[Message] = self._conversation_service.get_history(tg_user)
+        dialogue = self._conversation_service.get_dialogue(tg_user, limit=MAX_MESSAGES_PER_USER)
+        history: List[HistoryEntry] = dialogue.history
         if not history:
             return "⚠️ Достигнут дневной лимит токенов. Попробуйте снова завтра."
+        history = window_history(history, self._get_anchor(tg_user.id))
+        self._set_anchor(tg_user.id, history[0].id)
 
         rag_context = ""
-        with SessionLocal() as db:
-            chunks = retrieve_relevant_chunks(db, user_text, limit=3)
-            if chunks:
-                joined_chunks = "\n\n---\n\n".join(chunk.text for chunk in chunks)
+        retrieve = should_retrieve(user_text)
+        set_attribute("rag.retrieve", retrieve)
+        if retrieve:
+            set_attribute("rag.collection", dialogue.collection)
+            with SessionLocal() as db:
+                passages = retrieve_passages(db, user_text, collection=dialogue.collection)
+            set_attribute("rag.passages", len(passages))
+            if passages:
+                joined_passages = "\n\n---\n\n".join(passage.text for passage in passages)
                 rag_context = (
                     "Вот релевантные фрагменты из базы знаний. Используй их при ответе, "
                     "ты можешь цитировать эти фрагменты дословно, если это полезно пользователю, "
                     "но не ссылайся напрямую на внутренние идентификаторы или пути к файлам.\n\n"
-                    f"{joined_chunks}"
+                    f"{joined_passages}"
                 )
 
-        oa_messages: List[dict] = [{"role": "system", "content": SYSTEM_PROMPT}]
-        if rag_context:
-            oa_messages.append({"role": "system", "content": rag_context})
-
-        for msg in history[-MAX_MESSAGES_PER_USER:]:
-            oa_messages.append({"role": msg.role, "content": msg.content})
+        # Без маленькой модели бюджет на выбор не влияет — не тратим на него запрос к БД
+        remaining_budget = (
+            self._conversation_service.get_remaining_daily_tokens(tg_user) if self._router.uses_budget else None
+        )
+        with span("llm.build_prompt") as prompt_span:
+            oa_messages = build_prompt(history, rag_context, user_text)
+            decision = self._router.route_messages(
+                oa_messages,
+                has_context=bool(rag_context),
+                remaining_budget=remaining_budget,
+            )
+            if prompt_span is not None:
+                prompt_span.set_attribute("prompt_tokens", decision.prompt_tokens)
+                prompt_span.set_attribute("model", decision.model)
 
-        reply_text = generate_answer(oa_messages)
+        completion = generate_completion(oa_messages, model=decision.model, fallback_model=decision.fallback)
+        self._cache_stats.record(
+            tg_user.id,
+            completion.prompt_tokens,
+            completion.cached_tokens,
+            completion.latency_seconds,
+        )
+        reply_text = completion.text
 
         self._conversation_service.add_assistant_message(tg_user, reply_text)
 
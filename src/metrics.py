@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+import numpy as np
+
+
+RESERVOIR_SIZE = 2048
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, object]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_key(key: _Key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+class _Histogram:
+    def __init__(self, reservoir_size: int) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.recent: Deque[float] = deque(maxlen=reservoir_size)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        p50, p95, p99 = np.percentile(np.fromiter(self.recent, dtype=np.float64), [50, 95, 99])
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
+
+
+class Metrics:
+    """Простейший потокобезопасный реестр счётчиков и гистограмм в памяти процесса.
+
+    Перцентили считаются по последним RESERVOIR_SIZE наблюдениям, count/mean —
+    по всем.
+    """
+
+    def __init__(self, reservoir_size: int = RESERVOIR_SIZE) -> None:
+        self._reservoir_size = reservoir_size
+        self._lock = threading.Lock()
+        self._counters: Dict[_Key, float] = {}
+        self._histograms: Dict[_Key, _Histogram] = {}
+
+    def increment(self, name: str, value: float = 1.0, **labels: object) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self._reservoir_size)
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels: object) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0.0)
+
+    def summary(self, name: str, **labels: object) -> Dict[str, float] | None:
+        with self._lock:
+            histogram = self._histograms.get(_key(name, labels))
+            return histogram.summary() if histogram is not None else None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                "counters": {_format_key(key): value for key, value in sorted(self._counters.items())},
+                "histograms": {_format_key(key): h.summary() for key, h in sorted(self._histograms.items())},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,176 @@
+import os
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List
+
+import numpy as np
+
+from src.metrics import metrics
+from src.token_counter import count_message_tokens
+
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# Пустые значения означают «использовать OPENAI_MODEL» / «без запасной модели»
+OPENAI_SMALL_MODEL = os.getenv("OPENAI_SMALL_MODEL") or None
+OPENAI_LARGE_MODEL = os.getenv("OPENAI_LARGE_MODEL") or None
+OPENAI_FALLBACK_MODEL = os.getenv("OPENAI_FALLBACK_MODEL") or None
+
+ROUTER_SMALL_MAX_TOKENS = int(os.getenv("ROUTER_SMALL_MAX_TOKENS", "600"))
+ROUTER_LARGE_MIN_TOKENS = int(os.getenv("ROUTER_LARGE_MIN_TOKENS", "6000"))
+ROUTER_LOW_BUDGET_TOKENS = int(os.getenv("ROUTER_LOW_BUDGET_TOKENS", "5000"))
+ROUTER_SLOW_P95_SECONDS = float(os.getenv("ROUTER_SLOW_P95_SECONDS", "15"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+ROUTER_COOLDOWN_SECONDS = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "60"))
+ROUTER_LATENCY_WINDOW = 50
+ROUTER_MIN_LATENCY_SAMPLES = 5
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class RouteDecision:
+    model: str
+    fallback: str | None
+    reason: str
+    prompt_tokens: int
+
+
+@dataclass(slots=True)
+class _ModelHealth:
+    latencies: Deque[float]
+    consecutive_failures: int = 0
+    unhealthy_until: float = 0.0
+
+
+class ModelRouter:
+    """Выбирает модель для запроса по размеру промпта, наличию RAG, бюджету и здоровью моделей.
+
+    - мало токенов и нет RAG-контекста или почти исчерпан дневной бюджет → small;
+    - есть RAG-контекст и длинный промпт → large;
+    - иначе → primary.
+    Если у выбранной модели p95 последних задержек выше порога или подряд
+    несколько ошибок, запрос уходит на fallback.
+    """
+
+    def __init__(
+        self,
+        primary: str = OPENAI_MODEL,
+        small: str | None = OPENAI_SMALL_MODEL,
+        large: str | None = OPENAI_LARGE_MODEL,
+        fallback: str | None = OPENAI_FALLBACK_MODEL,
+        small_max_tokens: int = ROUTER_SMALL_MAX_TOKENS,
+        large_min_tokens: int = ROUTER_LARGE_MIN_TOKENS,
+        low_budget_tokens: int = ROUTER_LOW_BUDGET_TOKENS,
+        slow_p95_seconds: float = ROUTER_SLOW_P95_SECONDS,
+        failure_threshold: int = ROUTER_FAILURE_THRESHOLD,
+        cooldown_seconds: float = ROUTER_COOLDOWN_SECONDS,
+    ) -> None:
+        self.primary = primary
+        self.small = small or primary
+        self.large = large or primary
+        self.fallback = fallback
+        self.small_max_tokens = small_max_tokens
+        self.large_min_tokens = large_min_tokens
+        self.low_budget_tokens = low_budget_tokens
+        self.slow_p95_seconds = slow_p95_seconds
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+        self._lock = threading.Lock()
+        self._health: Dict[str, _ModelHealth] = {}
+
+    @property
+    def uses_budget(self) -> bool:
+        """Влияет ли дневной бюджет пользователя на выбор модели (задана отдельная маленькая модель)."""
+        return self.small != self.primary
+
+    def _get_health(self, model: str) -> _ModelHealth:
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = _ModelHealth(latencies=deque(maxlen=ROUTER_LATENCY_WINDOW))
+        return health
+
+    def is_degraded(self, model: str) -> bool:
+        with self._lock:
+            health = self._get_health(model)
+            if health.unhealthy_until > time.monotonic():
+                return True
+            if len(health.latencies) < ROUTER_MIN_LATENCY_SAMPLES:
+                return False
+            return float(np.percentile(np.fromiter(health.latencies, dtype=np.float64), 95)) > self.slow_p95_seconds
+
+    def route(self, prompt_tokens: int, has_context: bool, remaining_budget: int | None = None) -> RouteDecision:
+        return self._route(lambda model: prompt_tokens, has_context, remaining_budget)
+
+    def route_messages(
+        self,
+        messages: List[Dict[str, str]],
+        has_context: bool,
+        remaining_budget: int | None = None,
+    ) -> RouteDecision:
+        """Выбирает модель, сравнивая с порогами размер промпта в кодировке каждой модели-кандидата."""
+        counts: Dict[str, int] = {}
+
+        def prompt_tokens(model: str) -> int:
+            if model not in counts:
+                counts[model] = count_message_tokens(messages, model)
+            return counts[model]
+
+        return self._route(prompt_tokens, has_context, remaining_budget)
+
+    def _route(
+        self, prompt_tokens: Callable[[str], int], has_context: bool, remaining_budget: int | None
+    ) -> RouteDecision:
+        if remaining_budget is not None and remaining_budget < self.low_budget_tokens:
+            model, reason = self.small, "low_budget"
+        elif not has_context and prompt_tokens(self.small) <= self.small_max_tokens:
+            model, reason = self.small, "short_chat"
+        elif has_context and prompt_tokens(self.large) >= self.large_min_tokens:
+            model, reason = self.large, "long_context"
+        else:
+            model, reason = self.primary, "default"
+
+        fallback = self.fallback if self.fallback != model else None
+        if fallback is None and model != self.primary:
+            fallback = self.primary
+
+        if fallback is not None and self.is_degraded(model):
+            model, fallback, reason = fallback, None, f"{reason}:degraded_{model}"
+
+        tokens = prompt_tokens(model)
+        metrics.increment("router.decisions", model=model, reason=reason)
+        logger.debug("Routed request (%d prompt tokens) to %s: %s", tokens, model, reason)
+        return RouteDecision(model=model, fallback=fallback, reason=reason, prompt_tokens=tokens)
+
+    def record_result(self, model: str, latency_seconds: float, success: bool) -> None:
+        """Учитывает исход одного вызова модели (для здоровья и перцентилей задержки)."""
+        metrics.observe("openai.completion_seconds", latency_seconds, model=model)
+        if not success:
+            metrics.increment("openai.failures", model=model)
+
+        with self._lock:
+            health = self._get_health(model)
+            health.latencies.append(latency_seconds)
+            if success:
+                health.consecutive_failures = 0
+                return
+            health.consecutive_failures += 1
+            if health.consecutive_failures >= self.failure_threshold:
+                health.unhealthy_until = time.monotonic() + self.cooldown_seconds
+                health.consecutive_failures = 0
+                logger.warning("Model %s marked unhealthy for %.0fs", model, self.cooldown_seconds)
+
+    def latency_percentiles(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            models = list(self._health)
+        return {
+            model: summary
+            for model in models
+            if (summary := metrics.summary("openai.completion_seconds", model=model)) is not None
+        }
+
+
+model_router = ModelRouter()
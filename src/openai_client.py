@@ -1,29 +1,18 @@
-import os
 import logging
 import time
+from dataclasses import dataclass
 from typing import List, Dict
 
-from openai import OpenAI
+from src.model_router import OPENAI_MODEL, model_router
+from src.openai_factory import CALL_COMPLETION, get_client
+from src.tracing import set_attribute, span, traced
 
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-
 logger = logging.getLogger(__name__)
 
 
-def _create_client() -> OpenAI | None:
-    """Создаёт клиента OpenAI на основе OPENAI_API_KEY.
-
-    Возвращает None, если ключ не задан.
-    """
-    if not OPENAI_API_KEY:
-        return None
-
-    return OpenAI(api_key=OPENAI_API_KEY, timeout=20.0)
-
-
-client = _create_client()
+# Клиент на общем транспорте с таймаутами для completion; None, если ключ не задан
+client = get_client(CALL_COMPLETION)
 
 
 SYSTEM_PROMPT = (
@@ -37,52 +26,117 @@ SYSTEM_PROMPT = (
 )
 
 
-def generate_answer(messages: List[Dict[str, str]]) -> str:
-    """Отправляет сообщения в OpenAI и возвращает текст ответа.
+@dataclass(frozen=True, slots=True)
+class Completion:
+    """Ответ модели вместе с учётом токенов и задержкой успешного вызова."""
+
+    text: str
+    model: str
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    latency_seconds: float = 0.0
+
+
+def _usage_value(obj, name: str) -> int:
+    return int(getattr(obj, name, None) or 0)
+
+
+@traced("openai.generate_completion")
+def generate_completion(
+    messages: List[Dict[str, str]],
+    model: str | None = None,
+    fallback_model: str | None = None,
+) -> Completion:
+    """Отправляет сообщения в OpenAI и возвращает ответ с usage.
 
     messages: список словарей вида {"role": "system|user|assistant", "content": "..."}
+    model: модель запроса (по умолчанию OPENAI_MODEL); после первой ошибки
+    повторные попытки уходят на fallback_model, если она задана.
+    При ошибке text содержит сообщение для пользователя, а счётчики токенов равны нулю.
     """
+    model = model or OPENAI_MODEL
+
     if client is None:
-        return (
-            "⚠️ OpenAI API ключ не настроен. "
-            "Добавьте OPENAI_API_KEY в переменные окружения."
+        return Completion(
+            text=(
+                "⚠️ OpenAI API ключ не настроен. "
+                "Добавьте OPENAI_API_KEY в переменные окружения."
+            ),
+            model=model,
         )
 
     max_attempts = 3
     base_delay = 1.0
 
     last_error: Exception | None = None
+    current_model = model
 
     for attempt in range(1, max_attempts + 1):
+        started = time.perf_counter()
         try:
-            response = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=messages,
-                temperature=0.4,
-            )
+            with span("openai.chat_completion", model=current_model, attempt=attempt):
+                response = client.chat.completions.create(
+                    model=current_model,
+                    messages=messages,
+                    temperature=0.4,
+                )
+            latency = time.perf_counter() - started
+            model_router.record_result(current_model, latency, success=True)
 
+            prompt_tokens = cached_tokens = completion_tokens = 0
             usage = getattr(response, "usage", None)
             if usage is not None:
+                prompt_tokens = _usage_value(usage, "prompt_tokens")
+                completion_tokens = _usage_value(usage, "completion_tokens")
+                cached_tokens = _usage_value(getattr(usage, "prompt_tokens_details", None), "cached_tokens")
+                set_attribute("prompt_tokens", prompt_tokens)
+                set_attribute("cached_tokens", cached_tokens)
+                set_attribute("completion_tokens", completion_tokens)
                 logger.info(
-                    "OpenAI usage: prompt=%s, completion=%s, total=%s",
-                    getattr(usage, "prompt_tokens", None),
-                    getattr(usage, "completion_tokens", None),
+                    "OpenAI usage: prompt=%s (cached=%s), completion=%s, total=%s",
+                    prompt_tokens,
+                    cached_tokens,
+                    completion_tokens,
                     getattr(usage, "total_tokens", None),
                 )
 
             choice = response.choices[0]
-            return choice.message.content or "Извините, не удалось сформировать ответ."
+            return Completion(
+                text=choice.message.content or "Извините, не удалось сформировать ответ.",
+                model=getattr(response, "model", None) or current_model,
+                prompt_tokens=prompt_tokens,
+                cached_tokens=cached_tokens,
+                completion_tokens=completion_tokens,
+                latency_seconds=latency,
+            )
         except Exception as exc:  # noqa: BLE001 - хотим перехватить любые сетевые/HTTP ошибки
             last_error = exc
-            logger.warning("OpenAI call failed on attempt %s/%s: %s", attempt, max_attempts, exc)
+            model_router.record_result(current_model, time.perf_counter() - started, success=False)
+            logger.warning(
+                "OpenAI call to %s failed on attempt %s/%s: %s", current_model, attempt, max_attempts, exc
+            )
 
             if attempt == max_attempts:
                 break
 
+            if fallback_model and current_model != fallback_model:
+                logger.info("Switching from %s to fallback model %s", current_model, fallback_model)
+                current_model = fallback_model
+                continue
+
             time.sleep(base_delay * attempt)
 
     logger.error("OpenAI call failed after %s attempts: %s", max_attempts, last_error)
-    return (
-        "⚠️ Ошибка при обращении к OpenAI. "
-        "Пожалуйста, проверьте API-ключ и настройки, либо попробуйте позже."
+    return Completion(
+        text=(
+            "⚠️ Ошибка при обращении к OpenAI. "
+            "Пожалуйста, проверьте API-ключ и настройки, либо попробуйте позже."
+        ),
+        model=current_model,
     )
+
+
+def generate_answer(messages: List[Dict[str, str]]) -> str:
+    """Отправляет сообщения в OpenAI и возвращает только текст ответа."""
+    return generate_completion(messages).text
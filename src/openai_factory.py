@@ -0,0 +1,180 @@
+import os
+import logging
+import threading
+import time
+from typing import Dict
+
+import httpx
+from openai import OpenAI
+
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+OPENAI_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "20"))
+OPENAI_POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "0").lower() in ("1", "true", "yes")
+
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_COMPLETION_READ_TIMEOUT = float(os.getenv("OPENAI_COMPLETION_READ_TIMEOUT", "20"))
+OPENAI_EMBEDDING_READ_TIMEOUT = float(os.getenv("OPENAI_EMBEDDING_READ_TIMEOUT", "10"))
+
+CALL_COMPLETION = "completion"
+CALL_EMBEDDING = "embedding"
+
+_READ_TIMEOUTS = {
+    CALL_COMPLETION: lambda: OPENAI_COMPLETION_READ_TIMEOUT,
+    CALL_EMBEDDING: lambda: OPENAI_EMBEDDING_READ_TIMEOUT,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class TransportStats:
+    """Счётчики переиспользования соединений и времени на TCP/TLS-установку."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.new_connections = 0
+            self.connect_seconds = 0.0
+            self.tls_seconds = 0.0
+
+    def record(self, new_connection: bool, connect_seconds: float, tls_seconds: float) -> None:
+        with self._lock:
+            self.requests += 1
+            if new_connection:
+                self.new_connections += 1
+            self.connect_seconds += connect_seconds
+            self.tls_seconds += tls_seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            reused = self.requests - self.new_connections
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reuse_rate": reused / self.requests if self.requests else 0.0,
+                "connect_ms_total": self.connect_seconds * 1000,
+                "tls_ms_total": self.tls_seconds * 1000,
+            }
+
+
+transport_stats = TransportStats()
+
+
+class _ConnectionTrace:
+    """Callback для httpcore-расширения "trace": ловит установку TCP и TLS."""
+
+    def __init__(self) -> None:
+        self.new_connection = False
+        self.connect_seconds = 0.0
+        self.tls_seconds = 0.0
+        self._started: Dict[str, float] = {}
+
+    def __call__(self, event: str, info: dict) -> None:  # noqa: ARG002 - info не нужен
+        for stage in ("connect_tcp", "start_tls"):
+            if event.endswith(f".{stage}.started"):
+                self._started[stage] = time.perf_counter()
+            elif event.endswith(f".{stage}.complete") and stage in self._started:
+                elapsed = time.perf_counter() - self._started.pop(stage)
+                if stage == "connect_tcp":
+                    self.new_connection = True
+                    self.connect_seconds += elapsed
+                else:
+                    self.tls_seconds += elapsed
+
+
+class _InstrumentedTransport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        trace = _ConnectionTrace()
+        request.extensions["trace"] = trace
+        try:
+            return super().handle_request(request)
+        finally:
+            transport_stats.record(trace.new_connection, trace.connect_seconds, trace.tls_seconds)
+            if trace.new_connection:
+                logger.debug(
+                    "New OpenAI connection to %s: connect=%.1fms, tls=%.1fms",
+                    request.url.host,
+                    trace.connect_seconds * 1000,
+                    trace.tls_seconds * 1000,
+                )
+
+
+_lock = threading.Lock()
+_http_client: httpx.Client | None = None
+_clients: Dict[str, OpenAI] = {}
+
+
+def _http2_enabled() -> bool:
+    if not OPENAI_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("OPENAI_HTTP2 is set but the 'h2' package is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def get_http_client() -> httpx.Client:
+    """Возвращает общий для всех вызовов OpenAI httpx-клиент с пулом соединений."""
+    global _http_client
+
+    with _lock:
+        if _http_client is None:
+            limits = httpx.Limits(
+                max_connections=OPENAI_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            )
+            http2 = _http2_enabled()
+            _http_client = httpx.Client(
+                transport=_InstrumentedTransport(limits=limits, http2=http2),
+                timeout=httpx.Timeout(OPENAI_COMPLETION_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                follow_redirects=True,
+            )
+        return _http_client
+
+
+def get_client(kind: str) -> OpenAI | None:
+    """Возвращает клиента OpenAI для типа вызова (CALL_COMPLETION / CALL_EMBEDDING).
+
+    Все клиенты используют один транспорт, отличаются только таймаутами.
+    Возвращает None, если OPENAI_API_KEY не задан.
+    """
+    if not OPENAI_API_KEY:
+        return None
+
+    if kind not in _READ_TIMEOUTS:
+        raise ValueError(f"Unknown OpenAI call type: {kind!r}")
+
+    http_client = get_http_client()
+    with _lock:
+        client = _clients.get(kind)
+        if client is None:
+            client = OpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=OPENAI_BASE_URL,
+                http_client=http_client,
+                timeout=httpx.Timeout(_READ_TIMEOUTS[kind](), connect=OPENAI_CONNECT_TIMEOUT),
+            )
+            _clients[kind] = client
+        return client
+
+
+def close_clients() -> None:
+    """Закрывает общий транспорт (вызывается при остановке бота)."""
+    global _http_client
+
+    with _lock:
+        _clients.clear()
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
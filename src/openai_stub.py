@@ -0,0 +1,761 @@
+"""Локальный OpenAI-совместимый сервер-заглушка для офлайн-запусков и нагрузочных тестов.
+
+Реализует /v1/chat/completions (в том числе stream), /v1/embeddings,
+/v1/models/{model}, а также /v1/files и /v1/batches для пакетных
+эмбеддингов (Batch API с endpoint /v1/embeddings; задание завершается через
+batch_seconds после создания, во время очередного опроса). Ответы детерминированы: текст зависит только от промпта,
+эмбеддинги — хэши слов и символьных триграмм. Поля usage заполняются как у
+OpenAI, включая prompt_tokens_details.cached_tokens (префиксы от 1024 токенов
+с шагом 128 «кэшируются» между запросами).
+
+Задержки, ограничения пропускной способности, 429 с Retry-After, 500 и
+зависания настраиваются флагами. Бот переключается на заглушку через
+OPENAI_BASE_URL:
+
+    python -m src.openai_stub --port 8089 --latency-ms 300 --latency-distribution lognormal
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python -m src.bot
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.db import EMBEDDING_DIM
+from src.token_counter import TOKENS_PER_MESSAGE, TOKENS_PER_REPLY, count_tokens
+
+
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+_PROMPT_CACHE_SIZE = 10000
+
+_REPLY_WORDS = (
+    "ответ", "заглушки", "проверка", "нагрузки", "бот", "контекст", "документ",
+    "пользователь", "сообщение", "токен", "запрос", "модель", "данные", "пример",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def hash_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Детерминированный нормированный эмбеддинг: хэширование слов и символьных триграмм.
+
+    Тексты с общими словами получаются близкими, поэтому поиск по таким
+    векторам ведёт себя правдоподобно.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    words = text.lower().split()
+    features = words + [text[i : i + 3].lower() for i in range(0, max(len(text) - 2, 0), 2)]
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass(slots=True)
+class LatencyModel:
+    """Распределение задержки: fixed, uniform (median ± spread мс) или lognormal (медиана, sigma = spread)."""
+
+    distribution: str = "fixed"
+    median_ms: float = 0.0
+    spread: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        if self.distribution == "uniform":
+            value = rng.uniform(max(0.0, self.median_ms - self.spread), self.median_ms + self.spread)
+        elif self.distribution == "lognormal":
+            value = self.median_ms * math.exp(rng.gauss(0.0, self.spread))
+        else:
+            value = self.median_ms
+        return value / 1000
+
+
+@dataclass(slots=True)
+class StubConfig:
+    # Задержка до первого токена ответа / до ответа на запрос эмбеддингов
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    # Скорость генерации ответа, токенов в секунду (0 — мгновенно)
+    tokens_per_second: float = 0.0
+    # Длина ответа в словах (max_tokens запроса ограничивает её сверху)
+    reply_words: int = 60
+    # Ограничения пропускной способности (0 — без ограничения); сверх них — 429
+    max_rps: float = 0.0
+    max_tokens_per_minute: int = 0
+    max_concurrency: int = 0
+    # Доли запросов с искусственными ошибками
+    error_rate_429: float = 0.0
+    error_rate_500: float = 0.0
+    timeout_rate: float = 0.0
+    retry_after: float = 1.0
+    # Сколько «висит» запрос при имитации таймаута, прежде чем соединение закроется
+    timeout_seconds: float = 30.0
+    embedding_dim: int = EMBEDDING_DIM
+    # Batch API: через сколько секунд после создания задание завершается и
+    # какая доля его запросов попадает в файл ошибок
+    batch_seconds: float = 0.0
+    batch_failure_rate: float = 0.0
+    seed: int = 0
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self, amount: float = 1.0) -> float:
+        """Забирает amount токенов. Возвращает 0 или сколько секунд ждать до их появления."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            amount = min(amount, self._capacity)
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self._rate
+
+
+class _PromptCache:
+    """Имитация prompt cache: помнит хэши уже встречавшихся префиксов промпта."""
+
+    def __init__(self, size: int = _PROMPT_CACHE_SIZE) -> None:
+        self._size = size
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached_tokens(self, prefixes: List[Tuple[str, int]]) -> int:
+        """prefixes — (хэш, токены) для каждого префикса по сообщениям, от короткого к длинному."""
+        with self._lock:
+            hit = 0
+            for digest, tokens in prefixes:
+                if digest in self._seen:
+                    self._seen.move_to_end(digest)
+                    hit = tokens
+                self._seen[digest] = None
+            while len(self._seen) > self._size:
+                self._seen.popitem(last=False)
+
+        if hit < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return PROMPT_CACHE_MIN_TOKENS + (hit - PROMPT_CACHE_MIN_TOKENS) // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT
+
+
+class StubStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def increment(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class _InjectedFailure(Exception):
+    def __init__(self, status: int, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class OpenAIStub:
+    """Поведение заглушки без HTTP: лимиты, ошибки, генерация ответов и эмбеддингов."""
+
+    def __init__(self, config: StubConfig | None = None) -> None:
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self._rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self._prompt_cache = _PromptCache()
+        self._rps = _TokenBucket(self.config.max_rps, max(1.0, self.config.max_rps)) if self.config.max_rps else None
+        self._tpm = (
+            _TokenBucket(self.config.max_tokens_per_minute / 60, self.config.max_tokens_per_minute)
+            if self.config.max_tokens_per_minute
+            else None
+        )
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._files: Dict[str, dict] = {}
+        self._file_contents: Dict[str, bytes] = {}
+        self._batches: Dict[str, dict] = {}
+        self._storage_lock = threading.Lock()
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def sample_latency(self) -> float:
+        with self._rng_lock:
+            return self.config.latency.sample(self._rng)
+
+    def admit(self, tokens: int) -> None:
+        """Проверяет лимиты и случайные ошибки до обработки запроса; бросает _InjectedFailure."""
+        config = self.config
+        if self._random() < config.timeout_rate:
+            self.stats.increment("injected_timeout")
+            time.sleep(config.timeout_seconds)
+            raise _InjectedFailure(0, "timeout")
+        if self._random() < config.error_rate_429:
+            raise _InjectedFailure(429, "Rate limit reached (injected)", config.retry_after)
+        if self._random() < config.error_rate_500:
+            raise _InjectedFailure(500, "The server had an error (injected)")
+        if self._rps is not None and (wait := self._rps.try_take()) > 0:
+            raise _InjectedFailure(429, "Requests per second limit reached", wait)
+        if self._tpm is not None and (wait := self._tpm.try_take(tokens)) > 0:
+            raise _InjectedFailure(429, "Tokens per minute limit reached", wait)
+
+    def enter(self) -> None:
+        with self._active_lock:
+            if self.config.max_concurrency and self._active >= self.config.max_concurrency:
+                raise _InjectedFailure(429, "Too many concurrent requests", self.config.retry_after)
+            self._active += 1
+
+    def leave(self) -> None:
+        with self._active_lock:
+            self._active -= 1
+
+    def prompt_usage(self, messages: List[dict], model: str) -> Tuple[int, int]:
+        """Токены промпта и сколько из них «попало в кэш»."""
+        prefixes = []
+        total = TOKENS_PER_REPLY
+        digest = hashlib.blake2b(model.encode("utf-8"), digest_size=16)
+        for message in messages:
+            content = message.get("content") or ""
+            if not isinstance(content, str):
+                content = json.dumps(content, ensure_ascii=False)
+            total += TOKENS_PER_MESSAGE + count_tokens(content, model)
+            digest.update(json.dumps([message.get("role"), content], ensure_ascii=False).encode("utf-8"))
+            prefixes.append((digest.copy().hexdigest(), total))
+        return total, self._prompt_cache.cached_tokens(prefixes)
+
+    def reply_text(self, messages: List[dict], max_tokens: int | None) -> str:
+        """Детерминированный ответ: зависит только от последнего сообщения пользователя."""
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        if not isinstance(last_user, str):
+            last_user = json.dumps(last_user, ensure_ascii=False)
+        rng = random.Random(hashlib.blake2b(last_user.encode("utf-8"), digest_size=8).digest())
+        words = max(1, min(self.config.reply_words, max_tokens or self.config.reply_words))
+        snippet = " ".join(last_user.split()[:8])
+        filler = " ".join(rng.choice(_REPLY_WORDS) for _ in range(words))
+        return f"Ответ на «{snippet}»: {filler}."
+
+    def embeddings(self, inputs: List[str], dimensions: int | None) -> List[np.ndarray]:
+        return [hash_embedding(text, dimensions or self.config.embedding_dim) for text in inputs]
+
+    def embedding_response(self, request: dict) -> dict:
+        """Тело ответа /v1/embeddings; ValueError — некорректный запрос (400)."""
+        model = request.get("model") or "text-embedding-3-small"
+        inputs = request.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not inputs or not all(isinstance(item, str) for item in inputs):
+            raise ValueError("input must be a string or a list of strings")
+
+        prompt_tokens = sum(count_tokens(item, model) for item in inputs)
+        base64_format = request.get("encoding_format") == "base64"
+        data = []
+        for index, vector in enumerate(self.embeddings(inputs, request.get("dimensions"))):
+            embedding = (
+                base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii") if base64_format else vector.tolist()
+            )
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": model,
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+    def upload_file(self, filename: str, purpose: str, content: bytes) -> dict:
+        file = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self._storage_lock:
+            self._files[file["id"]] = file
+            self._file_contents[file["id"]] = content
+        return file
+
+    def file(self, file_id: str) -> dict | None:
+        with self._storage_lock:
+            return self._files.get(file_id)
+
+    def file_content(self, file_id: str) -> bytes | None:
+        with self._storage_lock:
+            return self._file_contents.get(file_id)
+
+    def create_batch(self, request: dict) -> dict:
+        """Создаёт задание; ValueError — неизвестный файл или неподдерживаемый endpoint."""
+        if request.get("endpoint") != "/v1/embeddings":
+            raise ValueError("Only /v1/embeddings batches are supported by the stub")
+        if self.file(request.get("input_file_id") or "") is None:
+            raise ValueError(f"No such file: {request.get('input_file_id')}")
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": request["endpoint"],
+            "errors": None,
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window") or "24h",
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": now,
+            "expires_at": now + 24 * 3600,
+            "completed_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+            "_due": time.monotonic() + self.config.batch_seconds,
+            "_started": False,
+        }
+        with self._storage_lock:
+            self._batches[batch["id"]] = batch
+        return self._public_batch(batch)
+
+    def batch(self, batch_id: str) -> dict | None:
+        """Состояние задания; пришедшее время задание обрабатывается прямо во время опроса."""
+        with self._storage_lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            due = batch["status"] == "in_progress" and not batch["_started"] and time.monotonic() >= batch["_due"]
+            if due:
+                batch["_started"] = True
+        if due:
+            self._run_batch(batch)
+        return self._public_batch(batch)
+
+    def cancel_batch(self, batch_id: str) -> dict | None:
+        with self._storage_lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            if batch["status"] == "in_progress":
+                batch["status"] = "cancelled"
+                batch["cancelled_at"] = int(time.time())
+        return self._public_batch(batch)
+
+    @staticmethod
+    def _public_batch(batch: dict) -> dict:
+        return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+    def _run_batch(self, batch: dict) -> None:
+        outputs: List[str] = []
+        errors: List[str] = []
+        for line in (self.file_content(batch["input_file_id"]) or b"").decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            status, body = 200, None
+            if request.get("url") != batch["endpoint"]:
+                status, body = 400, {"error": {"message": "url does not match batch endpoint", "type": "invalid_request_error"}}
+            elif self._random() < self.config.batch_failure_rate:
+                status, body = 500, {"error": {"message": "The server had an error (injected)", "type": "server_error"}}
+            else:
+                try:
+                    body = self.embedding_response(request.get("body") or {})
+                except ValueError as exc:
+                    status, body = 400, {"error": {"message": str(exc), "type": "invalid_request_error"}}
+            result = {
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": request.get("custom_id"),
+                "response": {"status_code": status, "request_id": uuid.uuid4().hex, "body": body},
+                "error": None,
+            }
+            (outputs if status == 200 else errors).append(json.dumps(result, ensure_ascii=False))
+
+        output = error = None
+        if outputs:
+            output = self.upload_file(f"{batch['id']}_output.jsonl", "batch_output", "\n".join(outputs).encode("utf-8"))
+        if errors:
+            error = self.upload_file(f"{batch['id']}_error.jsonl", "batch_output", "\n".join(errors).encode("utf-8"))
+        with self._storage_lock:
+            # Задание могли отменить, пока оно обрабатывалось
+            if batch["status"] != "in_progress":
+                return
+            batch["output_file_id"] = output["id"] if output else None
+            batch["error_file_id"] = error["id"] if error else None
+            batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_StubHTTPServer"
+
+    def log_message(self, format: str, *args) -> None:  # noqa: A002 - сигнатура базового класса
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, payload: dict, headers: Dict[str, str] | None = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, failure: _InjectedFailure) -> None:
+        stub = self.server.stub
+        if failure.status == 0:
+            # Имитация зависшего сервера: соединение закрывается без ответа
+            self.close_connection = True
+            return
+        stub.stats.increment(f"status_{failure.status}")
+        headers = {}
+        if failure.retry_after is not None:
+            headers["Retry-After"] = f"{max(failure.retry_after, 0.001):.3f}"
+            headers["Retry-After-Ms"] = str(max(1, round(failure.retry_after * 1000)))
+        error_type = "rate_limit_exceeded" if failure.status == 429 else "server_error"
+        self._send_json(failure.status, {"error": {"message": str(failure), "type": error_type, "code": error_type}}, headers)
+
+    def _send_not_found(self, message: str | None = None) -> None:
+        self._send_json(404, {"error": {"message": message or f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _send_bad_request(self, message: str) -> None:
+        self._send_json(400, {"error": {"message": message, "type": "invalid_request_error"}})
+
+    def do_GET(self) -> None:  # noqa: N802 - имя задано http.server
+        stub = self.server.stub
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if self.path == "/stub/stats":
+            self._send_json(200, stub.stats.snapshot())
+        elif self.path.startswith("/v1/models/"):
+            model = self.path[len("/v1/models/") :]
+            self._send_json(200, {"id": model, "object": "model", "created": 0, "owned_by": "stub"})
+        elif parts[:2] == ["v1", "files"] and len(parts) in (3, 4):
+            stub.stats.increment("/v1/files/{id}" if len(parts) == 3 else "/v1/files/{id}/content")
+            self._get_file(parts[2], content=len(parts) == 4 and parts[3] == "content")
+        elif parts[:2] == ["v1", "batches"] and len(parts) == 3:
+            stub.stats.increment("/v1/batches/{id}")
+            batch = stub.batch(parts[2])
+            if batch is None:
+                self._send_not_found(f"No such batch: {parts[2]}")
+            else:
+                self._send_json(200, batch)
+        else:
+            self._send_not_found()
+
+    def do_POST(self) -> None:  # noqa: N802 - имя задано http.server
+        stub = self.server.stub
+        handlers = {
+            "/v1/chat/completions": self._chat_completions,
+            "/v1/embeddings": self._embeddings,
+            "/v1/files": self._upload_file,
+            "/v1/batches": self._create_batch,
+        }
+        handler = handlers.get(self.path)
+        parts = self.path.strip("/").split("/")
+        if handler is None and parts[:2] == ["v1", "batches"] and parts[3:] == ["cancel"]:
+            stub.stats.increment("/v1/batches/{id}/cancel")
+            batch = stub.cancel_batch(parts[2])
+            if batch is None:
+                self._send_not_found(f"No such batch: {parts[2]}")
+            else:
+                self._send_json(200, batch)
+            return
+        if handler is None:
+            self._send_not_found()
+            return
+
+        stub.stats.increment(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        # Загрузка файла приходит как multipart/form-data, остальные запросы — JSON
+        request = body if self.path == "/v1/files" else json.loads(body or b"{}")
+        try:
+            stub.enter()
+        except _InjectedFailure as failure:
+            self._send_error(failure)
+            return
+        try:
+            handler(request)
+        except _InjectedFailure as failure:
+            self._send_error(failure)
+        finally:
+            stub.leave()
+
+    def _get_file(self, file_id: str, content: bool) -> None:
+        stub = self.server.stub
+        file = stub.file(file_id)
+        if file is None:
+            self._send_not_found(f"No such file: {file_id}")
+            return
+        if not content:
+            self._send_json(200, file)
+            return
+        data = stub.file_content(file_id) or b""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _upload_file(self, body: bytes) -> None:
+        stub = self.server.stub
+        stub.admit(0)
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("latin-1") + body
+        )
+        fields: Dict[str, Tuple[str | None, bytes]] = {}
+        for part in message.iter_parts() if message.is_multipart() else []:
+            name = part.get_param("name", header="content-disposition")
+            if name:
+                fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+        if "file" not in fields:
+            self._send_bad_request("multipart field 'file' is required")
+            return
+        filename, content = fields["file"]
+        purpose = fields.get("purpose", (None, b"batch"))[1].decode("utf-8")
+        stub.stats.increment("status_200")
+        self._send_json(200, stub.upload_file(filename or "upload.jsonl", purpose, content))
+
+    def _create_batch(self, request: dict) -> None:
+        stub = self.server.stub
+        stub.admit(0)
+        try:
+            batch = stub.create_batch(request)
+        except ValueError as exc:
+            self._send_bad_request(str(exc))
+            return
+        stub.stats.increment("status_200")
+        self._send_json(200, batch)
+
+    def _chat_completions(self, request: dict) -> None:
+        stub = self.server.stub
+        model = request.get("model") or "gpt-4o-mini"
+        messages = request.get("messages") or []
+        prompt_tokens, cached_tokens = stub.prompt_usage(messages, model)
+        stub.admit(prompt_tokens)
+
+        text = stub.reply_text(messages, request.get("max_completion_tokens") or request.get("max_tokens"))
+        completion_tokens = count_tokens(text, model)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens, "audio_tokens": 0},
+            "completion_tokens_details": {"reasoning_tokens": 0, "audio_tokens": 0},
+        }
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        time.sleep(stub.sample_latency())
+        generation_seconds = completion_tokens / stub.config.tokens_per_second if stub.config.tokens_per_second else 0.0
+
+        if not request.get("stream"):
+            time.sleep(generation_seconds)
+            stub.stats.increment("status_200")
+            self._send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text, "refusal": None},
+                            "logprobs": None,
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                    "system_fingerprint": "fp_stub",
+                },
+            )
+            return
+
+        include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+        self._stream_completion(completion_id, created, model, text, usage if include_usage else None, generation_seconds)
+
+    def _stream_completion(
+        self,
+        completion_id: str,
+        created: int,
+        model: str,
+        text: str,
+        usage: dict | None,
+        generation_seconds: float,
+    ) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta: dict, finish_reason: str | None = None, chunk_usage: dict | None = None) -> dict:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}]
+                if chunk_usage is None
+                else [],
+                "usage": chunk_usage,
+            }
+
+        def send_event(payload: dict | str) -> None:
+            data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+            event = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+
+        pieces = [word + " " for word in text.split(" ")]
+        pieces[-1] = pieces[-1].rstrip()
+        delay = generation_seconds / len(pieces)
+
+        send_event(chunk({"role": "assistant", "content": ""}))
+        for piece in pieces:
+            time.sleep(delay)
+            send_event(chunk({"content": piece}))
+        send_event(chunk({}, finish_reason="stop"))
+        if usage is not None:
+            send_event(chunk({}, chunk_usage=usage))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.server.stub.stats.increment("status_200")
+
+    def _embeddings(self, request: dict) -> None:
+        stub = self.server.stub
+        try:
+            response = stub.embedding_response(request)
+        except ValueError as exc:
+            self._send_bad_request(str(exc))
+            return
+
+        stub.admit(response["usage"]["prompt_tokens"])
+        time.sleep(stub.sample_latency())
+        stub.stats.increment("status_200")
+        self._send_json(200, response)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], stub: OpenAIStub) -> None:
+        super().__init__(address, _Handler)
+        self.stub = stub
+
+
+class StubServer:
+    """Заглушка в фоновом потоке текущего процесса (для тестов и бенчмарков).
+
+    port=0 — свободный порт; base_url подставляется в OPENAI_BASE_URL.
+    """
+
+    def __init__(self, config: StubConfig | None = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.stub = OpenAIStub(config)
+        self._server = _StubHTTPServer((host, port), self.stub)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="openai-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="медиана задержки до первого токена")
+    parser.add_argument("--latency-distribution", choices=("fixed", "uniform", "lognormal"), default="fixed")
+    parser.add_argument("--latency-spread", type=float, default=0.0, help="uniform: ± мс, lognormal: sigma")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--max-rps", type=float, default=0.0)
+    parser.add_argument("--max-tpm", type=int, default=0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-500", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=30.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--batch-seconds", type=float, default=0.0, help="время выполнения задания Batch API")
+    parser.add_argument("--batch-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = StubConfig(
+        latency=LatencyModel(args.latency_distribution, args.latency_ms, args.latency_spread),
+        tokens_per_second=args.tokens_per_second,
+        reply_words=args.reply_words,
+        max_rps=args.max_rps,
+        max_tokens_per_minute=args.max_tpm,
+        max_concurrency=args.max_concurrency,
+        error_rate_429=args.error_rate_429,
+        error_rate_500=args.error_rate_500,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        retry_after=args.retry_after,
+        batch_seconds=args.batch_seconds,
+        batch_failure_rate=args.batch_failure_rate,
+        seed=args.seed,
+    )
+    server = _StubHTTPServer((args.host, args.port), OpenAIStub(config))
+    logger.info("OpenAI stub listening on http://%s:%d/v1", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""Помесячные секции таблицы messages в Postgres: создание, миграция и retention.
+
+Таблица messages секционирована по диапазону created_at, по секции
+messages_pYYYYMM на месяц. Секции создаются заранее на
+MESSAGES_PARTITIONS_AHEAD месяцев вперёд, а секции старше
+MESSAGES_RETENTION_MONTHS целиком отсоединяются и удаляются (перед этим
+при заданном MESSAGES_ARCHIVE_DIR выгружаются в сжатый CSV) — без
+построчных DELETE и последующего VACUUM.
+
+Секция по умолчанию messages_default принимает сообщения, для месяца которых
+секции ещё нет (например, обслуживание не успело до смены месяца), так что
+вставки не падают. Когда секция месяца создаётся, его строки переносятся
+из messages_default в неё.
+
+    python -m src.partitions migrate   # перевод существующей таблицы на секции
+    python -m src.partitions maintain  # создать будущие секции и применить retention
+"""
+
+import os
+import gzip
+import logging
+import re
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", "2"))
+# 0 — хранить сообщения бессрочно
+MESSAGES_RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", "12"))
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR") or None
+MESSAGES_MAINTENANCE_INTERVAL = float(os.getenv("MESSAGES_MAINTENANCE_INTERVAL", "21600"))
+
+PARENT_TABLE = "messages"
+DEFAULT_PARTITION = "messages_default"
+_PARTITION_RE = re.compile(r"^messages_p(\d{4})(\d{2})$")
+
+logger = logging.getLogger(__name__)
+
+# Повторяет модель Message, но с первичным ключом (id, created_at): в
+# секционированной таблице ключ обязан включать ключ секционирования.
+# Последовательность messages_id_seq та же, что создаёт create_all для SERIAL,
+# поэтому при миграции нумерация id продолжается.
+_CREATE_PARTITIONED_MESSAGES = (
+    "CREATE SEQUENCE IF NOT EXISTS messages_id_seq",
+    """
+    CREATE TABLE messages (
+        id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        role VARCHAR(32) NOT NULL,
+        content TEXT NOT NULL,
+        token_count INTEGER NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """,
+    "CREATE INDEX ix_messages_id ON messages (id)",
+    "CREATE INDEX ix_messages_created_at ON messages (created_at)",
+    "CREATE INDEX ix_messages_user_id_created_at ON messages (user_id, created_at)",
+    "ALTER SEQUENCE messages_id_seq OWNED BY messages.id",
+    f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF messages DEFAULT",
+)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_p{month:%Y%m}"
+
+
+def parse_partition_name(name: str) -> date | None:
+    """Месяц секции по её имени или None, если это не помесячная секция."""
+    match = _PARTITION_RE.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def expired_partitions(
+    partitions: List[Tuple[str, date]],
+    today: date,
+    retention_months: int = MESSAGES_RETENTION_MONTHS,
+) -> List[str]:
+    """Секции, все сообщения которых старше retention_months полных месяцев."""
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(today), -retention_months)
+    return [name for name, month in sorted(partitions, key=lambda item: item[1]) if add_months(month, 1) <= cutoff]
+
+
+def table_exists(conn: Connection, name: str) -> bool:
+    return bool(conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar())
+
+
+def is_partitioned(conn: Connection, name: str = PARENT_TABLE) -> bool:
+    return bool(
+        conn.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.oid = to_regclass(:name))"
+            ),
+            {"name": name},
+        ).scalar()
+    )
+
+
+def list_partitions(conn: Connection) -> List[Tuple[str, date]]:
+    """Помесячные секции messages с их месяцами."""
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:parent)"
+        ),
+        {"parent": PARENT_TABLE},
+    ).scalars()
+    partitions = []
+    for name in rows:
+        month = parse_partition_name(name)
+        if month is not None:
+            partitions.append((name, month))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def create_partition(conn: Connection, month: date) -> str:
+    """Создаёт секцию месяца, перенося в неё строки этого месяца из секции по умолчанию."""
+    name = partition_name(month)
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    in_month = {"start": month, "end": add_months(month, 1)}
+    stray = table_exists(conn, DEFAULT_PARTITION) and conn.execute(
+        text(
+            f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+            "WHERE created_at >= :start AND created_at < :end)"
+        ),
+        in_month,
+    ).scalar()
+    if not stray:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} {bounds}"))
+        return name
+
+    # Секцию нельзя создать, пока такие строки лежат в секции по умолчанию:
+    # создаём отдельную таблицу, переносим строки и присоединяем её
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end "
+            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+        ),
+        in_month,
+    ).rowcount
+    conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} {bounds}"))
+    logger.warning("Moved %d messages from %s to the new partition %s", moved, DEFAULT_PARTITION, name)
+    return name
+
+
+def ensure_partitions(
+    conn: Connection,
+    ahead: int = MESSAGES_PARTITIONS_AHEAD,
+    start: date | None = None,
+    today: date | None = None,
+) -> List[str]:
+    """Создаёт недостающие секции от start (по умолчанию текущий месяц) до today + ahead месяцев."""
+    current = month_start(today or datetime.now(timezone.utc).date())
+    month = month_start(start) if start is not None else current
+    # Таблицы, созданные до появления секции по умолчанию
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"))
+    existing = {name for name, _ in list_partitions(conn)}
+    created = []
+    while month <= add_months(current, ahead):
+        name = partition_name(month)
+        if name not in existing:
+            create_partition(conn, month)
+            created.append(name)
+        month = add_months(month, 1)
+    if created:
+        logger.info("Created message partitions: %s", ", ".join(created))
+    return created
+
+
+def create_partitioned_messages(conn: Connection) -> None:
+    """Создаёт пустую секционированную таблицу messages с секциями на ближайшие месяцы."""
+    for statement in _CREATE_PARTITIONED_MESSAGES:
+        conn.execute(text(statement))
+    ensure_partitions(conn)
+
+
+def migrate_to_partitioned(engine: Engine) -> bool:
+    """Переводит таблицу messages, созданную create_all, на помесячные секции.
+
+    Всё выполняется одной транзакцией под эксклюзивной блокировкой: старая
+    таблица переименовывается, создаётся секционированная, данные копируются,
+    старая удаляется. Возвращает False, если переводить нечего.
+    """
+    with engine.begin() as conn:
+        if not table_exists(conn, PARENT_TABLE) or is_partitioned(conn):
+            return False
+
+        conn.execute(text("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE"))
+        oldest = conn.execute(text("SELECT min(created_at) FROM messages")).scalar()
+
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_legacy"))
+        conn.execute(text("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_messages_id, ix_messages_created_at, ix_messages_user_id_created_at"))
+        # Иначе последовательность удалится вместе со старой таблицей
+        conn.execute(text("ALTER SEQUENCE messages_id_seq OWNED BY NONE"))
+
+        for statement in _CREATE_PARTITIONED_MESSAGES:
+            conn.execute(text(statement))
+        ensure_partitions(conn, start=oldest.date() if oldest is not None else None)
+
+        copied = conn.execute(
+            text(
+                "INSERT INTO messages (id, user_id, role, content, token_count, created_at) "
+                "SELECT id, user_id, role, content, token_count, created_at FROM messages_legacy"
+            )
+        ).rowcount
+        conn.execute(text("DROP TABLE messages_legacy"))
+
+    logger.info("Migrated %d messages to the partitioned table", copied)
+    return True
+
+
+def archive_partition(engine: Engine, name: str, archive_dir: str) -> Path:
+    """Выгружает секцию в archive_dir/<name>.csv.gz (COPY, с заголовком)."""
+    if parse_partition_name(name) is None:
+        raise ValueError(f"Not a message partition: {name}")
+
+    path = Path(archive_dir) / f"{name}.csv.gz"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".gz.tmp")
+
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor, gzip.open(tmp_path, "wt", encoding="utf-8") as archive:
+            cursor.copy_expert(f"COPY (SELECT * FROM {name} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+        raw.commit()
+    finally:
+        raw.close()
+
+    tmp_path.replace(path)
+    return path
+
+
+def apply_retention(
+    engine: Engine,
+    retention_months: int = MESSAGES_RETENTION_MONTHS,
+    archive_dir: str | None = MESSAGES_ARCHIVE_DIR,
+    today: date | None = None,
+) -> List[str]:
+    """Отсоединяет и удаляет устаревшие секции, при archive_dir — после выгрузки в архив."""
+    with engine.connect() as conn:
+        expired = expired_partitions(
+            list_partitions(conn), today or datetime.now(timezone.utc).date(), retention_months
+        )
+
+    dropped = []
+    for name in expired:
+        if archive_dir:
+            path = archive_partition(engine, name, archive_dir)
+            logger.info("Archived partition %s to %s", name, path)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+        logger.info("Dropped expired partition %s", name)
+    return dropped
+
+
+def maintain_partitions(engine: Engine | None = None) -> Dict[str, List[str]]:
+    """Периодическое обслуживание: секции наперёд и retention. В SQLite ничего не делает."""
+    if engine is None:
+        from src.db import engine
+
+    if engine.dialect.name != "postgresql":
+        return {"created": [], "dropped": []}
+
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return {"created": [], "dropped": []}
+        created = ensure_partitions(conn)
+
+    return {"created": created, "dropped": apply_retention(engine)}
+
+
+if __name__ == "__main__":
+    import sys
+
+    from src.db import engine, init_db
+
+    logging.basicConfig(level=logging.INFO)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "migrate":
+        migrated = migrate_to_partitioned(engine)
+        init_db()
+        print("Migrated" if migrated else "Nothing to migrate")
+    elif command == "maintain":
+        print(maintain_partitions(engine))
+    else:
+        print("Usage: python -m src.partitions migrate|maintain")
+        raise SystemExit(1)
@@ -0,0 +1,106 @@
+"""Профилирование живого процесса по запросу администратора.
+
+Статистический профайлер: фоновый поток раз в PROFILE_INTERVAL_MS снимает
+стеки всех потоков (sys._current_frames), поэтому видна и работа в пуле
+asyncio.to_thread, и event loop — cProfile профилирует только поток, где
+включён. Результат пишется в PROFILE_DIR в формате collapsed stacks
+(«f1;f2;f3 N» — вход для flamegraph.pl, speedscope, inferno).
+"""
+
+import os
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Tuple
+
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+# Длительность профилирования по сигналу SIGUSR1
+PROFILE_SIGNAL_SECONDS = float(os.getenv("PROFILE_SIGNAL_SECONDS", "30"))
+ADMIN_USER_IDS = frozenset(int(value) for value in os.getenv("ADMIN_USER_IDS", "").split(",") if value.strip())
+
+logger = logging.getLogger(__name__)
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_USER_IDS
+
+
+@dataclass(frozen=True, slots=True)
+class ProfileResult:
+    path: Path
+    samples: int
+    seconds: float
+    top: List[Tuple[str, int]]
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Один сеанс профилирования за раз; повторный запуск во время сеанса отклоняется."""
+
+    def __init__(self, output_dir: str = PROFILE_DIR, interval_ms: float = PROFILE_INTERVAL_MS) -> None:
+        self.output_dir = Path(output_dir)
+        self.interval = interval_ms / 1000
+        self._running = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._running.locked()
+
+    def run(self, seconds: float, top: int = 10) -> ProfileResult | None:
+        """Сэмплирует стеки seconds секунд и пишет профиль. None — уже идёт другой сеанс."""
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            return self._run(min(seconds, PROFILE_MAX_SECONDS), top)
+        finally:
+            self._running.release()
+
+    def _run(self, seconds: float, top: int) -> ProfileResult:
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        self_time: Counter = Counter()
+        samples = 0
+
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if not labels:
+                    continue
+                self_time[labels[0]] += 1
+                labels.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        elapsed = time.perf_counter() - started
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / f"profile-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.folded"
+        with path.open("w", encoding="utf-8") as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+        logger.info("Profile with %d samples over %.1fs written to %s", samples, elapsed, path)
+        return ProfileResult(path=path, samples=samples, seconds=elapsed, top=self_time.most_common(top))
+
+
+profiler = SamplingProfiler()
@@ -1,22 +1,38 @@
 import os
 import logging
+import time
 from typing import List
 
 from sqlalchemy.orm import Session
-from openai import OpenAI
-import openai
 
-from src.db import Document, DocumentChunk, EMBEDDING_DIM
+from src.db import DEFAULT_COLLECTION, Document, DocumentChunk, EMBEDDING_DIM
+from src.metrics import metrics
+from src.openai_factory import CALL_EMBEDDING, get_client
+from src.read_models import ChunkHit, search_chunks
+from src.rerank import Passage, fill_token_budget, mmr_order
+from src.token_counter import count_tokens
+from src.tracing import span, traced
 
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
 
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 200
+
+# Сколько кандидатов достаём из pgvector для переранжирования и сколько токенов
+# контекста отдаём в промпт
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "20"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "800"))
+# Чанки дальше этого L2-расстояния от запроса отбрасываются; пусто — без отсечения
+RAG_MAX_DISTANCE = float(os.getenv("RAG_MAX_DISTANCE")) if os.getenv("RAG_MAX_DISTANCE") else None
+
 logger = logging.getLogger(__name__)
 
-_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+_client = get_client(CALL_EMBEDDING)
 
 
+@traced("rag.embedding")
 def _get_embedding(text: str) -> List[float]:
     if _client is None:
         return []
@@ -32,7 +48,7 @@ def _get_embedding(text: str) -> List[float]:
     return response.data[0].embedding
 
 
-def _split_text(text: str, chunk_size: int = 800, overlap: int = 200) -> List[str]:
+def _split_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """Простое разбиение текста на чанки по символам с перекрытием."""
     chunks: List[str] = []
     start = 0
@@ -50,11 +66,13 @@ def _split_text(text: str, chunk_size: int = 800, overlap: int = 200) -> List[st
     return chunks
 
 
-def ingest_text(db: Session, title: str, source: str, text: str) -> Document:
-    """Сохраняет текстовый документ и его чанки с эмбеддингами в БД."""
-    logger.info("Starting ingestion: title=%r, source=%r, length=%d chars", title, source, len(text))
+def ingest_text(db: Session, title: str, source: str, text: str, collection: str = DEFAULT_COLLECTION) -> Document:
+    """Сохраняет текстовый документ и его чанки с эмбеддингами в коллекцию collection."""
+    logger.info(
+        "Starting ingestion: title=%r, source=%r, collection=%s, length=%d chars", title, source, collection, len(text)
+    )
 
-    document = Document(title=title, source=source)
+    document = Document(title=title, source=source, collection=collection)
     db.add(document)
     db.commit()
     db.refresh(document)
@@ -71,6 +89,7 @@ def ingest_text(db: Session, title: str, source: str, text: str) -> Document:
         db.add(
             DocumentChunk(
                 document_id=document.id,
+                collection=collection,
                 chunk_index=idx,
                 text=chunk_text,
                 embedding=embedding,
@@ -83,8 +102,13 @@ def ingest_text(db: Session, title: str, source: str, text: str) -> Document:
     return document
 
 
-def retrieve_relevant_chunks(db: Session, query: str, limit: int = 3) -> List[DocumentChunk]:
-    """Возвращает наиболее релевантные чанки документа для запроса."""
+def retrieve_relevant_chunks(
+    db: Session, query: str, limit: int = 3, collection: str | None = None
+) -> List[ChunkHit]:
+    """Возвращает наиболее релевантные чанки документа для запроса.
+
+    Векторы чанков не загружаются: возвращаются лёгкие проекции ChunkHit.
+    """
     if _client is None:
         return []
 
@@ -92,12 +116,52 @@ def retrieve_relevant_chunks(db: Session, query: str, limit: int = 3) -> List[Do
     if not embedding:
         return []
 
-    return (
-        db.query(DocumentChunk)
-        .order_by(DocumentChunk.embedding.l2_distance(embedding))
-        .limit(limit)
-        .all()
-    )
+    return search_chunks(db, embedding, limit, collection=collection)
+
+
+@traced("rag.retrieve_passages")
+def retrieve_passages(
+    db: Session,
+    query: str,
+    token_budget: int = RAG_TOKEN_BUDGET,
+    candidates: int = RAG_CANDIDATES,
+    lambda_mult: float = RAG_MMR_LAMBDA,
+    max_distance: float | None = RAG_MAX_DISTANCE,
+    collection: str | None = None,
+) -> List[Passage]:
+    """Возвращает неизбыточный контекст для запроса в пределах token_budget.
+
+    Достаёт candidates ближайших чанков вместе с векторами, отбрасывает те,
+    что дальше max_distance, переупорядочивает остальные по MMR, склеивает
+    соседние чанки одного документа без перекрытия и набирает пассажи, пока
+    они укладываются в бюджет токенов. collection ограничивает поиск одной
+    коллекцией базы знаний.
+    """
+    if _client is None:
+        return []
+
+    started = time.perf_counter()
+    embedding = _get_embedding(query)
+    if not embedding:
+        return []
+
+    with span("rag.vector_search", candidates=candidates, collection=collection or "*") as search_span:
+        hits = search_chunks(db, embedding, candidates, with_embeddings=True, collection=collection)
+        if search_span is not None:
+            search_span.set_attribute("hits", len(hits))
+    metrics.observe("rag.retrieval_seconds", time.perf_counter() - started)
+
+    if max_distance is not None and hits:
+        hits = [hit for hit in hits if hit.distance <= max_distance]
+        if not hits:
+            metrics.increment("rag.gate.skipped", reason="distance")
+    if not hits:
+        return []
+
+    with span("rag.rerank", candidates=len(hits)):
+        order = mmr_order(embedding, [hit.embedding for hit in hits], lambda_mult=lambda_mult)
+        ranked = [hits[i] for i in order]
+        return fill_token_budget(ranked, token_budget, count_tokens, max_overlap=CHUNK_OVERLAP)
 
 
 def load_text_file(path: str) -> str:
@@ -106,25 +170,43 @@ def load_text_file(path: str) -> str:
 
 
 if __name__ == "__main__":
-    """Простейшая консольная утилита: python -m src.rag path/to/file.txt 'Title'"""
+    """Простейшая консольная утилита: python -m src.rag path/to/file.txt 'Title' [collection]
+
+    Каталог или glob-шаблон загружаются параллельно через src.ingest.
+    """
     import sys
 
     from src.db import SessionLocal, init_db
 
-    # Базовая настройка логирования для CLI-запуска
-    logging.basicConfig(level=logging.INFO)
-
     if len(sys.argv) < 2:
-        print("Usage: python -m src.rag path/to/file.txt [title]")
+        print(
+            "Usage: python -m src.rag path/to/file.txt [title] [collection]"
+            " | python -m src.rag <dir|glob> [ingest options]"
+        )
         raise SystemExit(1)
 
+    if os.path.isdir(sys.argv[1]) or any(char in sys.argv[1] for char in "*?["):
+        from src.ingest import main as ingest_main
+
+        ingest_main(sys.argv[1:])
+        raise SystemExit(0)
+
+    # Базовая настройка логирования для CLI-запуска
+    logging.basicConfig(level=logging.INFO)
+
     file_path = sys.argv[1]
     title = sys.argv[2] if len(sys.argv) > 2 else os.path.basename(file_path)
+    collection = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_COLLECTION
 
     logger.info("Loading text file for ingestion: path=%s, title=%r", file_path, title)
     text = load_text_file(file_path)
 
+    from src.db import engine
+    from src.knowledge_bases import ensure_collection_indexes, validate_collection
+
+    validate_collection(collection)
     init_db()
     with SessionLocal() as db:
-        doc = ingest_text(db, title=title, source=file_path, text=text)
-        print(f"Ingested document id={doc.id}, title={doc.title}")
+        doc = ingest_text(db, title=title, source=file_path, text=text, collection=collection)
+        print(f"Ingested document id={doc.id}, title={doc.title}, collection={collection}")
+    ensure_collection_indexes(engine, [collection])
@@ -0,0 +1,85 @@
+import os
+import re
+from typing import Dict
+
+from src.metrics import metrics
+
+
+RAG_MIN_QUERY_CHARS = int(os.getenv("RAG_MIN_QUERY_CHARS", "4"))
+
+# Слова, из которых состоят благодарности, приветствия и подтверждения.
+# Сообщение только из таких слов не требует поиска по базе знаний.
+SMALL_TALK_WORDS = frozenset(
+    {
+        "спасибо", "благодарю", "большое", "огромное", "ок", "окей", "ok", "okay", "ага", "угу",
+        "да", "нет", "понятно", "ясно", "хорошо", "отлично", "супер", "класс", "круто", "понял", "поняла",
+        "привет", "здравствуйте", "пока", "до", "свидания", "спс", "пасиб", "thanks", "thank", "you",
+        "thx", "hi", "hello", "bye", "yes", "no", "good", "great", "cool",
+    }
+)
+
+# Уточнения, которые ссылаются на предыдущий ответ, а не на документы
+FOLLOW_UP_PHRASES = frozenset(
+    {
+        "а подробнее", "подробнее", "почему", "а почему", "как это", "в смысле", "что именно",
+        "продолжай", "дальше", "ещё", "еще", "а ещё", "а еще", "повтори", "переформулируй", "короче",
+        "tell me more", "why", "continue", "go on", "more",
+    }
+)
+
+_extra_phrases = {p.strip().lower() for p in os.getenv("RAG_STOP_PHRASES", "").split(",") if p.strip()}
+
+_NON_WORD = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+
+def retrieval_skip_reason(text: str) -> str | None:
+    """Возвращает причину не ходить в RAG для сообщения или None, если поиск нужен.
+
+    Только локальные эвристики: длина, список фраз small talk и уточнений.
+    """
+    normalized = _normalize(text or "")
+    if not normalized:
+        return "empty"
+    if normalized in _extra_phrases or all(word in SMALL_TALK_WORDS for word in normalized.split()):
+        return "stop_phrase"
+    if normalized in FOLLOW_UP_PHRASES:
+        return "follow_up"
+    if len(normalized) < RAG_MIN_QUERY_CHARS:
+        return "too_short"
+    return None
+
+
+def should_retrieve(text: str) -> bool:
+    """Решает, нужен ли RAG для сообщения, и учитывает решение в метриках.
+
+    При пропуске к rag.gate.latency_saved_seconds добавляется средняя
+    наблюдаемая длительность эмбеддинга и векторного поиска.
+    """
+    metrics.increment("rag.gate.checked")
+    reason = retrieval_skip_reason(text)
+    if reason is None:
+        return True
+
+    metrics.increment("rag.gate.skipped", reason=reason)
+    retrieval = metrics.summary("rag.retrieval_seconds")
+    if retrieval is not None:
+        metrics.increment("rag.gate.latency_saved_seconds", retrieval["mean"])
+    return False
+
+
+def gate_stats() -> Dict[str, float]:
+    """Доля пропущенных запросов (включая отсечение по расстоянию) и сэкономленное время."""
+    snapshot = metrics.snapshot()["counters"]
+    checked = snapshot.get("rag.gate.checked", 0.0)
+    skipped = sum(value for key, value in snapshot.items() if key.startswith("rag.gate.skipped"))
+    return {
+        "checked": checked,
+        "skipped": skipped,
+        "skip_rate": skipped / checked if checked else 0.0,
+        "latency_saved_seconds": snapshot.get("rag.gate.latency_saved_seconds", 0.0),
+    }
@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from typing import List, Sequence
+
+from sqlalchemy.orm import Session
+
+from src.db import Message, DocumentChunk
+
+
+@dataclass(frozen=True, slots=True)
+class HistoryEntry:
+    """Лёгкая проекция сообщения истории: только то, что нужно для промпта.
+
+    id — первичный ключ сообщения; у ещё не записанных (write-behind) — None.
+    """
+
+    role: str
+    content: str
+    id: int | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class Dialogue:
+    """История пользователя и его коллекция базы знаний, прочитанные одним запросом пользователя."""
+
+    history: List[HistoryEntry]
+    collection: str
+
+
+@dataclass(frozen=True, slots=True)
+class ChunkHit:
+    """Результат векторного поиска; embedding заполняется только по запросу."""
+
+    id: int
+    document_id: int
+    chunk_index: int
+    text: str
+    distance: float
+    embedding: Sequence[float] | None = None
+
+
+def load_history(db: Session, user_id: int, limit: int | None = None) -> List[HistoryEntry]:
+    """Возвращает историю пользователя в хронологическом порядке.
+
+    Выбираются только колонки id/role/content, без материализации ORM-сущностей
+    и без identity map. Если задан limit, из БД читаются только последние
+    limit сообщений.
+    """
+    query = db.query(Message.id, Message.role, Message.content).filter(Message.user_id == user_id)
+
+    if limit is None:
+        rows = query.order_by(Message.created_at.asc(), Message.id.asc()).all()
+        return [HistoryEntry(role=row.role, content=row.content, id=row.id) for row in rows]
+
+    rows = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit).all()
+    return [HistoryEntry(role=row.role, content=row.content, id=row.id) for row in reversed(rows)]
+
+
+def search_chunks(
+    db: Session,
+    embedding: Sequence[float],
+    limit: int,
+    with_embeddings: bool = False,
+    collection: str | None = None,
+) -> List[ChunkHit]:
+    """Ищет ближайшие чанки по L2-расстоянию.
+
+    По умолчанию embedding участвует только в ORDER BY на стороне Postgres, и
+    клиенту возвращаются текст, идентификаторы и расстояние. with_embeddings=True
+    дополнительно выбирает векторы — они нужны для переранжирования.
+    collection ограничивает поиск одной коллекцией (её частичным HNSW-индексом,
+    см. src/knowledge_bases.py); None — поиск по всем чанкам.
+    """
+    distance = DocumentChunk.embedding.l2_distance(embedding)
+    columns = [
+        DocumentChunk.id,
+        DocumentChunk.document_id,
+        DocumentChunk.chunk_index,
+        DocumentChunk.text,
+        distance.label("distance"),
+    ]
+    if with_embeddings:
+        columns.append(DocumentChunk.embedding)
+
+    # Чанки, чей эмбеддинг ещё не пришёл из пакетного задания, не ищутся
+    query = db.query(*columns).filter(DocumentChunk.embedding.isnot(None))
+    if collection is not None:
+        query = query.filter(DocumentChunk.collection == collection)
+    rows = query.order_by(distance).limit(limit).all()
+    return [
+        ChunkHit(
+            id=row.id,
+            document_id=row.document_id,
+            chunk_index=row.chunk_index,
+            text=row.text,
+            distance=float(row.distance),
+            embedding=row.embedding if with_embeddings else None,
+        )
+        for row in rows
+    ]
@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from src.read_models import ChunkHit
+
+
+@dataclass(frozen=True, slots=True)
+class Passage:
+    """Склеенный фрагмент документа из одного или нескольких соседних чанков."""
+
+    document_id: int
+    first_chunk: int
+    last_chunk: int
+    text: str
+    rank: int
+
+
+def mmr_order(query: Sequence[float], candidates: Sequence[Sequence[float]], lambda_mult: float = 0.7) -> List[int]:
+    """Упорядочивает кандидатов по maximal marginal relevance.
+
+    На каждом шаге выбирается кандидат с максимальным
+    lambda * sim(query, c) - (1 - lambda) * max(sim(c, выбранные)),
+    где sim — косинусная близость. Все сходства считаются матрично за один раз.
+    """
+    if len(candidates) == 0:
+        return []
+
+    matrix = np.asarray(candidates, dtype=np.float32)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    query_vec = np.asarray(query, dtype=np.float32)
+    query_vec = query_vec / max(float(np.linalg.norm(query_vec)), 1e-12)
+
+    relevance = matrix @ query_vec
+    similarity = matrix @ matrix.T
+
+    count = len(matrix)
+    redundancy = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    order: List[int] = []
+
+    for step in range(count):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * (redundancy if step else 0.0)
+        scores = np.where(available, scores, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+
+    return order
+
+
+def _merge_text(left: str, right: str, max_overlap: int) -> str:
+    """Склеивает тексты соседних чанков, убирая общий кусок на стыке."""
+    limit = min(len(left), len(right), max_overlap)
+    for size in range(limit, 0, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return f"{left}\n{right}"
+
+
+def merge_adjacent(hits: Sequence[ChunkHit], max_overlap: int) -> List[Passage]:
+    """Объединяет соседние чанки одного документа в неперекрывающиеся пассажи.
+
+    Порядок hits считается порядком релевантности; пассаж получает ранг
+    своего лучшего чанка, результат отсортирован по рангу.
+    """
+    by_document: Dict[int, List[tuple[int, ChunkHit]]] = {}
+    for rank, hit in enumerate(hits):
+        by_document.setdefault(hit.document_id, []).append((rank, hit))
+
+    passages: List[Passage] = []
+    for document_id, ranked in by_document.items():
+        ranked.sort(key=lambda item: item[1].chunk_index)
+        rank, first = ranked[0]
+        text, start, end = first.text, first.chunk_index, first.chunk_index
+
+        for next_rank, hit in ranked[1:]:
+            if hit.chunk_index == end + 1:
+                text = _merge_text(text, hit.text, max_overlap)
+                end = hit.chunk_index
+                rank = min(rank, next_rank)
+                continue
+            passages.append(Passage(document_id, start, end, text, rank))
+            text, start, end, rank = hit.text, hit.chunk_index, hit.chunk_index, next_rank
+
+        passages.append(Passage(document_id, start, end, text, rank))
+
+    passages.sort(key=lambda passage: passage.rank)
+    return passages
+
+
+def fill_token_budget(
+    hits: Sequence[ChunkHit],
+    token_budget: int,
+    count_tokens: Callable[[str], int],
+    max_overlap: int,
+) -> List[Passage]:
+    """Набирает чанки в порядке hits, пока склеенные пассажи укладываются в бюджет токенов.
+
+    Чанк, с которым бюджет превышается, пропускается, но более короткие
+    следующие кандидаты ещё могут поместиться.
+    """
+    token_cache: Dict[str, int] = {}
+
+    def tokens_of(passages: List[Passage]) -> int:
+        total = 0
+        for passage in passages:
+            if passage.text not in token_cache:
+                token_cache[passage.text] = count_tokens(passage.text)
+            total += token_cache[passage.text]
+        return total
+
+    selected: List[ChunkHit] = []
+    passages: List[Passage] = []
+    for hit in hits:
+        trial = merge_adjacent([*selected, hit], max_overlap)
+        if tokens_of(trial) > token_budget:
+            continue
+        selected.append(hit)
+        passages = trial
+
+    return passages
@@ -0,0 +1,330 @@
+"""Очередь исходящих сообщений Telegram с лимитами скорости и приоритетами.
+
+Telegram ограничивает бота примерно 30 сообщениями в секунду в целом и
+примерно одним в секунду на чат (короткие всплески допустимы). Очередь
+держит два уровня token bucket — общий и на чат — и отправляет сообщения в
+порядке приоритета: ответы пользователям раньше рассылок. Порядок сообщений
+внутри чата сохраняется, в каждый чат одновременно уходит не больше одного.
+
+При 429 (TelegramRetryAfter) на паузу retry_after ставится только этот чат,
+остальные продолжают получать сообщения. Длинные ответы режутся на части по
+4096 символов по границам абзацев, строк и предложений; блоки кода ```
+закрываются в конце части и открываются заново в следующей. Inline-разметка
+(`код`, *жирный*, ссылки) при разрезе не учитывается, поэтому части длинного
+сообщения всегда отправляются как обычный текст, без parse_mode.
+"""
+
+import os
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramRetryAfter
+
+from src.metrics import metrics
+
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_SEND_MAX_RETRIES = int(os.getenv("TELEGRAM_SEND_MAX_RETRIES", "5"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+_FENCE = "```"
+
+logger = logging.getLogger(__name__)
+
+
+def _utf16_len(text: str) -> int:
+    # Telegram считает длину в кодовых единицах UTF-16: эмодзи занимают две
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _fit_prefix(text: str, limit: int) -> int:
+    """Сколько первых символов text укладывается в limit единиц UTF-16."""
+    if _utf16_len(text) <= limit:
+        return len(text)
+    low, high = 0, min(len(text), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _utf16_len(text[:middle]) <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _cut_position(window: str) -> int:
+    """Лучшая граница разреза в window: абзац, строка, предложение, пробел."""
+    min_position = len(window) // 3
+    for separator in ("\n\n", "\n", ". ", "! ", "? ", " "):
+        position = window.rfind(separator)
+        if position >= min_position:
+            return position + len(separator)
+    return len(window)
+
+
+def _open_fence_after(text: str, open_fence: str | None) -> str | None:
+    """Открытый блок кода (строка с ```lang) в конце text, если он не закрыт."""
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith(_FENCE):
+            open_fence = None if open_fence is not None else stripped
+    return open_fence
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Режет текст на части не длиннее limit, не разрывая блоки кода ```.
+
+    Если разрез приходится внутрь блока кода, часть закрывается ```, а
+    следующая снова открывает блок с тем же языком. Остальная разметка не
+    учитывается — части рассчитаны на отправку без parse_mode.
+    """
+    parts: List[str] = []
+    open_fence: str | None = None
+    rest = text
+    while rest:
+        prefix = f"{open_fence}\n" if open_fence else ""
+        if _utf16_len(prefix + rest) <= limit:
+            parts.append(prefix + rest)
+            break
+
+        # Запас на закрывающий ``` в конце части
+        budget = limit - _utf16_len(prefix) - len(_FENCE) - 1
+        window = rest[: _fit_prefix(rest, budget)]
+        cut = max(1, _cut_position(window))
+        piece = (prefix + rest[:cut]).rstrip()
+        rest = rest[cut:]
+        if rest.startswith("\n"):
+            rest = rest[1:]
+
+        open_fence = _open_fence_after(piece, None)
+        if open_fence is not None:
+            piece += f"\n{_FENCE}"
+        else:
+            # Внутри блока кода ведущие пробелы — это отступы, их не трогаем
+            rest = rest.lstrip(" ")
+        parts.append(piece)
+    return [part for part in parts if part.strip()]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, now: float | None = None) -> float:
+        """Через сколько секунд будет доступен один токен."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill(time.monotonic())
+        self._tokens -= 1
+
+    def full(self, now: float) -> bool:
+        """Восстановился ли bucket полностью — тогда его можно выбросить без потери лимита."""
+        self._refill(now)
+        return self._tokens >= self.capacity
+
+
+@dataclass(slots=True)
+class _Outgoing:
+    chat_id: int
+    text: str
+    priority: int
+    seq: int
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    attempts: int = 0
+
+
+@dataclass(slots=True)
+class _ChatState:
+    bucket: TokenBucket
+    queue: Deque[_Outgoing] = field(default_factory=deque)
+    blocked_until: float = 0.0
+    in_flight: bool = False
+
+
+class SendQueue:
+    """Планировщик исходящих сообщений одного бота; работает в event loop бота."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: float = TELEGRAM_CHAT_BURST,
+        max_retries: int = TELEGRAM_SEND_MAX_RETRIES,
+    ) -> None:
+        self._bot = bot
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        self._chats: Dict[int, _ChatState] = {}
+        self._seq = itertools.count()
+        self._depth = 0
+        self._wakeup = asyncio.Event()
+        self._sending: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        """Сообщений в очереди, включая отправляемые прямо сейчас."""
+        return self._depth
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="telegram-send-queue")
+
+    def enqueue(
+        self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs: Any
+    ) -> List[asyncio.Future]:
+        """Ставит текст в очередь (при необходимости частями) и сразу возвращает futures частей.
+
+        Если текст не поместился в одно сообщение, части уходят без parse_mode:
+        разрез может прийтись внутрь inline-разметки, и Telegram отклонил бы часть.
+        """
+        loop = asyncio.get_running_loop()
+        parts = split_message(text)
+        if len(parts) > 1:
+            kwargs = {**kwargs, "parse_mode": None}
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatState(bucket=TokenBucket(self._chat_rate, self._chat_burst))
+
+        futures = []
+        for part in parts:
+            outgoing = _Outgoing(chat_id, part, priority, next(self._seq), kwargs, loop.create_future())
+            chat.queue.append(outgoing)
+            futures.append(outgoing.future)
+        self._depth += len(futures)
+        metrics.observe("telegram.send_queue_depth", self._depth)
+        self._wakeup.set()
+        return futures
+
+    async def send(
+        self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs: Any
+    ) -> List[types.Message]:
+        """Ставит текст в очередь и ждёт отправки всех его частей."""
+        return list(await asyncio.gather(*self.enqueue(chat_id, text, priority, **kwargs)))
+
+    def _pick(self, now: float) -> tuple[_ChatState | None, float]:
+        """Чат с самым приоритетным готовым к отправке сообщением, иначе — время до ближайшего."""
+        best: _ChatState | None = None
+        best_key = None
+        next_ready = float("inf")
+        idle = []
+        for chat_id, chat in self._chats.items():
+            if chat.in_flight:
+                continue
+            if not chat.queue:
+                # Состояние чата держится, пока bucket не восстановится: иначе
+                # следующее сообщение получит новый bucket и обойдёт лимит чата
+                if chat.blocked_until <= now and chat.bucket.full(now):
+                    idle.append(chat_id)
+                continue
+            ready_in = max(chat.blocked_until - now, chat.bucket.delay(now))
+            if ready_in > 0:
+                next_ready = min(next_ready, ready_in)
+                continue
+            head = chat.queue[0]
+            key = (head.priority, head.seq)
+            if best_key is None or key < best_key:
+                best, best_key = chat, key
+        for chat_id in idle:
+            del self._chats[chat_id]
+        return best, next_ready
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            chat, next_ready = self._pick(time.monotonic())
+            if chat is None:
+                timeout = None if next_ready == float("inf") else next_ready
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_delay = self._global.delay()
+            if global_delay > 0:
+                # Пока ждём общий лимит, мог прийти более приоритетный ответ
+                await asyncio.sleep(global_delay)
+                continue
+
+            self._global.take()
+            chat.bucket.take()
+            chat.in_flight = True
+            task = asyncio.create_task(self._deliver(chat, chat.queue[0]))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _deliver(self, chat: _ChatState, outgoing: _Outgoing) -> None:
+        priority = _PRIORITY_NAMES.get(outgoing.priority, str(outgoing.priority))
+        outgoing.attempts += 1
+        try:
+            message = await self._bot.send_message(outgoing.chat_id, outgoing.text, **outgoing.kwargs)
+        except TelegramRetryAfter as exc:
+            metrics.increment("telegram.retry_after", priority=priority)
+            if outgoing.attempts <= self._max_retries:
+                logger.warning("Flood limit for chat %s, retrying in %ss", outgoing.chat_id, exc.retry_after)
+                chat.blocked_until = time.monotonic() + exc.retry_after
+                return
+            self._finish(chat, outgoing, error=exc)
+        except Exception as exc:  # noqa: BLE001 - ошибка отдаётся ожидающему через future
+            metrics.increment("telegram.send_errors", priority=priority)
+            self._finish(chat, outgoing, error=exc)
+        else:
+            metrics.observe("telegram.send_latency_seconds", time.perf_counter() - outgoing.enqueued_at, priority=priority)
+            self._finish(chat, outgoing, result=message)
+        finally:
+            chat.in_flight = False
+            self._wakeup.set()
+
+    def _finish(self, chat: _ChatState, outgoing: _Outgoing, result: Any = None, error: Exception | None = None) -> None:
+        chat.queue.popleft()
+        self._depth -= 1
+        if outgoing.future.done():
+            return
+        if error is not None:
+            outgoing.future.set_exception(error)
+        else:
+            outgoing.future.set_result(result)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Дожидается отправки очереди (не дольше timeout) и останавливает планировщик."""
+        deadline = time.monotonic() + timeout
+        while self._depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._depth:
+            logger.error("Send queue closed with %d unsent messages", self._depth)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._sending):
+            task.cancel()
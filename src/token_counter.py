@@ -1,15 +1,86 @@
 import os
-import tiktoken
-from datetime import datetime, timezone
+import logging
+import threading
+import time
+from typing import Dict, Iterable
 
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from src.db import Message
+from src.db import Message, utc_day_range
 
 
 
 MAX_MESSAGE_TOKENS = int(os.getenv("MAX_MESSAGE_TOKENS", "4000"))
+MAX_DAILY_TOKENS = 50000
+FALLBACK_ENCODING = "cl100k_base"
+# Через сколько секунд повторить загрузку кодировки, если она не удалась
+TIKTOKEN_RETRY_SECONDS = float(os.getenv("TIKTOKEN_RETRY_SECONDS", "300"))
+
+# Служебные токены chat-формата: на каждое сообщение и на начало ответа
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+logger = logging.getLogger(__name__)
+
+
+_encodings: Dict[str, object] = {}
+# Когда загрузка кодировки модели не удалась: до TIKTOKEN_RETRY_SECONDS
+# подсчёт приближённый, потом загрузка повторяется
+_encoding_failures: Dict[str, float] = {}
+_encodings_lock = threading.Lock()
+
+
+def _recently_failed(model: str) -> bool:
+    failed_at = _encoding_failures.get(model)
+    return failed_at is not None and time.monotonic() - failed_at < TIKTOKEN_RETRY_SECONDS
+
+
+def _get_encoding(model: str):
+    """Возвращает кодировку модели, загружая её не более одного раза даже из нескольких потоков.
+
+    Неудачная загрузка (нет BPE-файла и сети) не кэшируется навсегда: следующая
+    попытка будет не раньше чем через TIKTOKEN_RETRY_SECONDS.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None or _recently_failed(model):
+        return encoding
+
+    with _encodings_lock:
+        if model in _encodings or _recently_failed(model):
+            return _encodings.get(model)
+        encoding = _load_encoding(model)
+        if encoding is None:
+            _encoding_failures[model] = time.monotonic()
+        else:
+            _encodings[model] = encoding
+            _encoding_failures.pop(model, None)
+        return encoding
+
+
+def _load_encoding(model: str):
+    """Загружает кодировку tiktoken.
+
+    tiktoken импортируется лениво: модуль и BPE-файлы нужны только при первом
+    подсчёте токенов. Файлы берутся из TIKTOKEN_CACHE_DIR (заполняется при
+    сборке образа); если их там нет и сети тоже нет, возвращается None и
+    подсчёт переходит на приближённую оценку.
+    """
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as exc:  # noqa: BLE001 - сетевые ошибки загрузки BPE-файла
+        logger.warning("tiktoken encoding for %s is unavailable, using approximate counts: %s", model, exc)
+        return None
+
+
+def preload_encoding(model: str = "gpt-4o-mini") -> bool:
+    """Заранее загружает кодировку модели. Возвращает True, если доступен точный подсчёт."""
+    return _get_encoding(model) is not None
 
 
 def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
@@ -21,23 +92,37 @@ def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
     if not text:
         return 0
 
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # ~4 байта UTF-8 на токен — консервативная оценка и для латиницы, и для кириллицы
+        return max(1, len(text.encode("utf-8")) // 4)
 
     return len(encoding.encode(text))
 
 
-def check_daily_limit(db: Session, user_id: int, max_tokens: int = 50000) -> bool:
-    """Проверяет, не превышен ли дневной лимит токенов для пользователя."""
-    today = datetime.now(timezone.utc).date()
+def count_message_tokens(messages: Iterable[Dict[str, str]], model: str = "gpt-4o-mini") -> int:
+    """Оценивает размер промпта chat completion в токенах кодировки модели."""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + count_tokens(message.get("content") or "", model)
+    return total
+
+
+def get_daily_tokens(db: Session, user_id: int) -> int:
+    """Сумма токенов сообщений пользователя за сегодня (UTC)."""
+    day_start, day_end = utc_day_range()
     total = (
         db.query(func.coalesce(func.sum(Message.token_count), 0))
         .filter(
             Message.user_id == user_id,
-            func.date(Message.created_at) == today,
+            Message.created_at >= day_start,
+            Message.created_at < day_end,
         )
         .scalar()
     )
-    return int(total or 0) < max_tokens
+    return int(total or 0)
+
+
+def check_daily_limit(db: Session, user_id: int, max_tokens: int = MAX_DAILY_TOKENS) -> bool:
+    """Проверяет, не превышен ли дневной лимит токенов для пользователя."""
+    return get_daily_tokens(db, user_id) < max_tokens
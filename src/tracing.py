@@ -0,0 +1,261 @@
+"""Лёгкая трассировка обработки апдейтов: спаны по этапам, сэмплирование и экспорт в OTLP/JSON.
+
+Трасса начинается на каждый апдейт Telegram (start_trace) и собирает спаны
+этапов (span / traced) — БД, эмбеддинг, векторный поиск, вызов модели.
+Контекст передаётся через contextvars, поэтому спаны из asyncio.to_thread
+попадают в трассу своего апдейта.
+
+В файл TRACE_FILE (по строке на трассу, формат OTLP/JSON — как у
+file-экспортёра OpenTelemetry Collector) пишется доля TRACE_SAMPLE_RATE
+трасс и все трассы дольше TRACE_SLOW_MS; дерево медленной трассы вдобавок
+печатается в лог. При нулевых TRACE_SAMPLE_RATE и TRACE_SLOW_MS трассировка
+выключена и span() ничего не делает.
+"""
+
+import os
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from src.metrics import metrics
+
+
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/spans.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# Трассы дольше порога экспортируются всегда, независимо от сэмплирования; 0 — выключено
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+TRACE_SERVICE_NAME = "llm-telegram-bot"
+
+# OTLP: 1 — STATUS_CODE_OK, 2 — STATUS_CODE_ERROR; 1 — SPAN_KIND_INTERNAL
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+_SPAN_KIND_INTERNAL = 1
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1_000_000
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+@dataclass(slots=True)
+class _Trace:
+    trace_id: str
+    sampled: bool
+    spans: List[Span] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+_current_trace: ContextVar[_Trace | None] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON кодирует int64 строкой
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(trace_id: str, span: Span) -> Dict[str, Any]:
+    otlp = {
+        "traceId": trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": _SPAN_KIND_INTERNAL,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _attribute_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": _STATUS_ERROR, "message": span.error} if span.error else {"code": _STATUS_OK},
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+def to_otlp(trace_id: str, spans: List[Span]) -> Dict[str, Any]:
+    """Трасса в виде ExportTraceServiceRequest (OTLP/JSON)."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [_otlp_span(trace_id, span) for span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def format_tree(spans: List[Span]) -> str:
+    """Дерево спанов трассы с длительностями — для лога медленных запросов."""
+    children: Dict[str | None, List[Span]] = {}
+    for span in sorted(spans, key=lambda item: item.start_ns):
+        children.setdefault(span.parent_id, []).append(span)
+
+    lines = []
+
+    def walk(parent_id: str | None, depth: int) -> None:
+        for span in children.get(parent_id, []):
+            status = f" ERROR: {span.error}" if span.error else ""
+            lines.append(f"{'  ' * depth}{span.name} {span.duration_ms:.1f}ms{status}")
+            walk(span.span_id, depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+class TraceExporter:
+    """Дописывает трассы в JSONL-файл; запись сериализуется блокировкой."""
+
+    def __init__(self, path: str = TRACE_FILE) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, trace_id: str, spans: List[Span]) -> None:
+        line = json.dumps(to_otlp(trace_id, spans), ensure_ascii=False)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as file:
+                file.write(line + "\n")
+
+
+class Tracer:
+    def __init__(
+        self,
+        exporter: TraceExporter | None = None,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        slow_ms: float = TRACE_SLOW_MS,
+    ) -> None:
+        self.exporter = exporter or TraceExporter()
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    @contextmanager
+    def start_trace(self, name: str, update_id: int | None = None, **attributes: Any) -> Iterator[Span | None]:
+        """Корневой спан трассы одного апдейта. Вложенные трассы не создаются."""
+        if not self.enabled or _current_trace.get() is not None:
+            yield None
+            return
+
+        trace = _Trace(trace_id=_new_id(16), sampled=random.random() < self.sample_rate)
+        if update_id is not None:
+            attributes["telegram.update_id"] = update_id
+        trace_token = _current_trace.set(trace)
+        try:
+            with span(name, **attributes) as root:
+                yield root
+        finally:
+            _current_trace.reset(trace_token)
+            self._finish(trace, root)
+
+    def _finish(self, trace: _Trace, root: Span) -> None:
+        slow = self.slow_ms > 0 and root.duration_ms >= self.slow_ms
+        if slow:
+            root.set_attribute("trace.slow", True)
+            metrics.increment("tracing.slow_traces")
+            with trace.lock:
+                tree = format_tree(trace.spans)
+            logger.warning("Slow request %.0fms (trace %s):\n%s", root.duration_ms, trace.trace_id, tree)
+        if not (trace.sampled or slow):
+            return
+
+        with trace.lock:
+            spans = list(trace.spans)
+        try:
+            self.exporter.export(trace.trace_id, spans)
+            metrics.increment("tracing.exported_traces")
+        except OSError as exc:
+            logger.error("Failed to export trace %s: %s", trace.trace_id, exc)
+
+
+tracer = Tracer()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """Спан этапа внутри текущей трассы; вне трассы ничего не делает."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        span_id=_new_id(8),
+        parent_id=parent.span_id if parent is not None else None,
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        with trace.lock:
+            trace.spans.append(current)
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """Добавляет атрибут текущему спану, если трасса активна."""
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def traced(name: str):
+    """Декоратор: выполняет функцию внутри спана name."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
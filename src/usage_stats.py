@@ -0,0 +1,92 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict
+
+from src.metrics import metrics
+
+
+# Цены за 1M входных токенов (по умолчанию — gpt-4o-mini); кэшированные дешевле
+OPENAI_INPUT_PRICE_PER_1M = float(os.getenv("OPENAI_INPUT_PRICE_PER_1M", "0.15"))
+OPENAI_CACHED_INPUT_PRICE_PER_1M = float(os.getenv("OPENAI_CACHED_INPUT_PRICE_PER_1M", "0.075"))
+
+
+@dataclass(slots=True)
+class _UserCacheUsage:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    hit_requests: int = 0
+    hit_latency: float = 0.0
+    miss_latency: float = 0.0
+
+
+class PromptCacheStats:
+    """Учёт попаданий в prompt cache OpenAI по пользователям с момента запуска.
+
+    Экономия стоимости считается по разнице цен обычных и кэшированных входных
+    токенов, экономия задержки — как разница средних задержек запросов без
+    попадания и с попаданием в кэш.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._users: Dict[int, _UserCacheUsage] = {}
+
+    def record(self, user_id: int, prompt_tokens: int, cached_tokens: int, latency_seconds: float) -> None:
+        if prompt_tokens <= 0:
+            return
+
+        hit = cached_tokens > 0
+        metrics.increment("openai.prompt_tokens", prompt_tokens)
+        metrics.increment("openai.cached_tokens", cached_tokens)
+        metrics.observe("prompt_cache.completion_seconds", latency_seconds, cache="hit" if hit else "miss")
+
+        with self._lock:
+            usage = self._users.setdefault(user_id, _UserCacheUsage())
+            usage.requests += 1
+            usage.prompt_tokens += prompt_tokens
+            usage.cached_tokens += cached_tokens
+            if hit:
+                usage.hit_requests += 1
+                usage.hit_latency += latency_seconds
+            else:
+                usage.miss_latency += latency_seconds
+
+    @staticmethod
+    def _summary(usage: _UserCacheUsage) -> Dict[str, float]:
+        misses = usage.requests - usage.hit_requests
+        latency_saved = 0.0
+        if usage.hit_requests and misses:
+            latency_saved = usage.miss_latency / misses - usage.hit_latency / usage.hit_requests
+        return {
+            "requests": usage.requests,
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": usage.cached_tokens,
+            "cache_hit_ratio": usage.cached_tokens / usage.prompt_tokens if usage.prompt_tokens else 0.0,
+            "cost_saved_usd": usage.cached_tokens
+            * (OPENAI_INPUT_PRICE_PER_1M - OPENAI_CACHED_INPUT_PRICE_PER_1M)
+            / 1_000_000,
+            "avg_latency_saved_seconds": latency_saved,
+        }
+
+    def for_user(self, user_id: int) -> Dict[str, float]:
+        with self._lock:
+            return self._summary(self._users.get(user_id, _UserCacheUsage()))
+
+    def totals(self) -> Dict[str, float]:
+        with self._lock:
+            total = _UserCacheUsage()
+            for usage in self._users.values():
+                total.requests += usage.requests
+                total.prompt_tokens += usage.prompt_tokens
+                total.cached_tokens += usage.cached_tokens
+                total.hit_requests += usage.hit_requests
+                total.hit_latency += usage.hit_latency
+                total.miss_latency += usage.miss_latency
+            summary = self._summary(total)
+            summary["users"] = len(self._users)
+            return summary
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,76 @@
+import os
+import logging
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import text
+
+
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
+WARMUP_HTTP_TIMEOUT = float(os.getenv("WARMUP_HTTP_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_db_pool(connections: int) -> None:
+    """Открывает несколько соединений, чтобы первые запросы не платили за TCP/auth."""
+    from src.db import engine
+
+    opened = []
+    try:
+        for _ in range(max(1, connections)):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+def _warm_tokenizer() -> None:
+    from src.openai_client import OPENAI_MODEL
+    from src.token_counter import preload_encoding
+
+    if not preload_encoding(OPENAI_MODEL):
+        logger.warning("Tokenizer warm-up: exact encoding unavailable, approximate token counts in use")
+
+
+def _warm_openai_http() -> None:
+    """Устанавливает TLS-соединение общего транспорта OpenAI дешёвым запросом к /models.
+
+    Чат и эмбеддинги ходят через один пул, поэтому достаточно одного запроса.
+    """
+    from src.openai_client import OPENAI_MODEL
+    from src.openai_factory import CALL_COMPLETION, get_client
+
+    client = get_client(CALL_COMPLETION)
+    if client is not None:
+        client.with_options(max_retries=0, timeout=WARMUP_HTTP_TIMEOUT).models.retrieve(OPENAI_MODEL)
+
+
+def warm_up(db_connections: int = WARMUP_DB_CONNECTIONS) -> Dict[str, float]:
+    """Прогревает пул БД, токенайзер и HTTP-клиенты OpenAI перед стартом polling.
+
+    Ошибка одного шага только логируется: бот должен стартовать и без прогрева.
+    Возвращает длительность каждого шага в секундах.
+    """
+    steps: List[tuple[str, Callable[[], None]]] = [
+        ("db_pool", lambda: _warm_db_pool(db_connections)),
+        ("tokenizer", _warm_tokenizer),
+        ("openai_http", _warm_openai_http),
+    ]
+
+    timings: Dict[str, float] = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as exc:  # noqa: BLE001 - прогрев не должен ронять запуск
+            logger.warning("Warm-up step %s failed: %s", name, exc)
+        timings[name] = time.perf_counter() - started
+
+    logger.info(
+        "Warm-up finished: %s",
+        ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items()),
+    )
+    return timings
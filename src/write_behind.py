@@ -0,0 +1,259 @@
+import os
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple, TypeVar
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from src.db import Message, trim_messages_for_users, MAX_MESSAGES_PER_USER, MESSAGES_TRIM_ON_WRITE
+from src.metrics import metrics
+
+
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF", "30"))
+
+# Ошибки данных и ограничений вызывает конкретная строка — такой пакет
+# записывается построчно, а сама строка отбрасывается. Остальные ошибки
+# (соединение, блокировки) считаются временными: пакет повторяется после паузы
+_ROW_ERRORS = (DataError, IntegrityError)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True, slots=True)
+class PendingMessage:
+    user_id: int
+    role: str
+    content: str
+    token_count: int
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class WriteBehindBuffer:
+    """Буфер отложенной записи сообщений всех пользователей.
+
+    Сообщения копятся в памяти и записываются одной транзакцией (multi-row
+    INSERT + обрезка истории затронутых пользователей, если keep_last задан)
+    по достижении max_batch или раз в flush_interval секунд. Пока сообщение не записано,
+    оно видно через pending_for/read_consistent, поэтому история и дневной
+    лимит пользователя учитывают его сразу.
+
+    Если БД недоступна, запись повторяется с экспоненциальной паузой (до
+    max_backoff секунд); строки, которые не записываются по собственной вине,
+    отбрасываются и не блокируют остальных. В буфере держится не больше
+    max_pending сообщений: сверх этого, как и после close(), сообщение
+    записывается сразу в вызывающем потоке.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+        keep_last: int | None = MAX_MESSAGES_PER_USER if MESSAGES_TRIM_ON_WRITE else None,
+        autostart: bool = True,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        max_backoff: float = WRITE_BEHIND_MAX_BACKOFF,
+    ) -> None:
+        self._session_factory = session_factory
+        self._max_batch = max_batch
+        self._flush_interval = flush_interval
+        self._keep_last = keep_last
+        self._autostart = autostart
+        self._max_pending = max_pending
+        self._max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._flush_mutex = threading.Lock()
+        self._pending: List[PendingMessage] = []
+        # Пока идёт запись пакета, его сообщения уже могут быть в БД, но ещё
+        # лежат в _pending; читатели ждут окончания записи (см. read_consistent)
+        self._flushing = False
+        self._generation = 0
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+        # Пауза перед следующей попыткой после сбоя записи
+        self._backoff = 0.0
+        self._retry_at = 0.0
+
+    def _ensure_started(self) -> None:
+        if self._thread is None and self._autostart and not self._stopped:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopped or len(self._pending) >= self._max_batch,
+                    timeout=self._flush_interval,
+                )
+                # После сбоя ждём паузу целиком, а не пробуем каждый flush_interval
+                self._cond.wait_for(lambda: self._stopped, timeout=max(0.0, self._retry_at - time.monotonic()))
+                if self._stopped:
+                    return
+            while self.flush() >= self._max_batch:
+                pass
+
+    def add(self, user_id: int, role: str, content: str, token_count: int) -> None:
+        message = PendingMessage(user_id, role, content, token_count)
+        with self._cond:
+            direct = self._stopped or len(self._pending) >= self._max_pending
+            if not direct:
+                self._ensure_started()
+                self._pending.append(message)
+                metrics.observe("write_behind.queue_depth", len(self._pending))
+                if len(self._pending) >= self._max_batch:
+                    self._cond.notify_all()
+                return
+
+        # Буфер закрыт или переполнен (БД долго недоступна): пишем сразу, и
+        # ошибка записи достаётся вызывающему, а не теряется молча
+        metrics.increment("write_behind.direct_writes")
+        self._write([message])
+
+    def pending_for(self, user_id: int) -> List[PendingMessage]:
+        with self._cond:
+            return [message for message in self._pending if message.user_id == user_id]
+
+    def pending_tokens(self, user_id: int) -> int:
+        return sum(message.token_count for message in self.pending_for(user_id))
+
+    def read_consistent(self, user_id: int, read: Callable[[], T]) -> Tuple[T, List[PendingMessage]]:
+        """Выполняет read() и возвращает его результат вместе с ещё не записанными сообщениями.
+
+        Гарантирует, что ни одно сообщение не попадёт в результат дважды и не
+        потеряется, даже если пакет записывается параллельно с чтением.
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._flushing)
+                generation = self._generation
+            result = read()
+            with self._cond:
+                if not self._flushing and self._generation == generation:
+                    return result, [message for message in self._pending if message.user_id == user_id]
+
+    def discard_user(self, user_id: int) -> None:
+        """Выбрасывает незаписанные сообщения пользователя (например, при /clear)."""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._flushing)
+            self._pending = [message for message in self._pending if message.user_id != user_id]
+
+    def _write(self, batch: List[PendingMessage]) -> None:
+        """Записывает сообщения одной транзакцией вместе с обрезкой истории."""
+        with self._session_factory() as db:
+            db.execute(
+                insert(Message),
+                [
+                    {
+                        "user_id": message.user_id,
+                        "role": message.role,
+                        "content": message.content,
+                        "token_count": message.token_count,
+                        "created_at": message.created_at,
+                    }
+                    for message in batch
+                ],
+            )
+            if self._keep_last is not None:
+                trim_messages_for_users(db, {message.user_id for message in batch}, keep_last=self._keep_last)
+            db.commit()
+
+    def _write_rows(self, batch: List[PendingMessage]) -> Tuple[List[PendingMessage], List[PendingMessage]]:
+        """Записывает пакет построчно. Возвращает (записанные, отброшенные) сообщения.
+
+        На временной ошибке останавливается: оставшиеся строки повторятся позже.
+        """
+        written: List[PendingMessage] = []
+        dropped: List[PendingMessage] = []
+        for message in batch:
+            try:
+                self._write([message])
+            except _ROW_ERRORS as exc:
+                logger.error("Dropping message of user %s that cannot be saved: %s", message.user_id, exc)
+                dropped.append(message)
+            except Exception:  # noqa: BLE001 - остаток пакета повторится после паузы
+                break
+            else:
+                written.append(message)
+        return written, dropped
+
+    def flush(self) -> int:
+        """Синхронно записывает один пакет. Возвращает число записанных сообщений."""
+        with self._flush_mutex:
+            with self._cond:
+                if not self._pending:
+                    return 0
+                batch = self._pending[: self._max_batch]
+                self._flushing = True
+
+            started = time.perf_counter()
+            written: List[PendingMessage] = []
+            dropped: List[PendingMessage] = []
+            try:
+                self._write(batch)
+                written = batch
+            except Exception as exc:  # noqa: BLE001 - пакет останется в буфере и запишется позже
+                logger.error("Write-behind flush of %d messages failed: %s", len(batch), exc)
+                metrics.increment("write_behind.flush_errors")
+                if isinstance(exc, _ROW_ERRORS):
+                    written, dropped = self._write_rows(batch)
+            finally:
+                committed_at = time.perf_counter()
+                with self._cond:
+                    done = {id(message) for message in written + dropped}
+                    self._pending = [message for message in self._pending if id(message) not in done]
+                    if len(done) < len(batch):
+                        self._backoff = min(self._max_backoff, max(self._flush_interval, self._backoff * 2))
+                        self._retry_at = time.monotonic() + self._backoff
+                    else:
+                        self._backoff = self._retry_at = 0.0
+                    self._flushing = False
+                    self._generation += 1
+                    self._cond.notify_all()
+
+        if dropped:
+            metrics.increment("write_behind.dropped", len(dropped))
+        if not written:
+            return 0
+
+        metrics.increment("write_behind.commits")
+        metrics.observe("write_behind.batch_size", len(written))
+        metrics.observe("write_behind.flush_seconds", committed_at - started)
+        for message in written:
+            metrics.observe("write_behind.insert_latency_seconds", committed_at - message.enqueued_at)
+        return len(written)
+
+    def close(self) -> None:
+        """Останавливает фоновый поток и дописывает всё, что осталось в буфере."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+        # Дописываем, пока буфер убывает; если БД недоступна, пакет не уйдёт
+        while True:
+            with self._cond:
+                before = len(self._pending)
+            if not before:
+                break
+            self.flush()
+            with self._cond:
+                if len(self._pending) == before:
+                    break
+
+        with self._cond:
+            remaining = len(self._pending)
+        if remaining:
+            logger.error("Write-behind buffer closed with %d unsaved messages", remaining)
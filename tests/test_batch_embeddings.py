@@ -0,0 +1,154 @@
+import json
+
+from openai import OpenAI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src import ingest
+from src.batch_embeddings import BatchEmbedder, parse_result_line, pending_chunks_query, request_line
+from src.db import Base, Document, DocumentChunk, EmbeddingBatch
+from src.openai_stub import StubConfig, StubServer, hash_embedding
+
+
+def create_sqlite_session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+def add_pending_chunks(SessionFactory, texts):
+    with SessionFactory() as db:
+        document = Document(title="doc", source="doc.md")
+        db.add(document)
+        db.flush()
+        db.add_all(
+            DocumentChunk(document_id=document.id, chunk_index=index, text=text, embedding=None)
+            for index, text in enumerate(texts)
+        )
+        db.commit()
+
+
+def make_embedder(SessionFactory, server, tmp_path, **kwargs) -> BatchEmbedder:
+    client = OpenAI(api_key="stub", base_url=server.base_url, max_retries=0)
+    return BatchEmbedder(SessionFactory, client, output_dir=str(tmp_path / "batches"), **kwargs)
+
+
+def embeddings_by_text(SessionFactory):
+    with SessionFactory() as db:
+        return {chunk.text: chunk.embedding for chunk in db.query(DocumentChunk).all()}
+
+
+def test_request_and_result_lines_round_trip():
+    request = json.loads(request_line(42, "текст"))
+    result = json.dumps(
+        {
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "body": {"data": [{"index": 0, "embedding": [0.5, 0.25]}]}},
+            "error": None,
+        }
+    )
+    failed = json.dumps({"custom_id": "chunk-7", "response": {"status_code": 500, "body": {}}, "error": None})
+
+    assert request["url"] == "/v1/embeddings" and request["body"]["input"] == "текст"
+    assert parse_result_line(result) == (42, [0.5, 0.25])
+    assert parse_result_line(failed) == (7, None)
+
+
+def test_batch_files_respect_request_limit(tmp_path):
+    SessionFactory = create_sqlite_session_factory()
+    add_pending_chunks(SessionFactory, [f"chunk {i}" for i in range(5)])
+
+    with StubServer() as server:
+        files = make_embedder(SessionFactory, server, tmp_path, max_requests=2).write_batch_files()
+
+    assert [batch_file.requests for batch_file in files] == [2, 2, 1]
+    assert [(batch_file.first_chunk_id, batch_file.last_chunk_id) for batch_file in files] == [(1, 2), (3, 4), (5, 5)]
+    assert len(files[0].path.read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_submit_poll_and_import_embeddings(tmp_path):
+    SessionFactory = create_sqlite_session_factory()
+    texts = [f"оплата заказа номер {i}" for i in range(7)]
+    add_pending_chunks(SessionFactory, texts)
+
+    with StubServer(StubConfig(batch_seconds=1.0)) as server:
+        embedder = make_embedder(SessionFactory, server, tmp_path, max_requests=3, import_page=2)
+        batch_ids = embedder.submit()
+        # Пока задания активны, их чанки не отправляются повторно
+        assert embedder.submit() == []
+        first_poll = embedder.poll()
+        statuses = embedder.wait(interval=0.1, timeout=10)
+
+    assert len(batch_ids) == 3
+    assert set(first_poll.values()) == {"in_progress"}
+    assert set(statuses.values()) == {"completed"}
+    assert embedder.pending_chunks() == 0
+    stored = embeddings_by_text(SessionFactory)
+    for text in texts:
+        assert list(stored[text]) == list(hash_embedding(text))
+    with SessionFactory() as db:
+        assert [(batch.embedded, batch.failed) for batch in db.query(EmbeddingBatch).order_by(EmbeddingBatch.id)] == [
+            (3, 0),
+            (3, 0),
+            (1, 0),
+        ]
+    assert not list((tmp_path / "batches").iterdir())
+
+
+def test_failed_requests_are_resubmitted(tmp_path):
+    SessionFactory = create_sqlite_session_factory()
+    add_pending_chunks(SessionFactory, [f"chunk {i}" for i in range(20)])
+
+    with StubServer(StubConfig(batch_failure_rate=0.5, seed=3)) as server:
+        embedder = make_embedder(SessionFactory, server, tmp_path)
+        embedder.submit()
+        embedder.wait(interval=0)
+        with SessionFactory() as db:
+            (failed,) = db.query(EmbeddingBatch.failed).one()
+            pending = [row.id for row in db.execute(pending_chunks_query())]
+        server.stub.config.batch_failure_rate = 0.0
+        resubmitted = embedder.submit()
+        embedder.wait(interval=0)
+
+    assert 0 < failed < 20
+    assert len(pending) == failed
+    assert len(resubmitted) == 1
+    assert embedder.pending_chunks() == 0
+
+
+def test_ingest_batch_mode_writes_unsearchable_chunks(tmp_path):
+    (tmp_path / "doc.md").write_text("Текст про доставку. " * 100, encoding="utf-8")
+    SessionFactory = create_sqlite_session_factory()
+
+    with StubServer() as server:
+        client = OpenAI(api_key="stub", base_url=server.base_url, max_retries=0)
+        report = ingest.Ingestor(
+            SessionFactory, client, workers=1, concurrency=1, progress_interval=0, defer_embeddings=True
+        ).run(ingest.discover_files(str(tmp_path)))
+        requests = server.stub.stats.snapshot().get("/v1/embeddings", 0)
+
+    assert report.ingested == 1 and report.chunks > 1
+    assert requests == 0
+    with SessionFactory() as db:
+        assert db.query(DocumentChunk).filter(DocumentChunk.embedding.is_(None)).count() == report.chunks
+
+
+def test_import_skips_chunks_deleted_after_submit(tmp_path):
+    SessionFactory = create_sqlite_session_factory()
+    add_pending_chunks(SessionFactory, [f"chunk {i}" for i in range(4)])
+
+    with StubServer() as server:
+        embedder = make_embedder(SessionFactory, server, tmp_path)
+        embedder.submit()
+        with SessionFactory() as db:
+            db.query(DocumentChunk).filter(DocumentChunk.id == 2).delete()
+            db.commit()
+        statuses = embedder.poll()
+
+    assert set(statuses.values()) == {"completed"}
+    assert embedder.pending_chunks() == 0
+    with SessionFactory() as db:
+        batch = db.query(EmbeddingBatch).one()
+        assert batch.imported_at is not None
+        assert (batch.embedded, batch.failed) == (3, 0)
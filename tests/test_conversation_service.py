@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta, timezone
 from types import SimpleNamespace
 
 import pytest
@@ -6,6 +7,8 @@ from sqlalchemy.orm import sessionmaker
 
 from src.conversation_service import ConversationService
 from src.db import Base, User, Message, MAX_MESSAGES_PER_USER
+from src.knowledge_bases import RAG_COLLECTION
+from src.read_models import HistoryEntry
 
 
 def create_sqlite_session_factory():
@@ -57,7 +60,9 @@ def test_clear_history_removes_all_messages():
     assert messages == []
 
 
-def test_trim_old_messages_keeps_only_last_max():
+def test_trim_old_messages_keeps_only_last_max(monkeypatch):
+    # С секциями обрезка на записи по умолчанию выключена; здесь проверяется режим без них
+    monkeypatch.setattr("src.conversation_service.MESSAGES_TRIM_ON_WRITE", True)
     SessionFactory = create_sqlite_session_factory()
     service = ConversationService(session_factory=SessionFactory)
     tg_user = make_fake_user()
@@ -75,6 +80,22 @@ def test_trim_old_messages_keeps_only_last_max():
     assert remaining_contents == expected
 
 
+def test_history_is_limited_without_trim_on_write(monkeypatch):
+    monkeypatch.setattr("src.conversation_service.MESSAGES_TRIM_ON_WRITE", False)
+    SessionFactory = create_sqlite_session_factory()
+    service = ConversationService(session_factory=SessionFactory)
+    tg_user = make_fake_user()
+
+    total = MAX_MESSAGES_PER_USER + 5
+    for i in range(total):
+        service.add_user_message(tg_user, f"msg-{i}")
+
+    with SessionFactory() as db:
+        assert db.query(Message).count() == total
+    history = service.get_history(tg_user, limit=MAX_MESSAGES_PER_USER)
+    assert [h.content for h in history] == [f"msg-{i}" for i in range(5, total)]
+
+
 def test_add_user_message_stores_token_count():
     SessionFactory = create_sqlite_session_factory()
     service = ConversationService(session_factory=SessionFactory)
@@ -109,7 +130,7 @@ def test_add_user_message_respects_daily_limit(monkeypatch):
     service = ConversationService(session_factory=SessionFactory)
     tg_user = make_fake_user()
 
-    monkeypatch.setattr("src.conversation_service.check_daily_limit", lambda db, user_id: False)
+    monkeypatch.setattr("src.conversation_service.check_daily_limit", lambda db, user_id, max_tokens: False)
 
     service.add_user_message(tg_user, "any message")
 
@@ -117,3 +138,65 @@ def test_add_user_message_respects_daily_limit(monkeypatch):
         messages = db.query(Message).all()
 
     assert messages == []
+
+
+def test_get_history_returns_projected_entries_with_limit():
+    SessionFactory = create_sqlite_session_factory()
+    service = ConversationService(session_factory=SessionFactory)
+    tg_user = make_fake_user()
+
+    for i in range(5):
+        service.add_user_message(tg_user, f"msg-{i}")
+
+    full = service.get_history(tg_user)
+    last_two = service.get_history(tg_user, limit=2)
+
+    assert all(isinstance(entry, HistoryEntry) for entry in full)
+    assert [entry.content for entry in full] == [f"msg-{i}" for i in range(5)]
+    assert [entry.content for entry in last_two] == ["msg-3", "msg-4"]
+    assert all(entry.role == "user" for entry in last_two)
+
+
+def test_get_stats_counts_only_todays_messages():
+    SessionFactory = create_sqlite_session_factory()
+    service = ConversationService(session_factory=SessionFactory)
+    tg_user = make_fake_user()
+
+    service.add_user_message(tg_user, "today")
+    with SessionFactory() as db:
+        user = db.query(User).one()
+        db.add(
+            Message(
+                user_id=user.id,
+                role="user",
+                content="yesterday",
+                token_count=100,
+                created_at=datetime.now(timezone.utc) - timedelta(days=1),
+            )
+        )
+        db.commit()
+
+    stats = service.get_stats(tg_user)
+
+    assert stats["today_messages"] == 1
+    assert stats["today_tokens"] < 100
+
+
+def test_user_collection_defaults_to_bot_collection_and_can_be_assigned():
+    SessionFactory = create_sqlite_session_factory()
+    service = ConversationService(session_factory=SessionFactory)
+    tg_user = make_fake_user()
+
+    assert service.get_dialogue(tg_user).collection == RAG_COLLECTION
+
+    service.set_collection(tg_user.id, "shop")
+    service.add_user_message(tg_user, "hello")
+    dialogue = service.get_dialogue(tg_user, limit=5)
+    assert dialogue.collection == "shop"
+    assert [(h.role, h.content) for h in dialogue.history] == [("user", "hello")]
+
+    service.set_collection(tg_user.id, None)
+    assert service.get_dialogue(tg_user).collection == RAG_COLLECTION
+
+    with pytest.raises(ValueError):
+        service.set_collection(tg_user.id, "Shop; DROP TABLE users")
@@ -0,0 +1,182 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from openai import OpenAI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src import ingest
+from src.db import Base, Document, DocumentChunk, IngestCheckpoint
+from src.openai_stub import LatencyModel, StubConfig, StubServer
+
+
+def create_sqlite_session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+def write_corpus(root, files=5):
+    (root / "nested").mkdir()
+    for i in range(files):
+        folder = root / "nested" if i % 2 else root
+        (folder / f"doc{i}.md").write_text(f"Документ {i}. " + "Текст про оплату и доставку. " * 80, encoding="utf-8")
+    (root / "image.png").write_bytes(b"\x89PNG")
+
+
+def make_ingestor(session_factory, server, **kwargs) -> ingest.Ingestor:
+    client = OpenAI(api_key="stub", base_url=server.base_url, max_retries=0)
+    kwargs.setdefault("workers", 2)
+    kwargs.setdefault("concurrency", 2)
+    kwargs.setdefault("batch_size", 3)
+    kwargs.setdefault("progress_interval", 0)
+    return ingest.Ingestor(session_factory, client, **kwargs)
+
+
+def test_discover_files_by_directory_and_glob(tmp_path):
+    write_corpus(tmp_path, files=3)
+
+    by_dir = ingest.discover_files(str(tmp_path))
+    by_glob = ingest.discover_files(str(tmp_path / "*.md"))
+
+    assert [path.rsplit("/", 1)[1] for path in by_dir] == ["doc0.md", "doc2.md", "doc1.md"]
+    assert [path.rsplit("/", 1)[1] for path in by_glob] == ["doc0.md", "doc2.md"]
+
+
+def test_batches_respect_count_and_token_limits():
+    prepared = ingest.PreparedFile("a", "a", "h", chunks=tuple("abcdef"), tokens=(10, 10, 10, 50, 10, 10))
+
+    assert ingest._batches(prepared, batch_size=3, batch_tokens=60) == [(0, 3, 30), (3, 5, 60), (5, 6, 10)]
+
+
+def test_ingest_writes_documents_chunks_and_checkpoints(tmp_path):
+    write_corpus(tmp_path)
+    paths = ingest.discover_files(str(tmp_path))
+    SessionFactory = create_sqlite_session_factory()
+
+    with StubServer() as server:
+        report = make_ingestor(SessionFactory, server).run(paths)
+        requests = server.stub.stats.snapshot()["/v1/embeddings"]
+
+    with SessionFactory() as db:
+        documents = db.query(Document).count()
+        chunks = db.query(DocumentChunk).count()
+        checkpoints = db.query(IngestCheckpoint).all()
+
+    assert report.ingested == 5 and report.failed == []
+    assert documents == 5
+    assert chunks == report.chunks > 5
+    assert requests < chunks  # эмбеддинги запрашиваются пакетами
+    assert {checkpoint.source for checkpoint in checkpoints} == set(paths)
+    assert all(checkpoint.chunks > 0 for checkpoint in checkpoints)
+
+
+def test_rerun_skips_unchanged_and_replaces_changed_files(tmp_path):
+    write_corpus(tmp_path, files=3)
+    paths = ingest.discover_files(str(tmp_path))
+    SessionFactory = create_sqlite_session_factory()
+
+    with StubServer() as server:
+        make_ingestor(SessionFactory, server).run(paths)
+        (tmp_path / "doc0.md").write_text("Совсем новый короткий текст.", encoding="utf-8")
+        report = make_ingestor(SessionFactory, server).run(paths)
+
+    with SessionFactory() as db:
+        titles = sorted(document.title for document in db.query(Document).all())
+        new_doc = db.query(Document).filter(Document.title == "doc0.md").one()
+        new_chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id == new_doc.id).count()
+        orphan_chunks = (
+            db.query(DocumentChunk).filter(~DocumentChunk.document_id.in_(db.query(Document.id))).count()
+        )
+
+    assert report.skipped == 2 and report.ingested == 1
+    assert titles == ["doc0.md", "doc1.md", "doc2.md"]
+    assert new_chunks == 1
+    assert orphan_chunks == 0
+
+
+def test_ingest_tags_chunks_with_collection_and_moves_between_collections(tmp_path):
+    write_corpus(tmp_path, files=2)
+    paths = ingest.discover_files(str(tmp_path))
+    SessionFactory = create_sqlite_session_factory()
+
+    with StubServer() as server:
+        make_ingestor(SessionFactory, server, collection="shop").run(paths)
+        with SessionFactory() as db:
+            shop = {row.collection for row in db.query(DocumentChunk.collection)}
+        # В другую коллекцию тот же файл загружается заново, а не пропускается
+        report = make_ingestor(SessionFactory, server, collection="support").run(paths[:1])
+
+    with SessionFactory() as db:
+        documents = dict(db.query(Document.source, Document.collection).all())
+        chunk_collections = dict(
+            db.query(Document.collection, DocumentChunk.collection)
+            .join(DocumentChunk, DocumentChunk.document_id == Document.id)
+            .all()
+        )
+
+    assert shop == {"shop"}
+    assert report.ingested == 1 and report.skipped == 0
+    assert documents == {paths[0]: "support", paths[1]: "shop"}
+    assert chunk_collections == {"support": "support", "shop": "shop"}
+
+
+def test_failed_files_are_retried_on_next_run(tmp_path):
+    write_corpus(tmp_path, files=2)
+    paths = ingest.discover_files(str(tmp_path))
+    SessionFactory = create_sqlite_session_factory()
+
+    with StubServer(StubConfig(error_rate_500=1.0)) as server:
+        failed = make_ingestor(SessionFactory, server).run(paths)
+    with StubServer() as server:
+        retried = make_ingestor(SessionFactory, server).run(paths)
+
+    assert sorted(failed.failed) == paths and failed.ingested == 0
+    assert retried.ingested == 2 and retried.skipped == 0
+
+
+def test_prepared_files_are_bounded_while_embeddings_lag(tmp_path, monkeypatch):
+    for i in range(12):
+        (tmp_path / f"doc{i}.md").write_text(f"Документ {i}. " + "Текст. " * 50, encoding="utf-8")
+    paths = ingest.discover_files(str(tmp_path))
+    SessionFactory = create_sqlite_session_factory()
+
+    lock = threading.Lock()
+    alive = {"now": 0, "max": 0}
+    prepare_file = ingest.prepare_file
+    write = ingest.Ingestor._write
+
+    def counting_prepare(path):
+        with lock:
+            alive["now"] += 1
+            alive["max"] = max(alive["max"], alive["now"])
+        return prepare_file(path)
+
+    def counting_write(self, prepared, embeddings):
+        write(self, prepared, embeddings)
+        with lock:
+            alive["now"] -= 1
+
+    # Потоки вместо процессов, чтобы подсчёт шёл в одном интерпретаторе
+    monkeypatch.setattr(ingest, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(ingest, "prepare_file", counting_prepare)
+    monkeypatch.setattr(ingest.Ingestor, "_write", counting_write)
+
+    config = StubConfig(latency=LatencyModel("fixed", 30))
+    with StubServer(config) as server:
+        report = make_ingestor(SessionFactory, server, workers=1, concurrency=1).run(paths)
+
+    assert report.ingested == 12
+    assert alive["max"] <= 1 + 1 * 2
+
+
+def test_rate_limiter_waits_when_budget_is_spent():
+    limiter = ingest.RateLimiter(requests_per_minute=600, tokens_per_minute=60_000)
+
+    assert limiter.acquire(500) == 0.0
+    started = time.monotonic()
+    limiter.acquire(60_000)  # токенов осталось 59 500: ждём ~0.5 с
+    assert time.monotonic() - started == pytest.approx(0.5, abs=0.2)
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+
+from src.knowledge_bases import ensure_collection_indexes, index_name, validate_collection
+from src.read_models import search_chunks
+
+
+class RecordingQuery:
+    def __init__(self) -> None:
+        self.filters = []
+
+    def filter(self, *criteria):
+        self.filters.extend(criteria)
+        return self
+
+    def order_by(self, *args):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def all(self):
+        return []
+
+
+class RecordingSession:
+    def __init__(self) -> None:
+        self.query_obj = RecordingQuery()
+
+    def query(self, *columns):
+        return self.query_obj
+
+
+def test_collection_names_are_safe_for_index_names():
+    assert validate_collection("shop_v2") == "shop_v2"
+    assert index_name("shop_v2") == "ix_chunks_hnsw_shop_v2"
+    assert len(index_name("a" * 48)) <= 63
+
+    for bad in ("", "Shop", "shop-v2", "shop'; drop", "a" * 49):
+        with pytest.raises(ValueError):
+            validate_collection(bad)
+
+
+def test_search_chunks_filters_by_collection_only_when_given():
+    db = RecordingSession()
+    search_chunks(db, [0.1, 0.2], 5, collection="shop")
+
+    compiled = [
+        str(criterion.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        for criterion in db.query_obj.filters
+    ]
+    # Условие совпадает с предикатом частичного индекса: collection = '<имя>'
+    assert compiled == ["document_chunks.embedding IS NOT NULL", "document_chunks.collection = 'shop'"]
+
+    db = RecordingSession()
+    search_chunks(db, [0.1, 0.2], 5)
+    assert len(db.query_obj.filters) == 1
+
+
+def test_ensure_collection_indexes_is_noop_on_sqlite():
+    assert ensure_collection_indexes(create_engine("sqlite:///:memory:"), ["shop"]) == []
@@ -2,13 +2,18 @@ from types import SimpleNamespace
 
 import pytest
 
-from src.llm_service import LLMService
+from src.llm_service import LLMService, PROMPT_LAYOUT_LEGACY, build_prompt, window_history
+from src.model_router import ModelRouter
+from src.openai_client import Completion
+from src.read_models import Dialogue, HistoryEntry
+from src.usage_stats import PromptCacheStats
 
 
 class DummyMessage:
-    def __init__(self, role: str, content: str) -> None:
+    def __init__(self, role: str, content: str, id=None) -> None:
         self.role = role
         self.content = content
+        self.id = id
 
 
 class FakeConversationService:
@@ -16,6 +21,7 @@ class FakeConversationService:
         self.history = []  # type: ignore[var-annotated]
         self.user_messages = []
         self.assistant_messages = []
+        self.budget_lookups = 0
 
     def register_start(self, tg_user, greeting_text: str) -> None:  # pragma: no cover - не используется здесь
         self.add_user_message(tg_user, "/start")
@@ -32,8 +38,16 @@ class FakeConversationService:
         self.assistant_messages.append((tg_user.id, content))
         self.history.append(DummyMessage("assistant", content))
 
-    def get_history(self, tg_user):
-        return list(self.history)
+    def get_history(self, tg_user, limit=None):
+        history = list(self.history)
+        return history[-limit:] if limit else history
+
+    def get_remaining_daily_tokens(self, tg_user):
+        self.budget_lookups += 1
+        return 50000
+
+    def get_dialogue(self, tg_user, limit=None):
+        return Dialogue(history=self.get_history(tg_user, limit), collection="shop")
 
 
 class LimitedConversationService(FakeConversationService):
@@ -47,7 +61,7 @@ class LimitedConversationService(FakeConversationService):
         # Сообщение не сохраняется, как если бы дневной лимит был превышен.
         return
 
-    def get_history(self, tg_user):  # noqa: D401 - простая реализация для тестов
+    def get_history(self, tg_user, limit=None):  # noqa: D401 - простая реализация для тестов
         return []
 
 
@@ -66,11 +80,12 @@ def test_generate_reply_uses_llm_and_updates_history(monkeypatch, fake_user):
 
     captured_messages = {}
 
-    def fake_generate_answer(messages):
+    def fake_generate_completion(messages, model=None, fallback_model=None):
         captured_messages["messages"] = messages
-        return "LLM-REPLY"
+        return Completion(text="LLM-REPLY", model="gpt-4o-mini", prompt_tokens=100, cached_tokens=64)
 
-    def fake_retrieve_relevant_chunks(db, query: str, limit: int = 3):  # pragma: no cover
+    def fake_retrieve_passages(db, query: str, **kwargs):  # pragma: no cover
+        captured_messages["collection"] = kwargs.get("collection")
         return [SimpleNamespace(text="chunk-1"), SimpleNamespace(text="chunk-2")]
 
     from contextlib import contextmanager
@@ -79,11 +94,12 @@ def test_generate_reply_uses_llm_and_updates_history(monkeypatch, fake_user):
     def dummy_session():
         yield None
 
-    monkeypatch.setattr("src.llm_service.generate_answer", fake_generate_answer)
-    monkeypatch.setattr("src.llm_service.retrieve_relevant_chunks", fake_retrieve_relevant_chunks)
+    monkeypatch.setattr("src.llm_service.generate_completion", fake_generate_completion)
+    monkeypatch.setattr("src.llm_service.retrieve_passages", fake_retrieve_passages)
     monkeypatch.setattr("src.llm_service.SessionLocal", lambda: dummy_session())
 
-    service = LLMService(fake_conv)
+    cache_stats = PromptCacheStats()
+    service = LLMService(fake_conv, cache_stats=cache_stats)
 
     reply = service.generate_reply(fake_user, "How are you?")
 
@@ -94,19 +110,24 @@ def test_generate_reply_uses_llm_and_updates_history(monkeypatch, fake_user):
 
     msgs = captured_messages["messages"]
     assert msgs[0]["role"] == "system"
-    assert any(m["role"] == "system" and "chunk-1" in m["content"] for m in msgs[1:3])
-    roles = [m["role"] for m in msgs]
-    assert "user" in roles and "assistant" in roles
+    # RAG-контекст стоит перед последним сообщением, чтобы префикс промпта не менялся
+    assert msgs[-2]["role"] == "system" and "chunk-1" in msgs[-2]["content"]
+    assert msgs[-1] == {"role": "user", "content": "How are you?"}
+    assert [m["content"] for m in msgs[1:3]] == ["hi", "hello"]
+    # Контекст ищется в коллекции пользователя
+    assert captured_messages["collection"] == "shop"
+
+    assert cache_stats.for_user(fake_user.id)["cache_hit_ratio"] == pytest.approx(0.64)
 
 
 def test_generate_reply_respects_daily_token_limit(monkeypatch, fake_user):
     fake_conv = LimitedConversationService()
 
-    def fake_generate_answer(messages):  # pragma: no cover - не должен вызываться
-        raise AssertionError("generate_answer should not be called when daily limit is exceeded")
+    def fake_generate_completion(messages, **kwargs):  # pragma: no cover - не должен вызываться
+        raise AssertionError("generate_completion should not be called when daily limit is exceeded")
 
-    def fake_retrieve_relevant_chunks(db, query: str, limit: int = 3):  # pragma: no cover - не должен вызываться
-        raise AssertionError("retrieve_relevant_chunks should not be called when daily limit is exceeded")
+    def fake_retrieve_passages(db, query: str, **kwargs):  # pragma: no cover - не должен вызываться
+        raise AssertionError("retrieve_passages should not be called when daily limit is exceeded")
 
     from contextlib import contextmanager
 
@@ -114,8 +135,8 @@ def test_generate_reply_respects_daily_token_limit(monkeypatch, fake_user):
     def dummy_session():  # pragma: no cover - не должен вызываться
         yield None
 
-    monkeypatch.setattr("src.llm_service.generate_answer", fake_generate_answer)
-    monkeypatch.setattr("src.llm_service.retrieve_relevant_chunks", fake_retrieve_relevant_chunks)
+    monkeypatch.setattr("src.llm_service.generate_completion", fake_generate_completion)
+    monkeypatch.setattr("src.llm_service.retrieve_passages", fake_retrieve_passages)
     monkeypatch.setattr("src.llm_service.SessionLocal", lambda: dummy_session())
 
     service = LLMService(fake_conv)
@@ -123,3 +144,93 @@ def test_generate_reply_respects_daily_token_limit(monkeypatch, fake_user):
     reply = service.generate_reply(fake_user, "Hello")
 
     assert "дневной лимит токенов" in reply
+
+
+def test_generate_reply_skips_retrieval_for_small_talk(monkeypatch, fake_user):
+    fake_conv = FakeConversationService()
+    captured_messages = {}
+
+    def fake_generate_completion(messages, model=None, fallback_model=None):
+        captured_messages["messages"] = messages
+        return Completion(text="Пожалуйста!", model="gpt-4o-mini")
+
+    def fake_retrieve_passages(db, query: str, **kwargs):  # pragma: no cover - не должен вызываться
+        raise AssertionError("retrieve_passages should not be called for small talk")
+
+    monkeypatch.setattr("src.llm_service.generate_completion", fake_generate_completion)
+    monkeypatch.setattr("src.llm_service.retrieve_passages", fake_retrieve_passages)
+
+    reply = LLMService(fake_conv, cache_stats=PromptCacheStats()).generate_reply(fake_user, "Спасибо!")
+
+    assert reply == "Пожалуйста!"
+    assert [m["role"] for m in captured_messages["messages"]].count("system") == 1
+
+
+def test_build_prompt_legacy_layout_puts_context_after_system_prompt():
+    history = [DummyMessage("user", "hi"), DummyMessage("assistant", "hello"), DummyMessage("user", "question")]
+
+    msgs = build_prompt(history, "CONTEXT", "question", layout=PROMPT_LAYOUT_LEGACY)
+
+    assert [m["content"] for m in msgs[1:]] == ["CONTEXT", "hi", "hello", "question"]
+
+
+def test_build_prompt_cache_layout_keeps_history_prefix_stable():
+    history = [DummyMessage("user", "hi"), DummyMessage("assistant", "hello")]
+
+    first = build_prompt(history + [DummyMessage("user", "q1")], "CTX-1", "q1")
+    second = build_prompt(
+        history + [DummyMessage("user", "q1"), DummyMessage("assistant", "a1"), DummyMessage("user", "q2")],
+        "CTX-2",
+        "q2",
+    )
+
+    assert [m["content"] for m in first[1:]] == ["hi", "hello", "CTX-1", "q1"]
+    assert [m["content"] for m in second[1:]] == ["hi", "hello", "q1", "a1", "CTX-2", "q2"]
+
+
+def test_window_history_shifts_in_blocks():
+    stored, anchor, starts = [], None, []
+    for turn in range(40):
+        # Как в БД: хранится и читается не больше 6 последних сообщений
+        stored = (stored + [HistoryEntry("user", "ok", id=turn)])[-6:]
+        window = window_history(stored, anchor, limit=6)
+        anchor = window[0].id
+        starts.append(window[0].id)
+        assert 0 < len(window) <= 6 and window[-1].id == turn
+
+    # Одинаковые сообщения не сбивают окно: оно растёт с limit/2 до limit и
+    # сдвигается на ходах 6, 10, ..., 38, а не каждый ход
+    changes = [turn for turn in range(1, 40) if starts[turn] != starts[turn - 1]]
+    assert changes == list(range(6, 40, 4))
+
+
+def test_budget_is_looked_up_only_when_routing_uses_it(monkeypatch, fake_user):
+    monkeypatch.setattr(
+        "src.llm_service.generate_completion",
+        lambda messages, model=None, fallback_model=None: Completion(text="ok", model=model),
+    )
+    monkeypatch.setattr("src.llm_service.should_retrieve", lambda text: False)
+
+    single = FakeConversationService()
+    LLMService(single, cache_stats=PromptCacheStats(), router=ModelRouter(primary="main")).generate_reply(fake_user, "hi")
+    routed = FakeConversationService()
+    LLMService(
+        routed, cache_stats=PromptCacheStats(), router=ModelRouter(primary="main", small="mini")
+    ).generate_reply(fake_user, "hi")
+
+    assert single.budget_lookups == 0
+    assert routed.budget_lookups == 1
+
+
+def test_history_anchors_are_bounded(monkeypatch):
+    monkeypatch.setattr("src.llm_service.HISTORY_ANCHORS_MAX", 2)
+    service = LLMService(FakeConversationService(), cache_stats=PromptCacheStats())
+
+    service._set_anchor(1, 10)
+    service._set_anchor(2, 20)
+    assert service._get_anchor(1) == 10
+    service._set_anchor(1, 11)
+    service._set_anchor(3, 30)
+
+    # Вытесняется давно не обновлявшийся пользователь 2
+    assert [service._get_anchor(user_id) for user_id in (1, 2, 3)] == [11, None, 30]
@@ -0,0 +1,37 @@
+import pytest
+
+from src.metrics import Metrics
+
+
+def test_counters_are_kept_per_label_set():
+    registry = Metrics()
+
+    registry.increment("skipped", reason="stop_phrase")
+    registry.increment("skipped", reason="stop_phrase")
+    registry.increment("skipped", 0.5, reason="too_short")
+
+    assert registry.counter("skipped", reason="stop_phrase") == 2
+    assert registry.counter("skipped", reason="too_short") == 0.5
+    assert registry.counter("skipped") == 0
+    assert registry.snapshot()["counters"] == {
+        "skipped{reason=stop_phrase}": 2,
+        "skipped{reason=too_short}": 0.5,
+    }
+
+
+def test_histogram_summary_uses_recent_window_for_percentiles():
+    registry = Metrics(reservoir_size=100)
+
+    for value in range(1, 201):
+        registry.observe("latency", float(value), model="a")
+
+    summary = registry.summary("latency", model="a")
+
+    assert summary["count"] == 200
+    assert summary["mean"] == pytest.approx(100.5)
+    assert summary["p50"] == pytest.approx(150.5)
+    assert summary["p99"] == pytest.approx(199.01)
+    assert registry.summary("latency", model="b") is None
+
+    registry.reset()
+    assert registry.snapshot() == {"counters": {}, "histograms": {}}
@@ -0,0 +1,100 @@
+import pytest
+
+from src.metrics import metrics
+from src.model_router import ModelRouter
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def make_router(**overrides) -> ModelRouter:
+    params = dict(
+        primary="primary",
+        small="small",
+        large="large",
+        fallback="backup",
+        small_max_tokens=500,
+        large_min_tokens=4000,
+        low_budget_tokens=1000,
+        slow_p95_seconds=5.0,
+        failure_threshold=2,
+        cooldown_seconds=60.0,
+    )
+    params.update(overrides)
+    return ModelRouter(**params)
+
+
+def test_route_by_prompt_size_context_and_budget():
+    router = make_router()
+
+    assert router.route(100, has_context=False).model == "small"
+    assert router.route(100, has_context=False).reason == "short_chat"
+    assert router.route(2000, has_context=True).model == "primary"
+    assert router.route(5000, has_context=True).model == "large"
+    assert router.route(5000, has_context=True, remaining_budget=500).reason == "low_budget"
+    assert router.route(5000, has_context=True, remaining_budget=500).model == "small"
+
+    assert metrics.counter("router.decisions", model="small", reason="short_chat") == 2
+
+
+def test_route_without_extra_models_always_uses_primary():
+    router = ModelRouter(primary="primary", small=None, large=None, fallback=None)
+
+    decision = router.route(10, has_context=False)
+
+    assert decision.model == "primary"
+    assert decision.fallback is None
+
+
+def test_router_switches_to_fallback_after_failures():
+    router = make_router()
+
+    router.record_result("primary", 0.5, success=False)
+    assert router.route(2000, has_context=True).model == "primary"
+
+    router.record_result("primary", 0.5, success=False)
+    decision = router.route(2000, has_context=True)
+
+    assert decision.model == "backup"
+    assert decision.fallback is None
+    assert decision.reason == "default:degraded_primary"
+    assert metrics.counter("openai.failures", model="primary") == 2
+
+
+def test_router_switches_to_fallback_when_slow():
+    router = make_router()
+
+    for _ in range(10):
+        router.record_result("primary", 8.0, success=True)
+
+    assert router.route(2000, has_context=True).model == "backup"
+    assert router.latency_percentiles()["primary"]["p95"] == pytest.approx(8.0)
+
+
+def test_route_messages_counts_prompt_tokens():
+    router = make_router()
+
+    decision = router.route_messages([{"role": "user", "content": "hello"}], has_context=False)
+
+    assert decision.prompt_tokens > 6
+    assert decision.model == "small"
+
+
+def test_route_messages_counts_tokens_with_each_candidate_encoding(monkeypatch):
+    # Маленькая модель токенизирует по символам, основная — по словам
+    def fake_count(messages, model):
+        content = " ".join(message["content"] for message in messages)
+        return len(content) if model == "small" else len(content.split())
+
+    monkeypatch.setattr("src.model_router.count_message_tokens", fake_count)
+    router = make_router(small_max_tokens=10)
+    messages = [{"role": "user", "content": "one two three four five six"}]
+
+    decision = router.route_messages(messages, has_context=False)
+
+    assert decision.model == "primary"
+    assert decision.prompt_tokens == 6
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from src import openai_client
+
+
+class FakeCompletions:
+    def __init__(self, response):
+        self._response = response
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return self._response
+
+
+def make_client(response):
+    completions = FakeCompletions(response)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+def test_generate_completion_reports_cached_tokens(monkeypatch):
+    response = SimpleNamespace(
+        model="gpt-4o-mini-2024-07-18",
+        choices=[SimpleNamespace(message=SimpleNamespace(content="ответ"))],
+        usage=SimpleNamespace(
+            prompt_tokens=2048,
+            completion_tokens=20,
+            total_tokens=2068,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=1920),
+        ),
+    )
+    client, completions = make_client(response)
+    monkeypatch.setattr(openai_client, "client", client)
+
+    completion = openai_client.generate_completion([{"role": "user", "content": "вопрос"}])
+
+    assert completion.text == "ответ"
+    assert completion.model == "gpt-4o-mini-2024-07-18"
+    assert (completion.prompt_tokens, completion.cached_tokens, completion.completion_tokens) == (2048, 1920, 20)
+    assert completion.latency_seconds >= 0
+    assert completions.calls[0]["model"] == openai_client.OPENAI_MODEL
+
+
+def test_generate_completion_tolerates_missing_usage_details(monkeypatch):
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=None))],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=1, total_tokens=11, prompt_tokens_details=None),
+    )
+    client, _ = make_client(response)
+    monkeypatch.setattr(openai_client, "client", client)
+
+    completion = openai_client.generate_completion([])
+
+    assert completion.cached_tokens == 0
+    assert completion.text == "Извините, не удалось сформировать ответ."
+    assert openai_client.generate_answer([]) == completion.text
+
+
+def test_generate_completion_retries_on_fallback_model(monkeypatch):
+    response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))], usage=None)
+    models = []
+
+    class FlakyCompletions:
+        def create(self, **kwargs):
+            models.append(kwargs["model"])
+            if kwargs["model"] == "primary":
+                raise TimeoutError("slow primary")
+            return response
+
+    monkeypatch.setattr(openai_client, "client", SimpleNamespace(chat=SimpleNamespace(completions=FlakyCompletions())))
+    monkeypatch.setattr(openai_client.time, "sleep", lambda seconds: None)
+
+    completion = openai_client.generate_completion([], model="primary", fallback_model="backup")
+
+    assert models == ["primary", "backup"]
+    assert completion.text == "ok"
+    assert completion.model == "backup"
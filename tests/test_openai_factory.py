@@ -0,0 +1,78 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src import openai_factory
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa: N802 - имя задаёт BaseHTTPRequestHandler
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002 - сигнатура базового класса
+        return
+
+
+@pytest.fixture()
+def local_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_factory():
+    openai_factory.close_clients()
+    openai_factory.transport_stats.reset()
+    yield
+    openai_factory.close_clients()
+    openai_factory.transport_stats.reset()
+
+
+def test_get_client_returns_none_without_api_key(monkeypatch):
+    monkeypatch.setattr(openai_factory, "OPENAI_API_KEY", None)
+
+    assert openai_factory.get_client(openai_factory.CALL_COMPLETION) is None
+
+
+def test_clients_share_transport_with_per_call_timeouts(monkeypatch):
+    monkeypatch.setattr(openai_factory, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(openai_factory, "OPENAI_CONNECT_TIMEOUT", 2.0)
+    monkeypatch.setattr(openai_factory, "OPENAI_COMPLETION_READ_TIMEOUT", 30.0)
+    monkeypatch.setattr(openai_factory, "OPENAI_EMBEDDING_READ_TIMEOUT", 7.0)
+
+    completion = openai_factory.get_client(openai_factory.CALL_COMPLETION)
+    embedding = openai_factory.get_client(openai_factory.CALL_EMBEDDING)
+
+    assert completion is openai_factory.get_client(openai_factory.CALL_COMPLETION)
+    assert completion._client is embedding._client is openai_factory.get_http_client()
+    assert completion.timeout.read == 30.0 and completion.timeout.connect == 2.0
+    assert embedding.timeout.read == 7.0 and embedding.timeout.connect == 2.0
+
+    with pytest.raises(ValueError):
+        openai_factory.get_client("unknown")
+
+
+def test_transport_stats_track_connection_reuse(local_server):
+    http_client = openai_factory.get_http_client()
+
+    for _ in range(3):
+        assert http_client.get(local_server).status_code == 200
+
+    stats = openai_factory.transport_stats.snapshot()
+    assert stats["requests"] == 3
+    assert stats["new_connections"] == 1
+    assert stats["reuse_rate"] == pytest.approx(2 / 3)
+    assert stats["connect_ms_total"] > 0
+    assert stats["tls_ms_total"] == 0
@@ -0,0 +1,153 @@
+import json
+
+import numpy as np
+import openai
+import pytest
+from openai import OpenAI
+
+from src.openai_stub import LatencyModel, StubConfig, StubServer, hash_embedding
+
+
+def make_client(server: StubServer, **kwargs) -> OpenAI:
+    kwargs.setdefault("max_retries", 0)
+    return OpenAI(api_key="stub", base_url=server.base_url, **kwargs)
+
+
+def test_chat_completion_is_deterministic_and_reports_usage():
+    with StubServer(StubConfig(reply_words=10)) as server:
+        client = make_client(server)
+        messages = [{"role": "system", "content": "sys"}, {"role": "user", "content": "Как оплатить заказ?"}]
+
+        first = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
+        second = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
+
+    assert first.choices[0].message.content == second.choices[0].message.content
+    assert "Как оплатить заказ?" in first.choices[0].message.content
+    assert first.usage.prompt_tokens > 0
+    assert first.usage.completion_tokens > 0
+    assert first.usage.total_tokens == first.usage.prompt_tokens + first.usage.completion_tokens
+    assert first.usage.prompt_tokens_details.cached_tokens == 0
+
+
+def test_repeated_long_prefix_is_reported_as_cached():
+    long_system = "правило " * 1500
+    with StubServer() as server:
+        client = make_client(server)
+        client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "system", "content": long_system}, {"role": "user", "content": "первый"}],
+        )
+        response = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "system", "content": long_system}, {"role": "user", "content": "второй"}],
+        )
+
+    cached = response.usage.prompt_tokens_details.cached_tokens
+    assert cached >= 1024
+    assert (cached - 1024) % 128 == 0
+    assert cached < response.usage.prompt_tokens
+
+
+def test_streaming_completion_yields_same_text_and_usage():
+    messages = [{"role": "user", "content": "расскажи про доставку"}]
+    with StubServer(StubConfig(reply_words=8)) as server:
+        client = make_client(server)
+        full = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
+        stream = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        chunks = list(stream)
+
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+    assert text == full.choices[0].message.content
+    assert chunks[-1].usage.completion_tokens == full.usage.completion_tokens
+
+
+def test_embeddings_match_local_hash_embedding():
+    with StubServer() as server:
+        client = make_client(server)
+        response = client.embeddings.create(model="text-embedding-3-small", input=["один", "два"])
+        floats = client.embeddings.create(model="text-embedding-3-small", input="один", encoding_format="float")
+
+    assert [item.index for item in response.data] == [0, 1]
+    assert len(response.data[0].embedding) == 1536
+    np.testing.assert_allclose(response.data[0].embedding, hash_embedding("один"), rtol=1e-6)
+    np.testing.assert_allclose(floats.data[0].embedding, response.data[0].embedding, rtol=1e-6)
+    assert response.usage.prompt_tokens > 0
+
+
+def test_injected_429_carries_retry_after():
+    with StubServer(StubConfig(error_rate_429=1.0, retry_after=0.25)) as server:
+        client = make_client(server)
+        with pytest.raises(openai.RateLimitError) as excinfo:
+            client.embeddings.create(model="text-embedding-3-small", input="x")
+
+    assert float(excinfo.value.response.headers["Retry-After"]) == pytest.approx(0.25)
+
+
+def test_rps_cap_rejects_excess_requests_and_client_retries():
+    with StubServer(StubConfig(max_rps=5)) as server:
+        client = make_client(server)
+        statuses = []
+        for _ in range(8):
+            try:
+                client.embeddings.create(model="text-embedding-3-small", input="x")
+                statuses.append(200)
+            except openai.RateLimitError:
+                statuses.append(429)
+
+        # С повторами клиент дожидается Retry-After и получает ответ
+        make_client(server, max_retries=3).embeddings.create(model="text-embedding-3-small", input="x")
+        stats = server.stub.stats.snapshot()
+
+    assert statuses[:5] == [200] * 5
+    assert 429 in statuses
+    assert stats["status_429"] >= statuses.count(429)
+
+
+def test_injected_timeout_surfaces_as_client_timeout():
+    with StubServer(StubConfig(timeout_rate=1.0, timeout_seconds=1.0)) as server:
+        client = make_client(server, timeout=0.2)
+        with pytest.raises(openai.APITimeoutError):
+            client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "hi"}])
+
+
+def test_latency_model_distributions():
+    import random
+
+    rng = random.Random(1)
+    assert LatencyModel("fixed", 100).sample(rng) == pytest.approx(0.1)
+    assert 0.05 <= LatencyModel("uniform", 100, 50).sample(rng) <= 0.15
+    samples = sorted(LatencyModel("lognormal", 100, 0.5).sample(rng) for _ in range(2001))
+    assert samples[1000] == pytest.approx(0.1, rel=0.15)
+    assert LatencyModel("lognormal", 0, 0.5).sample(rng) == 0.0
+
+
+def test_batch_api_splits_results_into_output_and_error_files():
+    lines = [
+        {"custom_id": "ok", "method": "POST", "url": "/v1/embeddings", "body": {"model": "m", "input": "оплата"}},
+        {"custom_id": "bad", "method": "POST", "url": "/v1/chat/completions", "body": {}},
+    ]
+    content = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines).encode("utf-8")
+
+    with StubServer() as server:
+        client = make_client(server)
+        uploaded = client.files.create(file=("requests.jsonl", content), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id, endpoint="/v1/embeddings", completion_window="24h"
+        )
+        batch = client.batches.retrieve(batch.id)
+        output = [json.loads(line) for line in client.files.content(batch.output_file_id).text.splitlines()]
+        errors = [json.loads(line) for line in client.files.content(batch.error_file_id).text.splitlines()]
+        with pytest.raises(openai.BadRequestError):
+            client.batches.create(input_file_id=uploaded.id, endpoint="/v1/completions", completion_window="24h")
+
+    assert uploaded.bytes == len(content)
+    assert batch.status == "completed"
+    assert (batch.request_counts.completed, batch.request_counts.failed) == (1, 1)
+    assert output[0]["custom_id"] == "ok"
+    assert output[0]["response"]["body"]["data"][0]["embedding"] == pytest.approx(hash_embedding("оплата").tolist())
+    assert errors[0]["custom_id"] == "bad" and errors[0]["response"]["status_code"] == 400
@@ -0,0 +1,77 @@
+from datetime import date
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+
+from src.partitions import (
+    add_months,
+    create_partition,
+    expired_partitions,
+    maintain_partitions,
+    parse_partition_name,
+    partition_name,
+)
+
+
+def test_add_months_crosses_year_boundaries():
+    assert add_months(date(2025, 11, 1), 2) == date(2026, 1, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+    assert add_months(date(2026, 3, 1), -15) == date(2024, 12, 1)
+
+
+def test_partition_name_round_trip():
+    assert partition_name(date(2026, 2, 1)) == "messages_p202602"
+    assert parse_partition_name("messages_p202602") == date(2026, 2, 1)
+    assert parse_partition_name("messages_default") is None
+    assert parse_partition_name("messages_p2026021") is None
+
+
+def test_expired_partitions_keeps_full_retention_window():
+    partitions = [(partition_name(date(2026, month, 1)), date(2026, month, 1)) for month in range(1, 11)]
+
+    expired = expired_partitions(partitions, today=date(2026, 10, 19), retention_months=3)
+
+    # Октябрь текущий, хранятся июль–сентябрь
+    assert expired == [partition_name(date(2026, month, 1)) for month in range(1, 7)]
+
+
+def test_expired_partitions_disabled_by_zero_retention():
+    partitions = [(partition_name(date(2020, 1, 1)), date(2020, 1, 1))]
+
+    assert expired_partitions(partitions, today=date(2026, 10, 19), retention_months=0) == []
+
+
+def test_maintain_partitions_is_noop_on_sqlite():
+    engine = create_engine("sqlite:///:memory:")
+
+    assert maintain_partitions(engine) == {"created": [], "dropped": []}
+
+
+class RecordingConnection:
+    """Записывает SQL; на проверки (to_regclass, EXISTS) отвечает scalar_result."""
+
+    def __init__(self, scalar_result):
+        self.statements = []
+        self.scalar_result = scalar_result
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+        return SimpleNamespace(scalar=lambda: self.scalar_result, rowcount=3)
+
+
+def test_create_partition_moves_rows_out_of_default_partition():
+    conn = RecordingConnection(scalar_result=True)
+
+    assert create_partition(conn, date(2026, 11, 1)) == "messages_p202611"
+
+    moved = [statement for statement in conn.statements if "DELETE FROM messages_default" in statement]
+    assert len(moved) == 1 and "INSERT INTO messages_p202611" in moved[0]
+    assert "ATTACH PARTITION messages_p202611 FOR VALUES FROM ('2026-11-01') TO ('2026-12-01')" in conn.statements[-1]
+
+
+def test_create_partition_without_stray_rows_creates_it_directly():
+    conn = RecordingConnection(scalar_result=False)
+
+    create_partition(conn, date(2026, 11, 1))
+
+    assert conn.statements[-1].startswith("CREATE TABLE IF NOT EXISTS messages_p202611 PARTITION OF messages")
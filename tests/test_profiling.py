@@ -0,0 +1,40 @@
+import threading
+import time
+
+from src.profiling import SamplingProfiler
+
+
+def busy_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def test_profiler_writes_collapsed_stacks_of_other_threads(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="worker")
+    worker.start()
+    try:
+        result = SamplingProfiler(str(tmp_path), interval_ms=1).run(0.2)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert result.samples > 0
+    lines = result.path.read_text(encoding="utf-8").splitlines()
+    assert any(line.startswith("worker;") and "busy_loop" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_profiler_rejects_concurrent_sessions(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), interval_ms=1)
+    results = []
+    first = threading.Thread(target=lambda: results.append(profiler.run(0.3)))
+    first.start()
+    time.sleep(0.05)
+
+    assert profiler.busy
+    assert profiler.run(0.1) is None
+
+    first.join()
+    assert results[0] is not None
+    assert not profiler.busy
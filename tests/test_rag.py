@@ -3,10 +3,11 @@ from pathlib import Path
 
 import pytest
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, undefer
 
 from src import rag
 from src.db import Base, Document, DocumentChunk, EMBEDDING_DIM
+from src.read_models import ChunkHit
 
 
 def create_sqlite_session_factory():
@@ -42,7 +43,12 @@ def test_ingest_text_creates_document_and_chunks(monkeypatch):
         doc = rag.ingest_text(db, title="Test Doc", source="test.txt", text=sample_text)
 
         documents = db.query(Document).all()
-        chunks = db.query(DocumentChunk).order_by(DocumentChunk.chunk_index.asc()).all()
+        chunks = (
+            db.query(DocumentChunk)
+            .options(undefer(DocumentChunk.embedding))
+            .order_by(DocumentChunk.chunk_index.asc())
+            .all()
+        )
 
     assert len(documents) == 1
     assert documents[0].id == doc.id
@@ -66,15 +72,17 @@ def test_retrieve_relevant_chunks_uses_embedding_and_limit(monkeypatch):
     monkeypatch.setattr("src.rag._get_embedding", fake_get_embedding)
 
     fake_chunks = [
-        SimpleNamespace(text="chunk-1"),
-        SimpleNamespace(text="chunk-2"),
-        SimpleNamespace(text="chunk-3"),
+        SimpleNamespace(id=i, document_id=1, chunk_index=i, text=f"chunk-{i}", distance=0.1 * i)
+        for i in (1, 2, 3)
     ]
 
     class FakeQuery:
         def __init__(self, items):
             self._items = items
 
+        def filter(self, *criteria):  # фильтр по наличию эмбеддинга не влияет на фейковые данные
+            return self
+
         def order_by(self, *args, **kwargs):  # pragma: no cover - просто игнорируем выражение сортировки
             return self
 
@@ -90,7 +98,7 @@ def test_retrieve_relevant_chunks_uses_embedding_and_limit(monkeypatch):
         def __init__(self, items):
             self._items = items
 
-        def query(self, model):  # noqa: ARG002 - model не используется в тесте
+        def query(self, *entities):  # noqa: ARG002 - колонки не используются в тесте
             return FakeQuery(self._items)
 
     db = FakeSession(fake_chunks)
@@ -102,6 +110,8 @@ def test_retrieve_relevant_chunks_uses_embedding_and_limit(monkeypatch):
     assert len(result) == 2
     assert result[0].text == "chunk-1"
     assert result[1].text == "chunk-2"
+    assert isinstance(result[0], ChunkHit)
+    assert result[0].distance == pytest.approx(0.1)
 
 
 def test_retrieve_relevant_chunks_returns_empty_if_no_client(monkeypatch):
@@ -143,6 +153,9 @@ def test_sample_file_ingest_and_retrieve(monkeypatch):
         def __init__(self, items):
             self._items = items
 
+        def filter(self, *criteria):  # фильтр по наличию эмбеддинга не влияет на фейковые данные
+            return self
+
         def order_by(self, *args, **kwargs):  # pragma: no cover - просто игнорируем выражение сортировки
             return self
 
@@ -157,10 +170,15 @@ def test_sample_file_ingest_and_retrieve(monkeypatch):
         def __init__(self, items):
             self._items = items
 
-        def query(self, model):  # noqa: ARG002 - model не используется в тесте
+        def query(self, *entities):  # noqa: ARG002 - колонки не используются в тесте
             return FakeQuery(self._items)
 
-    fake_db = FakeSession(stored_chunks)
+    fake_db = FakeSession(
+        [
+            SimpleNamespace(id=c.id, document_id=c.document_id, chunk_index=c.chunk_index, text=c.text, distance=0.0)
+            for c in stored_chunks
+        ]
+    )
 
     chunks = rag.retrieve_relevant_chunks(fake_db, "тестовый документ для RAG", limit=3)
 
@@ -172,3 +190,20 @@ def test_sample_file_ingest_and_retrieve(monkeypatch):
     snippet = first_non_empty_line[:30]
 
     assert any(snippet in chunk.text for chunk in chunks)
+
+
+def test_retrieve_passages_drops_chunks_beyond_max_distance(monkeypatch):
+    def fake_search_chunks(db, embedding, limit, with_embeddings=False, collection=None):
+        return [
+            ChunkHit(1, 1, 0, "close chunk", 0.4, [1.0, 0.0]),
+            ChunkHit(2, 2, 0, "far chunk", 1.3, [0.0, 1.0]),
+        ]
+
+    monkeypatch.setattr("src.rag._client", object())
+    monkeypatch.setattr("src.rag._get_embedding", lambda text: [1.0, 0.0])
+    monkeypatch.setattr("src.rag.search_chunks", fake_search_chunks)
+
+    passages = rag.retrieve_passages(None, "question", max_distance=1.0)
+    assert [p.text for p in passages] == ["close chunk"]
+
+    assert rag.retrieve_passages(None, "question", max_distance=0.1) == []
@@ -0,0 +1,45 @@
+import pytest
+
+from src import rag_gate
+from src.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.mark.parametrize(
+    "text, reason",
+    [
+        ("спасибо", "stop_phrase"),
+        ("Спасибо большое!!! 🙏", "stop_phrase"),
+        ("ok", "stop_phrase"),
+        ("А подробнее?", "follow_up"),
+        ("?!", "empty"),
+        ("zx", "too_short"),
+        ("Как вернуть деньги за заказ?", None),
+        ("VPN не работает", None),
+    ],
+)
+def test_retrieval_skip_reason(text, reason):
+    assert rag_gate.retrieval_skip_reason(text) == reason
+
+
+def test_should_retrieve_records_skip_rate_and_saved_latency():
+    metrics.observe("rag.retrieval_seconds", 0.2)
+    metrics.observe("rag.retrieval_seconds", 0.4)
+
+    assert rag_gate.should_retrieve("Как оформить возврат?") is True
+    assert rag_gate.should_retrieve("спасибо") is False
+    assert rag_gate.should_retrieve("ок") is False
+    metrics.increment("rag.gate.skipped", reason="distance")
+
+    stats = rag_gate.gate_stats()
+
+    assert stats["checked"] == 3
+    assert stats["skipped"] == 3
+    assert stats["skip_rate"] == pytest.approx(1.0)
+    assert stats["latency_saved_seconds"] == pytest.approx(0.6)
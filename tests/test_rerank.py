@@ -0,0 +1,86 @@
+from src import rag
+from src.read_models import ChunkHit
+from src.rerank import fill_token_budget, merge_adjacent, mmr_order
+
+
+def make_hit(document_id: int, chunk_index: int, text: str, embedding=None) -> ChunkHit:
+    return ChunkHit(
+        id=document_id * 100 + chunk_index,
+        document_id=document_id,
+        chunk_index=chunk_index,
+        text=text,
+        distance=0.0,
+        embedding=embedding,
+    )
+
+
+def word_count(text: str) -> int:
+    return len(text.split())
+
+
+def test_mmr_order_prefers_diverse_candidates_over_duplicates():
+    query = [1.0, 0.0]
+    candidates = [
+        [1.0, 0.05],  # самый релевантный
+        [1.0, 0.06],  # почти дубликат первого
+        [0.6, 0.8],  # менее релевантный, но другой
+    ]
+
+    assert mmr_order(query, candidates, lambda_mult=0.3) == [0, 2, 1]
+    assert mmr_order(query, candidates, lambda_mult=1.0) == [0, 1, 2]
+    assert mmr_order(query, []) == []
+
+
+def test_merge_adjacent_removes_overlap_between_neighbour_chunks():
+    text = " ".join(f"word{i}" for i in range(400))
+    chunks = rag._split_text(text, chunk_size=300, overlap=80)
+    hits = [make_hit(1, 1, chunks[1]), make_hit(2, 0, "other doc"), make_hit(1, 0, chunks[0])]
+
+    passages = merge_adjacent(hits, max_overlap=80)
+
+    assert [(p.document_id, p.first_chunk, p.last_chunk) for p in passages] == [(1, 0, 1), (2, 0, 0)]
+    assert passages[0].text == text[: len(passages[0].text)]
+    assert passages[0].rank == 0
+
+
+def test_merge_adjacent_keeps_non_adjacent_chunks_separate():
+    hits = [make_hit(1, 0, "alpha"), make_hit(1, 2, "gamma")]
+
+    passages = merge_adjacent(hits, max_overlap=200)
+
+    assert [p.text for p in passages] == ["alpha", "gamma"]
+
+
+def test_fill_token_budget_skips_chunks_that_do_not_fit():
+    hits = [
+        make_hit(1, 0, "one two three"),
+        make_hit(2, 0, "a b c d e f g h"),
+        make_hit(3, 0, "four five"),
+    ]
+
+    passages = fill_token_budget(hits, token_budget=6, count_tokens=word_count, max_overlap=200)
+
+    assert [p.text for p in passages] == ["one two three", "four five"]
+
+
+def test_retrieve_passages_reranks_and_respects_budget(monkeypatch):
+    captured = {}
+
+    def fake_search_chunks(db, embedding, limit, with_embeddings=False, collection=None):
+        captured["limit"] = limit
+        captured["with_embeddings"] = with_embeddings
+        return [
+            make_hit(1, 0, "first copy of the answer", embedding=[1.0, 0.0]),
+            make_hit(2, 0, "second copy of the answer", embedding=[1.0, 0.01]),
+            make_hit(3, 0, "different angle", embedding=[0.7, 0.7]),
+        ]
+
+    monkeypatch.setattr("src.rag._client", object())
+    monkeypatch.setattr("src.rag._get_embedding", lambda text: [1.0, 0.0])
+    monkeypatch.setattr("src.rag.search_chunks", fake_search_chunks)
+    monkeypatch.setattr("src.rag.count_tokens", word_count)
+
+    passages = rag.retrieve_passages(None, "question", token_budget=7, candidates=10, lambda_mult=0.5)
+
+    assert captured == {"limit": 10, "with_embeddings": True}
+    assert [p.text for p in passages] == ["first copy of the answer", "different angle"]
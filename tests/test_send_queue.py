@@ -0,0 +1,174 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from src.send_queue import PRIORITY_BULK, PRIORITY_INTERACTIVE, SendQueue, split_message
+
+
+class FakeBot:
+    """Записывает отправленные сообщения; для чатов из flood отвечает 429 один раз."""
+
+    def __init__(self, flood=(), retry_after=1):
+        self.sent = []
+        self.sent_kwargs = []
+        self.flood = set(flood)
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.flood:
+            self.flood.discard(chat_id)
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text),
+                message="Too Many Requests",
+                retry_after=self.retry_after,
+            )
+        self.sent.append((chat_id, text))
+        self.sent_kwargs.append(kwargs)
+        return text
+
+
+def test_split_message_prefers_paragraph_boundaries():
+    text = "first paragraph.\n\n" + "second " * 10
+    parts = split_message(text, limit=40)
+
+    assert parts[0] == "first paragraph."
+    assert all(len(part) <= 40 for part in parts)
+    assert " ".join(parts).split() == text.split()
+
+
+def test_split_message_keeps_code_fences_balanced():
+    code = "\n".join(f"line_{i} = {i}" for i in range(30))
+    text = f"intro\n```python\n{code}\n```\noutro"
+    parts = split_message(text, limit=120)
+
+    assert len(parts) > 2
+    for part in parts:
+        assert len(part) <= 120
+        assert part.count("```") % 2 == 0
+    assert parts[1].startswith("```python\n")
+
+
+def test_split_message_keeps_code_indentation():
+    code = "\n".join(f"    value_{i} = {i}" for i in range(30))
+    text = f"```python\ndef f():\n{code}\n```"
+    parts = split_message(text, limit=120)
+
+    assert len(parts) > 2
+    lines = [line for part in parts for line in part.split("\n") if "value_" in line]
+    assert lines == code.split("\n")
+
+
+def test_split_message_counts_utf16_units():
+    parts = split_message("😀" * 20, limit=16)
+
+    # Эмодзи занимает две единицы UTF-16
+    assert all(len(part.encode("utf-16-le")) // 2 <= 16 for part in parts)
+    assert "".join(parts) == "😀" * 20
+
+
+def test_short_message_is_not_split():
+    assert split_message("hello") == ["hello"]
+
+
+def test_interactive_messages_go_before_bulk():
+    async def scenario():
+        bot = FakeBot()
+        queue = SendQueue(bot, global_rate=1000, chat_rate=1000, chat_burst=1)
+        bulk = [queue.enqueue(chat_id, "news", priority=PRIORITY_BULK)[0] for chat_id in range(1, 4)]
+        reply = queue.enqueue(99, "answer", priority=PRIORITY_INTERACTIVE)[0]
+        queue.start()
+        await asyncio.gather(reply, *bulk)
+        await queue.close()
+        return bot.sent
+
+    sent = asyncio.run(scenario())
+
+    assert sent[0] == (99, "answer")
+    assert [chat_id for chat_id, _ in sent[1:]] == [1, 2, 3]
+
+
+def test_sequential_sends_to_one_chat_respect_chat_rate():
+    async def scenario():
+        bot = FakeBot()
+        queue = SendQueue(bot, global_rate=1000, chat_rate=4, chat_burst=1)
+        queue.start()
+        started = asyncio.get_running_loop().time()
+        for index in range(4):
+            await queue.send(7, f"message {index}")
+        loop_time = asyncio.get_running_loop().time()
+        await queue.close()
+        return loop_time - started
+
+    # Первое сообщение уходит сразу, следующие три — по одному в 1/4 секунды
+    assert asyncio.run(scenario()) >= 0.7
+
+
+def test_messages_in_one_chat_keep_order():
+    async def scenario():
+        bot = FakeBot()
+        queue = SendQueue(bot, global_rate=1000, chat_rate=1000, chat_burst=10)
+        queue.start()
+        await asyncio.gather(*(queue.send(1, f"m{i}") for i in range(5)))
+        await queue.close()
+        return bot.sent
+
+    assert [text for _, text in asyncio.run(scenario())] == [f"m{i}" for i in range(5)]
+
+
+def test_retry_after_pauses_only_its_chat():
+    async def scenario():
+        bot = FakeBot(flood={1}, retry_after=0.2)
+        queue = SendQueue(bot, global_rate=1000, chat_rate=1000, chat_burst=10)
+        queue.start()
+        flooded = asyncio.create_task(queue.send(1, "flooded"))
+        await asyncio.sleep(0.01)
+        other = await asyncio.wait_for(queue.send(2, "other"), timeout=0.1)
+        sent_before_retry = list(bot.sent)
+        await flooded
+        await queue.close()
+        return other, sent_before_retry, bot.sent
+
+    other, sent_before_retry, sent = asyncio.run(scenario())
+
+    assert other == ["other"]
+    assert sent_before_retry == [(2, "other")]
+    assert sent == [(2, "other"), (1, "flooded")]
+
+
+def test_send_error_is_raised_to_caller():
+    class BrokenBot(FakeBot):
+        async def send_message(self, chat_id, text, **kwargs):
+            raise RuntimeError("chat not found")
+
+    async def scenario():
+        queue = SendQueue(BrokenBot(), global_rate=1000, chat_rate=1000)
+        queue.start()
+        try:
+            await queue.send(1, "hello")
+        finally:
+            await queue.close()
+
+    try:
+        asyncio.run(scenario())
+    except RuntimeError as exc:
+        assert str(exc) == "chat not found"
+    else:
+        raise AssertionError("send() must raise the delivery error")
+
+
+def test_send_forwards_thread_and_sends_split_parts_as_plain_text():
+    async def scenario():
+        bot = FakeBot()
+        queue = SendQueue(bot, global_rate=1000, chat_rate=1000, chat_burst=10)
+        queue.start()
+        await queue.send(5, "short", message_thread_id=7, parse_mode="HTML")
+        await queue.send(5, "**long** " * 1000, message_thread_id=7, parse_mode="Markdown")
+        await queue.close()
+        return bot.sent_kwargs
+
+    sent_kwargs = asyncio.run(scenario())
+
+    assert sent_kwargs[0] == {"message_thread_id": 7, "parse_mode": "HTML"}
+    assert len(sent_kwargs) > 2
+    assert all(kwargs == {"message_thread_id": 7, "parse_mode": None} for kwargs in sent_kwargs[1:])
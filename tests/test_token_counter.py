@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+from src import token_counter
+
+
+@pytest.fixture(autouse=True)
+def clear_encoding_cache():
+    token_counter._encodings.clear()
+    token_counter._encoding_failures.clear()
+    yield
+    token_counter._encodings.clear()
+    token_counter._encoding_failures.clear()
+
+
+def test_count_tokens_falls_back_to_estimate_when_encoding_unavailable(monkeypatch):
+    import tiktoken
+
+    calls = []
+
+    def failing_encoding_for_model(model):
+        calls.append(model)
+        raise ConnectionError("no network")
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", failing_encoding_for_model)
+
+    assert token_counter.count_tokens("a" * 40) == 10
+    assert token_counter.count_tokens("b") == 1
+    assert token_counter.preload_encoding() is False
+    # Неудачная загрузка не повторяется на каждое сообщение
+    assert calls == ["gpt-4o-mini"]
+
+
+def test_failed_encoding_load_is_retried_after_delay(monkeypatch):
+    import tiktoken
+
+    class FakeEncoding:
+        def encode(self, text):
+            return text.split()
+
+    outcomes = [ConnectionError("no network"), FakeEncoding()]
+
+    def flaky_encoding_for_model(model):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", flaky_encoding_for_model)
+    monkeypatch.setattr(token_counter, "TIKTOKEN_RETRY_SECONDS", 0.05)
+
+    assert token_counter.preload_encoding() is False
+    assert token_counter.count_tokens("one two") == 1  # оценка по байтам, без новой загрузки
+    assert len(outcomes) == 1
+
+    time.sleep(0.06)
+    assert token_counter.count_tokens("one two") == 2
+    assert token_counter.preload_encoding() is True
+    assert outcomes == []
+
+
+def test_count_tokens_uses_cached_encoding(monkeypatch):
+    import tiktoken
+
+    class FakeEncoding:
+        def encode(self, text):
+            return text.split()
+
+    calls = []
+
+    def fake_encoding_for_model(model):
+        calls.append(model)
+        return FakeEncoding()
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", fake_encoding_for_model)
+
+    assert token_counter.preload_encoding("gpt-4o-mini") is True
+    assert token_counter.count_tokens("one two three") == 3
+    assert token_counter.count_tokens("") == 0
+    assert calls == ["gpt-4o-mini"]
+
+
+def test_count_message_tokens_uses_encoding_of_requested_model(monkeypatch):
+    import tiktoken
+
+    class WordEncoding:
+        def encode(self, text):
+            return text.split()
+
+    class CharEncoding:
+        def encode(self, text):
+            return list(text)
+
+    encodings = {"word-model": WordEncoding(), "char-model": CharEncoding()}
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: encodings[model])
+
+    messages = [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi there"}]
+
+    assert token_counter.count_message_tokens(messages, "word-model") == 3 + 2 * 3 + 4
+    assert token_counter.count_message_tokens(messages, "char-model") == 3 + 2 * 3 + 16
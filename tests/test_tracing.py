@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+
+from src.tracing import TraceExporter, Tracer, format_tree, span, traced
+
+
+def make_tracer(tmp_path, sample_rate=1.0, slow_ms=0.0) -> Tracer:
+    return Tracer(TraceExporter(str(tmp_path / "spans.jsonl")), sample_rate=sample_rate, slow_ms=slow_ms)
+
+
+def read_spans(tmp_path):
+    lines = (tmp_path / "spans.jsonl").read_text(encoding="utf-8").splitlines()
+    return [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"] for line in lines]
+
+
+def test_span_outside_trace_is_noop():
+    with span("db.query") as current:
+        assert current is None
+
+
+def test_sampled_trace_is_exported_as_otlp_tree(tmp_path):
+    tracer = make_tracer(tmp_path)
+
+    @traced("db.query")
+    def query():
+        return 42
+
+    with tracer.start_trace("telegram.update", update_id=7):
+        with span("llm.generate_reply", model="gpt-4o-mini"):
+            assert query() == 42
+
+    [spans] = read_spans(tmp_path)
+    by_name = {item["name"]: item for item in spans}
+    root = by_name["telegram.update"]
+    assert "parentSpanId" not in root
+    assert {"key": "telegram.update_id", "value": {"intValue": "7"}} in root["attributes"]
+    assert by_name["llm.generate_reply"]["parentSpanId"] == root["spanId"]
+    assert by_name["db.query"]["parentSpanId"] == by_name["llm.generate_reply"]["spanId"]
+    assert len({item["traceId"] for item in spans}) == 1
+    assert len(root["traceId"]) == 32 and len(root["spanId"]) == 16
+    assert int(root["endTimeUnixNano"]) >= int(by_name["db.query"]["endTimeUnixNano"])
+
+
+def test_spans_from_worker_threads_join_the_update_trace(tmp_path):
+    tracer = make_tracer(tmp_path)
+
+    @traced("conversation.get_history")
+    def blocking_call():
+        return "ok"
+
+    async def handler():
+        with tracer.start_trace("telegram.update", update_id=1):
+            return await asyncio.to_thread(blocking_call)
+
+    assert asyncio.run(handler()) == "ok"
+
+    [spans] = read_spans(tmp_path)
+    assert sorted(item["name"] for item in spans) == ["conversation.get_history", "telegram.update"]
+
+
+def test_errors_mark_span_status(tmp_path):
+    tracer = make_tracer(tmp_path)
+
+    with pytest.raises(RuntimeError):
+        with tracer.start_trace("telegram.update", update_id=1):
+            with span("openai.chat_completion"):
+                raise RuntimeError("boom")
+
+    [spans] = read_spans(tmp_path)
+    failed = next(item for item in spans if item["name"] == "openai.chat_completion")
+    assert failed["status"] == {"code": 2, "message": "RuntimeError: boom"}
+
+
+def test_unsampled_fast_traces_are_dropped_and_slow_ones_captured(tmp_path, caplog):
+    tracer = make_tracer(tmp_path, sample_rate=0.0, slow_ms=50)
+
+    with tracer.start_trace("telegram.update", update_id=1):
+        pass
+    assert not (tmp_path / "spans.jsonl").exists()
+
+    with caplog.at_level("WARNING", logger="src.tracing"):
+        with tracer.start_trace("telegram.update", update_id=2):
+            with span("rag.vector_search"):
+                import time
+
+                time.sleep(0.06)
+
+    [spans] = read_spans(tmp_path)
+    root = next(item for item in spans if item["name"] == "telegram.update")
+    assert {"key": "trace.slow", "value": {"boolValue": True}} in root["attributes"]
+    assert "rag.vector_search" in caplog.text
+
+
+def test_disabled_tracer_records_nothing(tmp_path):
+    tracer = make_tracer(tmp_path, sample_rate=0.0, slow_ms=0.0)
+
+    with tracer.start_trace("telegram.update", update_id=1) as root:
+        with span("db.query") as child:
+            assert root is None and child is None
+
+
+def test_format_tree_indents_children():
+    from src.tracing import Span
+
+    spans = [
+        Span("root", "a", None, 0, 10_000_000),
+        Span("child", "b", "a", 1_000_000, 3_000_000, error="ValueError: x"),
+    ]
+
+    assert format_tree(spans) == "root 10.0ms\n  child 2.0ms ERROR: ValueError: x"
@@ -0,0 +1,28 @@
+import pytest
+
+from src import usage_stats
+from src.usage_stats import PromptCacheStats
+
+
+def test_prompt_cache_stats_per_user_ratios_and_savings(monkeypatch):
+    monkeypatch.setattr(usage_stats, "OPENAI_INPUT_PRICE_PER_1M", 1.0)
+    monkeypatch.setattr(usage_stats, "OPENAI_CACHED_INPUT_PRICE_PER_1M", 0.5)
+    stats = PromptCacheStats()
+
+    stats.record(1, prompt_tokens=1000, cached_tokens=0, latency_seconds=1.0)
+    stats.record(1, prompt_tokens=1000, cached_tokens=800, latency_seconds=0.6)
+    stats.record(2, prompt_tokens=500, cached_tokens=0, latency_seconds=0.5)
+    stats.record(2, prompt_tokens=0, cached_tokens=0, latency_seconds=0.0)  # неудачный вызов
+
+    user = stats.for_user(1)
+    assert user["requests"] == 2
+    assert user["cache_hit_ratio"] == pytest.approx(0.4)
+    assert user["cost_saved_usd"] == pytest.approx(800 * 0.5 / 1_000_000)
+    assert user["avg_latency_saved_seconds"] == pytest.approx(0.4)
+
+    assert stats.for_user(3)["requests"] == 0
+
+    totals = stats.totals()
+    assert totals["users"] == 2
+    assert totals["prompt_tokens"] == 2500
+    assert totals["cache_hit_ratio"] == pytest.approx(800 / 2500)
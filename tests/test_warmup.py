@@ -0,0 +1,19 @@
+from src import warmup
+
+
+def test_warm_up_runs_all_steps_and_survives_failures(monkeypatch):
+    called = []
+
+    def failing_db_pool(connections):
+        called.append(("db_pool", connections))
+        raise RuntimeError("db is down")
+
+    monkeypatch.setattr(warmup, "_warm_db_pool", failing_db_pool)
+    monkeypatch.setattr(warmup, "_warm_tokenizer", lambda: called.append("tokenizer"))
+    monkeypatch.setattr(warmup, "_warm_openai_http", lambda: called.append("openai_http"))
+
+    timings = warmup.warm_up(db_connections=3)
+
+    assert called == [("db_pool", 3), "tokenizer", "openai_http"]
+    assert set(timings) == {"db_pool", "tokenizer", "openai_http"}
+    assert all(seconds >= 0 for seconds in timings.values())
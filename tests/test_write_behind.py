@@ -0,0 +1,176 @@
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.conversation_service import ConversationService
+from src.db import Base, Message
+from src.write_behind import WriteBehindBuffer
+
+
+def create_sqlite_session_factory():
+    # StaticPool: одна in-memory БД для основного потока и потока буфера
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+def make_fake_user(user_id: int = 123) -> SimpleNamespace:
+    return SimpleNamespace(id=user_id, username="testuser", first_name="Test", last_name="User")
+
+
+class FlakySessions:
+    """Фабрика сессий, у которой первые failures вызовов падают как при недоступной БД."""
+
+    def __init__(self, factory, failures):
+        self.factory = factory
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError("INSERT INTO messages", {}, ConnectionError("connection refused"))
+        return self.factory()
+
+
+def stored_contents(SessionFactory):
+    with SessionFactory() as db:
+        return [m.content for m in db.query(Message).order_by(Message.created_at.asc(), Message.id.asc()).all()]
+
+
+def test_history_reads_pending_messages_before_flush():
+    SessionFactory = create_sqlite_session_factory()
+    buffer = WriteBehindBuffer(SessionFactory, autostart=False)
+    service = ConversationService(session_factory=SessionFactory, write_buffer=buffer)
+    tg_user = make_fake_user()
+
+    service.add_user_message(tg_user, "first")
+    service.add_assistant_message(tg_user, "second")
+
+    assert stored_contents(SessionFactory) == []
+    assert [(h.role, h.content) for h in service.get_history(tg_user)] == [("user", "first"), ("assistant", "second")]
+    assert service.get_stats(tg_user)["today_messages"] == 2
+
+    assert buffer.flush() == 2
+    assert stored_contents(SessionFactory) == ["first", "second"]
+    assert [h.content for h in service.get_history(tg_user, limit=1)] == ["second"]
+
+
+def test_flush_inserts_all_users_in_one_commit_and_trims_history():
+    SessionFactory = create_sqlite_session_factory()
+    buffer = WriteBehindBuffer(SessionFactory, keep_last=3, autostart=False)
+    service = ConversationService(session_factory=SessionFactory, write_buffer=buffer)
+    alice, bob = make_fake_user(1), make_fake_user(2)
+
+    commits = []
+    event.listen(SessionFactory.kw["bind"], "commit", lambda conn: commits.append(1))
+
+    for i in range(5):
+        service.add_user_message(alice, f"alice-{i}")
+        service.add_user_message(bob, f"bob-{i}")
+
+    commits.clear()  # пользователи создаются отдельными коммитами
+    assert buffer.flush() == 10
+    assert len(commits) == 1
+
+    with SessionFactory() as db:
+        counts = {uid: db.query(Message).filter(Message.user_id == uid).count() for uid in (1, 2)}
+    assert counts == {1: 3, 2: 3}
+    assert [h.content for h in service.get_history(alice)] == ["alice-2", "alice-3", "alice-4"]
+
+
+def test_clear_history_discards_pending_messages():
+    SessionFactory = create_sqlite_session_factory()
+    buffer = WriteBehindBuffer(SessionFactory, autostart=False)
+    service = ConversationService(session_factory=SessionFactory, write_buffer=buffer)
+    tg_user = make_fake_user()
+
+    service.add_user_message(tg_user, "stored")
+    buffer.flush()
+    service.add_user_message(tg_user, "pending")
+
+    service.clear_history(tg_user)
+    buffer.flush()
+
+    assert stored_contents(SessionFactory) == []
+    assert service.get_history(tg_user) == []
+
+
+def test_daily_limit_counts_pending_tokens(monkeypatch):
+    SessionFactory = create_sqlite_session_factory()
+    buffer = WriteBehindBuffer(SessionFactory, autostart=False)
+    service = ConversationService(session_factory=SessionFactory, write_buffer=buffer)
+    tg_user = make_fake_user()
+
+    monkeypatch.setattr("src.conversation_service.MAX_DAILY_TOKENS", 5000)
+    monkeypatch.setattr("src.conversation_service.count_tokens", lambda content: 3000)
+
+    for i in range(3):
+        service.add_user_message(tg_user, f"big-{i}")
+
+    assert [h.content for h in service.get_history(tg_user)] == ["big-0", "big-1"]
+    assert service.get_remaining_daily_tokens(tg_user) == 0
+
+
+def test_close_flushes_background_buffer():
+    SessionFactory = create_sqlite_session_factory()
+    buffer = WriteBehindBuffer(SessionFactory, flush_interval=10.0)
+    service = ConversationService(session_factory=SessionFactory, write_buffer=buffer)
+    tg_user = make_fake_user()
+
+    service.add_user_message(tg_user, "before shutdown")
+    service.close()
+
+    assert stored_contents(SessionFactory) == ["before shutdown"]
+
+
+def test_poison_row_is_dropped_without_blocking_others():
+    SessionFactory = create_sqlite_session_factory()
+    buffer = WriteBehindBuffer(SessionFactory, autostart=False)
+
+    buffer.add(1, "user", "before", 1)
+    buffer.add(1, "user", None, 1)  # NOT NULL: эту строку не записать никогда
+    buffer.add(2, "user", "after", 1)
+
+    assert buffer.flush() == 2
+    assert buffer.pending_for(1) == [] and buffer.pending_for(2) == []
+    assert stored_contents(SessionFactory) == ["before", "after"]
+
+
+def test_failed_flush_backs_off_and_keeps_messages():
+    SessionFactory = create_sqlite_session_factory()
+    sessions = FlakySessions(SessionFactory, failures=1000)
+    buffer = WriteBehindBuffer(sessions, flush_interval=0.01, max_backoff=10.0)
+
+    buffer.add(1, "user", "waiting", 1)
+    time.sleep(0.5)
+
+    # Без паузы было бы ~50 попыток; с удвоением паузы от 0.01 с — около шести
+    assert sessions.calls <= 7
+    assert [message.content for message in buffer.pending_for(1)] == ["waiting"]
+
+    sessions.failures = 0
+    buffer.close()
+    assert stored_contents(SessionFactory) == ["waiting"]
+
+
+def test_full_buffer_and_closed_buffer_write_directly():
+    SessionFactory = create_sqlite_session_factory()
+    buffer = WriteBehindBuffer(SessionFactory, max_pending=1, autostart=False)
+
+    buffer.add(1, "user", "buffered", 1)
+    buffer.add(1, "user", "overflow", 1)
+    assert stored_contents(SessionFactory) == ["overflow"]
+
+    buffer.close()
+    buffer.add(1, "user", "after close", 1)
+    assert stored_contents(SessionFactory) == ["buffered", "overflow", "after close"]